@@ -1,4 +1,10 @@
 import streamlit as st
+import pandas as pd
+from utils.ingest_jobs import commit_finished_jobs, get_running_jobs
+from utils.watch_folder import WATCH_DIR, sync_watched_folder, poll_watched_folder
+
+# Copy-on-write lets the pages read the datasets in the session state without copying them (see `utils.session_data`)
+pd.set_option("mode.copy_on_write", True)
 
 pages = [
     st.Page(
@@ -24,4 +30,17 @@ pages = [
 ]
 
 page = st.navigation(pages)
+
+# Data is loaded in background jobs, so the user can move to other pages while loading.
+# The results are committed here, whichever page is shown.
+commit_finished_jobs()
+if get_running_jobs():
+    st.sidebar.info(":material/hourglass_top: データを読み込んでいます。完了するとアップロードページに結果が表示されます。")
+
+# Zip files put in the watched folder are loaded on the server and reach every session automatically.
+if WATCH_DIR is not None:
+    sync_watched_folder()
+    with st.sidebar:
+        poll_watched_folder()
+
 page.run()
@@ -1,10 +1,18 @@
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 import pandas as pd
-from io import BytesIO
-import zipfile
 from PIL import Image
 import numpy as np
+import time
+import uuid
+from utils.pos_cleaning import merge_pos_tables
+from utils.pos_schema import compact_pos_tables, get_memory_report
+from utils.pos_state import build_pos_dataset, append_pos_dataset, set_session_state_pos, append_session_state_pos
+from utils.ingest_cache import load_zip_files_cached, hash_file
+from utils.workbook_loader import read_syllabus_workbook, read_calendar_workbook
+from utils.calendar_dimension import SYLLABUS_STORES, build_calendar_dimension
+from utils.watch_folder import WATCH_DIR
+from utils.ingest_jobs import start_job, get_job, is_running, cancel_job, pop_finished_job, check_cancelled, report_progress, set_total
 
 
 #-----------------------------------------Settings-----------------------------------------
@@ -52,6 +60,54 @@ def button_controller(file_uploader_key: str) -> bool:
             return True # disable button
 
 
+@st.fragment(run_every=1)
+def show_job_progress(name: str) -> None:
+    """
+    Show the progress of the background job registered as `name` with a button to cancel it.\\
+    This fragment is rerun every second without rerunning the whole page.
+    When the job has finished, the whole app is rerun so that the result is committed and shown.
+    """
+    job = get_job(name)
+    if job is None or job["status"] != "running":
+        st.rerun()
+    with job["lock"]:
+        done, total, rows = job["progress"]["done"], job["progress"]["total"], job["progress"]["rows"]
+    seconds = time.time() - job["started"]
+    if job["cancel"].is_set():
+        text = "読み込みを中止しています..."
+    elif total == 0:
+        text = f"ファイルを確認しています...（{seconds:.0f}秒）"
+    else:
+        text = f"データを読み込んでいます...（{done}/{total}ファイル、{rows:,}行、{seconds:.0f}秒）"
+    st.progress(done / total if total > 0 else 0.0, text=text)
+    st.button(
+        label="中止する", 
+        key=f"cancel_{name}", 
+        icon=":material/cancel:", 
+        disabled=job["cancel"].is_set(), 
+        on_click=cancel_job, 
+        args=(name,)
+    )
+
+
+def show_job_error(job: dict) -> bool:
+    """
+    Show a message if the finished job has been cancelled or failed, and return `True` in that case.
+    """
+    if job["status"] == "cancelled":
+        st.warning("データの読み込みを中止しました。")
+        return True
+    if job["status"] == "failed":
+        st.error(
+            """
+            データの読み込みに失敗しました。\\
+            データ形式が正しくない可能性があります。
+            """
+        )
+        return True
+    return False
+
+
 #----------------POS----------------
 
 def when_zip_pos_changed() -> None:
@@ -64,148 +120,89 @@ def when_zip_pos_changed() -> None:
     st.session_state["zip_pos_changed"] = True
 
 
-def load_uploaded_zip_pos() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def load_uploaded_zip_pos(job: dict, zip_files: list[UploadedFile], parallel: bool, archive_keys: set[str] | None = None, dataset: dict | None = None) -> dict:
     """
-    Load the uploaded zip files and return DataFrames of checkouts, items, and payments.\\
-    Each file of checktouts,csv, items.csv, and payments.csv is concatenated into a single DataFrame respectively.
+    Load the uploaded zip files in a background job and return a dictionary of the result.\\
+    This function runs outside of the script thread, so it must not touch the session state.\\
+    Zip files that have been uploaded before are loaded from the cache without parsing.\\
+    When `archive_keys` (the hashes of the zip files already added to the session) and `dataset` (the current dataset of the session)
+    are given, it works in the append mode, and only the zip files that have not been added yet are loaded.\\
+    When `parallel` is `True`, the zip files are loaded in parallel with pyarrow's CSV reader.\\
+    The result contains "status" ("ok", "no_new", or "empty"), the hashes of the loaded zip files,
+    the statistics of the loading, and the dataset aggregated in the job (see `utils.pos_state`).
+    In the append mode, it is `dataset` with the new data appended, and the merged DataFrames of the new data are also returned.
     """
-    # load zip files from session state
-    zip_files: list[UploadedFile] = st.session_state["uploaded_zip_pos"]
-    # Initialize empty DataFrames
-    df_checkouts = pd.DataFrame()
-    df_items = pd.DataFrame()
-    df_payments = pd.DataFrame()
-    # checkouts.csv, items.csv, payments.csv, and other trivial files in zip_file
+    keys = []
     for zip_file in zip_files:
-        # Streamlit's UploadedFile is a subclass of BytesIO, so it can be read directly
-        with zipfile.ZipFile(zip_file) as zf:
-            # Load the necessary files: checkouts.csv, items.csv, and payments.csv
-            for file in zf.namelist():
-                if file == "checkouts.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_checkouts = pd.concat([df_checkouts, tmp], axis="index")
-                elif file == "items.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_items = pd.concat([df_items, tmp], axis="index")
-                elif file == "payments.csv":
-                    with zf.open(file) as f:
-                        tmp = pd.read_csv(BytesIO(f.read()), encoding="shift-jis")
-                        # Concatenate with empty or all-NA DataFrame will be deprecated, 
-                        # so if the loaded DataFrame is empty or all-NA, skip it.
-                        if tmp.empty or tmp.isna().all().all():
-                            continue
-                        df_payments = pd.concat([df_payments, tmp], axis="index")
-    return df_checkouts, df_items, df_payments
-
-
-def cleanup_pos(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
-    """
-    Return cleanuped POS data.
-    """
-    # Filter columns
-    df_checkouts = df_checkouts[
-        ["アカウント名", "会計ID", "開始日時", "会計日時", "削除日時", "金額", "客数"]
-    ]
-    df_items = df_items[
-        ["会計ID", "SKU", "バーコード",  "名前", "数量", "金額", "部門"]
-    ]
-    df_payments = df_payments[["会計ID", "支払い方法"]]
-
-    # Drop duplicates
-    df_checkouts = df_checkouts.drop_duplicates()
-    df_items = df_items.drop_duplicates()
-    df_payments = df_payments.drop_duplicates()
-
-    # Delete cancelled records
-    # Non-NA value in "削除日時" means that the record is cancelled
-    cancelled = df_checkouts[["会計ID", "削除日時"]]
-    df_checkouts = df_checkouts[df_checkouts["削除日時"].isna()].drop(columns=["削除日時"])
-    df_items = pd.merge(df_items, cancelled, on="会計ID", how="left")
-    df_items = df_items[df_items["削除日時"].isna()].drop(columns=["削除日時"])
-    df_payments = pd.merge(df_payments, cancelled, on="会計ID", how="left")
-    df_payments = df_payments[df_payments["削除日時"].isna()].drop(columns=["削除日時"])
-
-    # Empty entries in "支払い方法" are change of payment, so remove them
-    df_payments = df_payments[df_payments["支払い方法"].notna()]
-
-    # A negative value in "数量" seems to indicate that the transaction has been cancelled, so remove those records.
-    # While there seems no record with zero value in "数量", remove those records as well.
-    invalid_cnt = df_items.query('数量 <= 0')["会計ID"].to_list()
-    df_checkouts = df_checkouts[~df_checkouts["会計ID"].isin(invalid_cnt)]
-    df_items = df_items[~df_items["会計ID"].isin(invalid_cnt)]
-    df_payments = df_payments[~df_payments["会計ID"].isin(invalid_cnt)]
-
-    # Change the account names to more straightforward ones
-    df_checkouts = df_checkouts.replace({"アカウント名": {"ub396203": "西食堂", "ub396207": "東カフェテリア"}})
-
-    # One-hot encoding on "支払い方法" to cope with multiple payment methods in a single checkout.
-    df_payments = pd.get_dummies(df_payments, columns=["支払い方法"], 
-                                 prefix="", prefix_sep="", dtype="int")
-    df_payments = df_payments.groupby("会計ID").sum().reset_index()
-
-    # Modigy the data types
-    df_checkouts["開始日時"] = pd.to_datetime(df_checkouts["開始日時"]).map(lambda x: x.tz_localize(None))
-    df_checkouts["会計日時"] = pd.to_datetime(df_checkouts["会計日時"]).map(lambda x: x.tz_localize(None))
-    df_checkouts = df_checkouts.astype({"会計ID": "str", "金額": "int", "客数": "int"})
-    df_items = df_items.astype({"会計ID": "str", "SKU": "str", "バーコード": "str", 
-                                "名前": "str", "数量": "int", "金額": "int", "部門": "str"})
-    df_payments = df_payments.astype({"会計ID": "str"})
-
-    # Merge the DataFrames
-    df_customers = pd.merge(df_checkouts, df_payments, on="会計ID", how="inner")
-    df_items = pd.merge(df_customers[["アカウント名", "会計ID", "開始日時", "会計日時"]], df_items, on="会計ID", how="inner")
-
-    return df_customers, df_items
-
-
-def set_session_state_pos(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> None:
-    """
-    Set the session states related with POS data.
-    """
-    # main DataFrames
-    st.session_state["df_customers"] = df_cus
-    st.session_state["df_items"] = df_itm
-
-    # These session states are used to show information about the uploaded POS data
-    st.session_state["west_date_min"] = df_cus.query('アカウント名 == "西食堂"')["開始日時"].min()
-    st.session_state["east_date_min"] = df_cus.query('アカウント名 == "東カフェテリア"')["開始日時"].min()
-    st.session_state["west_date_max"] = df_cus.query('アカウント名 == "西食堂"')["開始日時"].max()
-    st.session_state["east_date_max"] = df_cus.query('アカウント名 == "東カフェテリア"')["開始日時"].max()
-    
-    stores = df_cus["アカウント名"].unique().tolist()
-    if "西食堂" in stores:
-        if "東カフェテリア" in stores:
-            st.session_state["west_pos"] = True
-            st.session_state["east_pos"] = True
-            st.session_state["min_date"] = min(
-                st.session_state["west_date_min"], 
-                st.session_state["east_date_min"]
-            )
-            st.session_state["max_date"] = max(
-                st.session_state["west_date_max"], 
-                st.session_state["east_date_max"]
-            )
+        check_cancelled(job)
+        keys.append(hash_file(zip_file))
+    if archive_keys is not None:
+        new = [i for i, key in enumerate(keys) if key not in archive_keys]
+        zip_files = [zip_files[i] for i in new]
+        keys = [keys[i] for i in new]
+        if not zip_files:
+            return {"status": "no_new", "append": True, "keys": keys}
+    set_total(job, len(zip_files))
+    # Streamlit's UploadedFile is a subclass of BytesIO, so it can be read directly
+    df_checkouts, df_items, df_payments, stats = load_zip_files_cached(
+        zip_files, 
+        parallel=parallel, 
+        keys=keys, 
+        on_progress=lambda rows: report_progress(job, rows)
+    )
+    result = {"status": "empty", "append": archive_keys is not None, "keys": keys, "stats": stats}
+    if df_checkouts.shape[0] > 0:
+        check_cancelled(job)
+        tables = merge_pos_tables(df_checkouts, df_items, df_payments)
+        if archive_keys is None:
+            result["dataset"] = build_pos_dataset(*compact_pos_tables(*tables))
         else:
-            st.session_state["west_pos"] = True
-            st.session_state["east_pos"] = False
-            st.session_state["min_date"] = st.session_state["west_date_min"]
-            st.session_state["max_date"] = st.session_state["west_date_max"]
-    else:
-        if "東カフェテリア" in stores:
-            st.session_state["west_pos"] = False
-            st.session_state["east_pos"] = True
-            st.session_state["min_date"] = st.session_state["east_date_min"]
-            st.session_state["max_date"] = st.session_state["east_date_max"]
+            result["dataset"] = append_pos_dataset(dataset, *tables)
+            # Kept to append again if the data of the session is replaced before the result is committed
+            result["base"] = dataset
+            result["tables"] = tables
+        result["status"] = "ok"
+    return result
+
+
+def commit_zip_pos(result: dict) -> None:
+    """
+    Commit the result of `load_uploaded_zip_pos()` to the session states.\\
+    This function is called in the script thread when the background job has finished.
+    """
+    if "stats" in result:
+        st.session_state["pos_load_stats"] = result["stats"]
+    st.session_state["pos_loaded_keys"] = result["keys"]
+    if result["status"] == "ok":
+        if not result["append"]:
+            set_session_state_pos(result["dataset"])
+        elif st.session_state.get("pos_dataset") is result["base"]:
+            set_session_state_pos(result["dataset"], append=True)
+        else:
+            # The data of the session has been replaced during the job (ex. by the watched folder), so append to the current one
+            append_session_state_pos(*result["tables"])
+        # The uploaded data is no longer replaced by the data of the watched folder
+        stop_following_watch()
+    st.session_state["zip_pos_changed"] = False
+
+
+def stop_following_watch() -> None:
+    """
+    Stop updating the POS data of the session with the data of the watched folder.
+    """
+    st.session_state["watch_follow"] = False
+    st.session_state["watch_version"] = None
+    # The toggle is created again from "watch_follow"
+    st.session_state.pop("toggle_watch_follow", None)
+
+
+def when_watch_follow_changed() -> None:
+    """
+    Switch between the data of the watched folder and the uploaded data.\\
+    The data of the watched folder is copied into the session at the next run by `sync_watched_folder()`.
+    """
+    st.session_state["watch_follow"] = st.session_state["toggle_watch_follow"]
+    st.session_state["watch_version"] = None
 
 
 def get_uploaded_pos_info() -> list[str]:
@@ -240,30 +237,45 @@ def when_syllabus_changed() -> None:
     st.session_state["syllabus_changed"] = True
 
 
-def load_uploaded_syllabus() -> tuple[pd.DataFrame, pd.DataFrame]:
+def load_uploaded_syllabus(job: dict, file: UploadedFile) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Load the uploaded xlsx file of syllabus data and return DataFrames.
+    Load the uploaded xlsx file of syllabus data in a background job and return DataFrames.\\
+    If the file format is not correct, return empty DataFrames.
     """
-    # Load the xlsx file from session state
-    file: UploadedFile = st.session_state["uploaded_syllabus"]
-    # Read xlsx file
-    df_syllabus_west = pd.read_excel(file, sheet_name="west", index_col=[0, 1])
-    df_syllabus_east = pd.read_excel(file, sheet_name="east", index_col=[0, 1])
+    set_total(job, 1)
+    # Both sheets are read from a single parse of the workbook
+    df_syllabus_west, df_syllabus_east = read_syllabus_workbook(file)
+    report_progress(job)
     return df_syllabus_west, df_syllabus_east
 
 
+def commit_syllabus(result: tuple[pd.DataFrame, pd.DataFrame]) -> None:
+    """
+    Commit the result of `load_uploaded_syllabus()` to the session states if it contains valid data.
+    """
+    df_slb_west, df_slb_east = result
+    if not df_slb_west.empty and not df_slb_east.empty:
+        set_session_state_syllabus(df_slb_west, df_slb_east)
+    st.session_state["syllabus_changed"] = False
+
+
 def set_session_state_syllabus(df_slb_west: pd.DataFrame, df_slb_east: pd.DataFrame) -> None:
     """
     Set the session states related with syllabus data.
     """
     st.session_state["df_syllabus_west"] = df_slb_west
     st.session_state["df_syllabus_east"] = df_slb_east
+    # Identifies the syllabus data in the cache of figures (see `utils.query_cache`)
+    st.session_state["syllabus_version"] = uuid.uuid4().hex
 
     terms = ["SPR", "SMR", "AUT", "WTR"]
     west_cols = sorted([[int(col[:4]), terms.index(col[4:]), col] for col in df_slb_west.columns])
     east_cols = sorted([[int(col[:4]), terms.index(col[4:]), col] for col in df_slb_east.columns])
     st.session_state["west_syllabus_range"] = [west_cols[0][2], west_cols[-1][2]]
     st.session_state["east_syllabus_range"] = [east_cols[0][2], east_cols[-1][2]]
+    # The number of students is a part of the date dimension of the calendar
+    if "df_calendar" in st.session_state:
+        set_session_state_calendar_dimension()
 
 
 def get_uploaded_syllabus_info() -> list[str]:
@@ -298,30 +310,49 @@ def when_calendar_changed() -> None:
     st.session_state["calendar_changed"] = True
 
 
-def load_uploaded_calendar() -> pd.DataFrame:
+def load_uploaded_calendar(job: dict, file: UploadedFile) -> pd.DataFrame:
     """
-    Load the uploaded xlsx file of calendar data and return a DataFrame.\\
+    Load the uploaded xlsx file of calendar data in a background job and return a DataFrame.\\
     If the file format is not correct, return an empty DataFrame.
     """
-    # Load the xlsx file from session state
-    file: UploadedFile = st.session_state["uploaded_calendar"]
-    cols = ["date", "academic_year", "term", "class", "info"]
-    df_cal = pd.read_excel(file)
-    for col in df_cal.columns:
-        if col not in cols:
-            return pd.DataFrame()
+    set_total(job, 1)
+    df_cal = read_calendar_workbook(file)
+    report_progress(job)
     return df_cal
 
 
+def commit_calendar(df_cal: pd.DataFrame) -> None:
+    """
+    Commit the result of `load_uploaded_calendar()` to the session states if it contains valid data.
+    """
+    if not df_cal.empty:
+        set_session_state_calendar(df_cal)
+    st.session_state["calendar_changed"] = False
+
+
 def set_session_state_calendar(df_cal: pd.DataFrame) -> None:
     """
     Set the session states related with calendar data.
     """
     st.session_state["df_calendar"] = df_cal
+    # Identifies the calendar data in the cache of figures (see `utils.query_cache`)
+    st.session_state["calendar_version"] = uuid.uuid4().hex
     st.session_state["calendar_range"] = [
         df_cal["date"].min().strftime("%Y/%m/%d"), 
         df_cal["date"].max().strftime("%Y/%m/%d")
     ]
+    set_session_state_calendar_dimension()
+
+
+def set_session_state_calendar_dimension() -> None:
+    """
+    Build the date dimension of the committed calendar data with the committed syllabus data.\\
+    Daily charts look up the calendar and the number of students from it (see `utils.calendar_dimension`).
+    """
+    syllabus = {
+        store: st.session_state[key] for store, key in SYLLABUS_STORES.items() if key in st.session_state
+    }
+    st.session_state["calendar_dimension"] = build_calendar_dimension(st.session_state["df_calendar"], syllabus)
 
 
 def get_uploaded_calendar_info() -> str:
@@ -352,6 +383,14 @@ st.header("データアップロード")
 # Upload POS data
 with st.container(border=True):
     st.subheader(":material/point_of_sale: POSデータ")
+    if WATCH_DIR is not None:
+        st.toggle(
+            label="監視フォルダのデータを使用する", 
+            value=st.session_state.get("watch_follow", True), 
+            key="toggle_watch_follow", 
+            on_change=when_watch_follow_changed, 
+            help=f"サーバーの監視フォルダ（`{WATCH_DIR}`）に置かれた`ZIP`ファイルを自動で読み込みます。ファイルをアップロードすると、アップロードしたデータに切り替わります。"
+        )
     st.file_uploader(
         label="ユビレジからエクスポートした`ZIP`ファイル（`CSV`形式）をアップロードしてください。", 
         type=["zip"], 
@@ -359,29 +398,46 @@ with st.container(border=True):
         key="uploaded_zip_pos", 
         on_change=when_zip_pos_changed
     )
-    if st.button(label="使用するデータを決定する", key="button_pos", disabled=button_controller("uploaded_zip_pos")):
-        with st.spinner("データを読み込んでいます...", show_time=True):
-            try:
-                df_checkouts, df_items, df_payments = load_uploaded_zip_pos()
-                if df_checkouts.shape[0] > 0:
-                    df_cus, df_itm = cleanup_pos(df_checkouts, df_items, df_payments)
-                    set_session_state_pos(df_cus, df_itm)
-                    st.session_state["zip_pos_changed"] = False
-                else:
-                    st.error(
-                        """
-                        データの読み込みに失敗しました。\\
-                        アップロードされたファイルには有効なデータが含まれていません。
-                        """
-                    )
-                    st.session_state["zip_pos_changed"] = False
-            except:
-                st.error(
-                    """
-                    データの読み込みに失敗しました。\\
-                    データ形式が正しくない可能性があります。
-                    """
-                )
+    st.toggle(
+        label="並列読み込み", 
+        value=True, 
+        key="parallel_pos", 
+        help="複数の`ZIP`ファイルを並列に読み込みます。ファイル数が多い場合に高速になります。"
+    )
+    st.radio(
+        label="読み込み方法", 
+        options=["置き換え", "追加"], 
+        index=0, 
+        horizontal=True, 
+        key="pos_mode", 
+        help="「追加」を選択すると、まだ読み込まれていない`ZIP`ファイルのデータのみを現在のデータに追加します。"
+    )
+    if st.button(label="使用するデータを決定する", key="button_pos", disabled=button_controller("uploaded_zip_pos") or is_running("pos")):
+        # Ignore a click while a job is running (the button is disabled only after the next run)
+        if not is_running("pos"):
+            append = st.session_state["pos_mode"] == "追加" and "pos_dataset" in st.session_state
+            start_job(
+                "pos", 
+                load_uploaded_zip_pos, 
+                list(st.session_state["uploaded_zip_pos"]), 
+                st.session_state["parallel_pos"], 
+                set(st.session_state["pos_archive_keys"]) if append else None, 
+                st.session_state["pos_dataset"] if append else None, 
+                on_done=commit_zip_pos
+            )
+    # Progress or result of the background job
+    if is_running("pos"):
+        show_job_progress("pos")
+    elif (job := pop_finished_job("pos")) is not None and not show_job_error(job):
+        if job["result"]["status"] == "no_new":
+            st.info("追加されたファイルはありません。")
+        elif job["result"]["status"] == "empty":
+            st.error(
+                """
+                データの読み込みに失敗しました。\\
+                アップロードされたファイルには有効なデータが含まれていません。
+                """
+            )
     # Information about the uploaded POS data
     messages = get_uploaded_pos_info()
     st.info(
@@ -391,6 +447,30 @@ with st.container(border=True):
          - 東カフェテリア：{messages[1]}
         """
     )
+    # Statistics of the last loading
+    if "pos_load_stats" in st.session_state:
+        stats = st.session_state["pos_load_stats"]
+        # The peak and its increase are measured during the loading (see `measure_peak_memory()`)
+        if stats["peak_memory"] is None:
+            peak_memory = "不明"
+        else:
+            peak_memory = f"{stats['peak_memory'] / 1024**2:,.0f}MB（+{stats['memory_increase'] / 1024**2:,.0f}MB）"
+        st.caption(
+            f"前回の読み込み：{stats['rows']:,}行（{stats['rows_per_sec']:,.0f}行/秒、読み込み中のピークメモリ：{peak_memory}、"
+            f"キャッシュ：{stats['cache_hits']}/{stats['cache_hits'] + stats['cache_misses']}ファイル）"
+        )
+    # Memory usage of the POS data
+    if "df_customers" in st.session_state:
+        with st.expander(":material/memory: メモリ使用量"):
+            df_memory = get_memory_report({
+                "df_customers": st.session_state["df_customers"], 
+                "df_items": st.session_state["df_items"]
+            })
+            st.dataframe(
+                df_memory, 
+                column_config={"メモリ使用量（バイト）": st.column_config.NumberColumn(format="localized")}
+            )
+            st.caption(f"合計：{df_memory['メモリ使用量（バイト）'].sum() / 1024**2:,.1f}MB")
 
 # space
 st.write("")
@@ -405,28 +485,20 @@ with st.container(border=True):
         key="uploaded_syllabus", 
         on_change=when_syllabus_changed
     )
-    if st.button(label="使用するデータを決定する", key="button_syllabus", disabled=button_controller("uploaded_syllabus")):
-        with st.spinner("データを読み込んでいます...", show_time=True):
-            try:
-                df_slb_west, df_slb_east = load_uploaded_syllabus()
-                if not df_slb_west.empty and not df_slb_east.empty:
-                    set_session_state_syllabus(df_slb_west, df_slb_east)
-                    st.session_state["syllabus_changed"] = False
-                else:
-                    st.error(
-                        """
-                        データの読み込みに失敗しました。\\
-                        アップロードしたファイルに有効なデータが含まれていることを確認してください。
-                        """
-                    )
-                    st.session_state["syllabus_changed"] = False
-            except:
-                st.error(
-                    """
-                    データの読み込みに失敗しました。\\
-                    データ形式が正しくない可能性があります。
-                    """
-                )
+    if st.button(label="使用するデータを決定する", key="button_syllabus", disabled=button_controller("uploaded_syllabus") or is_running("syllabus")):
+        if not is_running("syllabus"):
+            start_job("syllabus", load_uploaded_syllabus, st.session_state["uploaded_syllabus"], on_done=commit_syllabus)
+    # Progress or result of the background job
+    if is_running("syllabus"):
+        show_job_progress("syllabus")
+    elif (job := pop_finished_job("syllabus")) is not None and not show_job_error(job):
+        if job["result"][0].empty or job["result"][1].empty:
+            st.error(
+                """
+                データの読み込みに失敗しました。\\
+                アップロードしたファイルに有効なデータが含まれていることを確認してください。
+                """
+            )
     # Information about the uploaded POS data
     messages = get_uploaded_syllabus_info()
     st.info(
@@ -503,28 +575,20 @@ with st.container(border=True):
         key="uploaded_calendar", 
         on_change=when_calendar_changed
     )
-    if st.button(label="使用するデータを決定する", key="button_calendar", disabled=button_controller("uploaded_calendar")):
-        with st.spinner("データを読み込んでいます...", show_time=True):
-            try:
-                df_cal = load_uploaded_calendar()
-                if not df_cal.empty:
-                    set_session_state_calendar(df_cal)
-                    st.session_state["calendar_changed"] = False
-                else:
-                    st.error(
-                        """
-                        データの読み込みに失敗しました。\\
-                        アップロードされたファイルには有効なデータが含まれていません。
-                        """
-                    )
-                    st.session_state["calendar_changed"] = False
-            except:
-                st.error(
-                    """
-                    データの読み込みに失敗しました。\\
-                    データ形式が正しくない可能性があります。
-                    """
-                )
+    if st.button(label="使用するデータを決定する", key="button_calendar", disabled=button_controller("uploaded_calendar") or is_running("calendar")):
+        if not is_running("calendar"):
+            start_job("calendar", load_uploaded_calendar, st.session_state["uploaded_calendar"], on_done=commit_calendar)
+    # Progress or result of the background job
+    if is_running("calendar"):
+        show_job_progress("calendar")
+    elif (job := pop_finished_job("calendar")) is not None and not show_job_error(job):
+        if job["result"].empty:
+            st.error(
+                """
+                データの読み込みに失敗しました。\\
+                アップロードされたファイルには有効なデータが含まれていません。
+                """
+            )
     # Information about the uploaded calendar data
     message = get_uploaded_calendar_info()
     st.info(
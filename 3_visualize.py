@@ -1,9 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
+import time
 from PIL import Image
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from utils.pos_queries import (
+    query_customers_by_slot, query_customers_by_day, query_payment_users, 
+    query_item_sales, query_item_search, query_department_sales, query_department_ranking
+)
+from utils.query_cache import get_query_stats, get_cached_figure, get_figure_cache
+from utils.latency import show_section_latency, show_page_latency
+from utils.session_data import get_dataset
+from utils.exports import show_export
+from utils.downsampling import downsample, get_selected_range, slice_selected_range, show_resolution
+from utils.item_search import SEARCH_RESULTS
+from utils.calendar_dimension import attach_calendar, get_calendar_hovertemplate, get_calendar_meta
 
 
 #-----------------------------------------Settings-----------------------------------------
@@ -26,34 +39,25 @@ st.set_page_config(
     }
 )
 
+# Rendering modes of the time of day chart. In "まとめて", all days are packed into a single WebGL trace,
+# so the size of the chart does not grow with the number of traces. "自動" packs the days from `PACKED_DAYS` days.
+RENDERING_MODES = ["自動", "日ごと", "まとめて"]
+PACKED_DAYS = 15
 
-#-----------------------------------------Functions-----------------------------------------
 
-# Future implementation
-# When `@st.cache_data` is attached to a function, it caches the return in the memory
-# and reuses it until any argument of the function changes.
-# Therefore, `@st.cache_data` is useful for expensive computations.
-# However, as stated above, the function is not executed when the arguments do not change, 
-# so the options in the session state need to be included in the arguments.
-# Otherwise, the function will not be executed when the options are changed.
+#-----------------------------------------Functions-----------------------------------------
 
-
-#------------Universal------------
-
-def convert_for_download(df: pd.DataFrame, index_flag: bool) -> bytes:
-    """
-    Convert the DataFrame to a CSV format encoded in Shift-JIS for download.\\
-    The `index` parameter determines whether to include the index in the CSV.\\
-    The option of `encoding` in `pd.DataFrame.to_csv()` is not supported when `path_or_buf` is `None`.
-    """
-    return df.to_csv(index=index_flag).encode("shift-jis")
+# The functions below load the options from the session state and pass them explicitly to the queries in `utils.pos_queries`.
+# The queries are memoized by the version of the POS data and the options (see `utils.query_cache`),
+# so a rerun with the same options, or another session with the same data, reuses the results.
 
 
 #---Number of customers by time of day---
 
 def process_cus1(df_cus: pd.DataFrame):
     """
-    Filter the DataFrame based on the selected options and return a DataFrame for visualization of number of customers by time of day.\\
+    Return a DataFrame for visualization of number of customers by time of day based on the selected options.\\
+    The numbers are served from the customer tensor aggregated when the data was uploaded.\\
     Return an empty DataFrame if no valid data is found.
     """
     # Load options from session state
@@ -61,72 +65,70 @@ def process_cus1(df_cus: pd.DataFrame):
     span = st.session_state["span1"]
     business_hours = st.session_state["bsh1"]
     store = st.session_state["store1"]
-    # Date inputs
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    # Filter the DataFrame by date and store
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    # Resample the number of customers by span
-    df_cus = df_cus.resample(span, on="開始日時")["客数"].sum()
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
-    else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    # If the sum of customers is zero, there is nothing to visualize, so return an empty DataFrame
-    if df_cus.sum() == 0:
-        return pd.DataFrame()
-    df_cus = df_cus.to_frame()
-    df_cus["日付"] = df_cus.index.date
-    df_cus["時間"] = df_cus.index.time
-    df_cus = df_cus.set_index(["日付", "時間"])
-    df_cus = df_cus.unstack(level=0)
-    df_cus.index = list(map(lambda x: x.strftime("%H:%M"), df_cus.index))
-    df_cus.columns = df_cus.columns.droplevel(0)
-    return df_cus
+    return query_customers_by_slot(st.session_state["pos_version"], st.session_state["customer_tensor"], df_cus, date, store, span, business_hours)
+
+
+def get_slot_times(df_cus_time: pd.DataFrame) -> np.ndarray:
+    """
+    Return the times of the time slots ("HH:MM") in the index as milliseconds since midnight,
+    which are shown as times on a date axis of Plotly.\\
+    Multiples of a minute are exact in float32, so the array is half the size of float64.
+    """
+    minutes = [int(t[:2]) * 60 + int(t[3:]) for t in df_cus_time.index]
+    return (np.array(minutes, dtype="int64") * 60 * 1000).astype("float32")
+
+
+def pack_days(df_cus_time: pd.DataFrame, dates: list[datetime.date]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pack the columns of `dates` into arrays of a single trace:
+    x (time of the slot, see `get_slot_times()`), y (number of customers), and customdata (year, month, and day).\\
+    Days are separated by NaN, so the lines of different days are not connected.
+    All arrays are numeric, so that Plotly sends them as binary arrays instead of strings.
+    """
+    times = get_slot_times(df_cus_time)
+    n_days, n_slots = len(dates), len(times)
+    # A separator is appended to the slots of each day
+    y = np.full((n_days, n_slots + 1), np.nan, dtype="float32")
+    y[:, :n_slots] = df_cus_time[dates].to_numpy(dtype="float32").T
+    x = np.tile(np.append(times, np.float32(np.nan)), n_days)
+    days = np.array([[d.year, d.month, d.day] for d in dates], dtype="int16").reshape(n_days, 3)
+    return x, y.ravel(), np.repeat(days, n_slots + 1, axis=0)
+
+
+def get_percentiles(df_cus_time: pd.DataFrame, dates: list[datetime.date]) -> np.ndarray:
+    """
+    Return the 10th, 50th, and 90th percentiles of the number of customers of `dates` in each time slot.\\
+    Missing slots (ex. before the first checkout) are ignored.
+    """
+    values = df_cus_time[dates].to_numpy(dtype="float64")
+    # Slots missing on all days remain NaN
+    is_missing = np.isnan(values).all(axis=1)
+    percentiles = np.full((3, len(values)), np.nan)
+    percentiles[:, ~is_missing] = np.nanpercentile(values[~is_missing], [10, 50, 90], axis=1)
+    return percentiles
 
 
 #----Total number of customers per day----
 
-def process_cus2(df_cus: pd.DataFrame):
+def process_cus2():
     """
-    Filter the DataFrame based on the selected options and return a DataFrame for visualization of total number of customers per day.\\
+    Return a DataFrame for visualization of total number of customers per day based on the selected options.\\
+    The numbers are served from the customer tensor aggregated when the data was uploaded.\\
     Return an empty DataFrame if no valid data is found.
     """
     # Load options from session state
     date: tuple[datetime.date] = st.session_state["date2"]
     business_hours = st.session_state["bsh2"]
     store = st.session_state["store2"]
-    # Date inputs
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    # Filter the DataFrame by date and store
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    df_cus = df_cus.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
-    else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    df_cus = df_cus.reset_index(drop=False)
-    if df_cus.empty:
-        return pd.DataFrame()
-    df_cus = df_cus.groupby("アカウント名").resample("1D", on="開始日時")["客数"].sum()
-    df_cus = df_cus.to_frame().unstack(level=0)
-    df_cus.columns = df_cus.columns.droplevel(0)
-    return df_cus
+    return query_customers_by_day(st.session_state["pos_version"], st.session_state["customer_tensor"], date, store, business_hours)
 
 
 #---------Ratio of payment methods---------
 
-def filter_pm(df_cus: pd.DataFrame) -> pd.DataFrame:
+def filter_pm() -> pd.DataFrame:
     """
-    Filter the DataFrame and return a DataFrame for visualization of the ratio of payment methods.
+    Return a DataFrame for visualization of the ratio of payment methods based on the selected options.\\
+    The numbers are served from the daily cube aggregated when the data was uploaded.
     It does not exclude records with multiple payment methods, 
     so the sum of the total counts is not necessarily equal to the total number of customers.
     """
@@ -134,29 +136,14 @@ def filter_pm(df_cus: pd.DataFrame) -> pd.DataFrame:
     date = st.session_state["date3"]
     business_hours = st.session_state["bsh3"]
     store = st.session_state["store3"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_cus = df_cus[(left_date <= df_cus["開始日時"]) & (df_cus["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_cus = df_cus.query(f'アカウント名 == "{store}"')
-    df_cus = df_cus.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_cus = df_cus.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_cus = df_cus.between_time("17:30", "19:30")
-    else:
-        df_cus = df_cus.between_time("11:00", "19:30")
-    df_cus = df_cus.reset_index(drop=False)
-    pms = list(set(df_cus.columns) - set(["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数"]))
-    df_pm = df_cus[pms] * df_cus["客数"].values.reshape(-1, 1)
-    df_pm = df_pm.sum(axis="index").to_frame(name="合計利用者数").reset_index(names=["支払い方法"])
-    return df_pm
+    return query_payment_users(st.session_state["pos_version"], st.session_state["daily_cube"], date, store, business_hours)
 
 #--------------Sales by item---------------
 
-def process_itm1(df_itm: pd.DataFrame):
+def process_itm1():
     """
-    Filter the DataFrame based on the selected options and return a DataFrame for visualization of sales by item.\\
+    Return a DataFrame for visualization of sales by item based on the selected options.\\
+    The sales are served from the item matrices aggregated when the data was uploaded.\\
     If no valid data is found, return an empty DataFrame.
     """
     # Load options from session state
@@ -166,36 +153,14 @@ def process_itm1(df_itm: pd.DataFrame):
     aggregation = st.session_state["aggr4"]
     method = st.session_state["mthd4"]
     item = st.session_state["item4"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    if method == "名前":
-        df_itm = df_itm[df_itm["名前"] == item]
-    elif method == "バーコード":
-        df_itm = df_itm[df_itm["バーコード"] == item]
-    elif method == "SKU":
-        df_itm = df_itm[df_itm["SKU"] == item]
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    if df_itm.empty:
-        return pd.DataFrame()
-    df_itm = df_itm.groupby("アカウント名").resample("1D", on="開始日時")[aggregation].sum()
-    df_itm = df_itm.to_frame().unstack(level=0)
-    df_itm.columns = df_itm.columns.droplevel(0)
-    return df_itm
+    return query_item_sales(st.session_state["pos_version"], st.session_state["item_matrices"], method, item, date, store, business_hours, aggregation)
 
 
-def candidates_itm1(df_itm: pd.DataFrame):
+def candidates_itm1():
     """
-    Return a list of possible candidates of items based on the selected options.
+    Return a list of possible candidates of items based on the selected options and the search query.\\
+    Items are searched in the index built when the data was uploaded, and only items sold in the selected period are returned.
+    Prefix matches come first, and then items are ordered by the quantity sold, so the best-selling item comes first.
     """
     # Load options from session state
     date: tuple[datetime.date] = st.session_state["date4"]
@@ -204,32 +169,15 @@ def candidates_itm1(df_itm: pd.DataFrame):
     method = st.session_state["mthd4"]
     if len(date) != 2:
         return []
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    if method == "名前":
-        candidates = df_itm["名前"].unique().tolist()
-    elif method == "バーコード":
-        candidates = df_itm["バーコード"].unique().tolist()
-    elif method == "SKU":
-        candidates = df_itm["SKU"].unique().tolist()
-    return candidates
+    query = st.session_state["search4"]
+    return query_item_search(st.session_state["pos_version"], st.session_state["item_matrices"], method, query, date, store, business_hours)
 
 #------------Sales by department------------
 
-def process_itm2(df_itm: pd.DataFrame):
+def process_itm2():
     """
-    Filter the DataFrame based on the selected options and return a DataFrame for visualization of sales by department.\\
+    Return a DataFrame for visualization of sales by department based on the selected options.\\
+    The sales are served from the daily cube aggregated when the data was uploaded.\\
     If no valid data is found, return an empty DataFrame.
     """
     # Load options from session state
@@ -238,31 +186,13 @@ def process_itm2(df_itm: pd.DataFrame):
     store = st.session_state["store5"]
     aggregation = st.session_state["aggr5"]
     department = st.session_state["dpmt5"]
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm[df_itm["部門"] == department]
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    if df_itm.empty:
-        return pd.DataFrame()
-    df_itm = df_itm.groupby("アカウント名").resample("1D", on="開始日時")[aggregation].sum()
-    df_itm = df_itm.to_frame().unstack(level=0)
-    df_itm.columns = df_itm.columns.droplevel(0)
-    return df_itm
+    return query_department_sales(st.session_state["pos_version"], st.session_state["daily_cube"], department, date, store, business_hours, aggregation)
 
 
-def candidates_itm2(df_itm: pd.DataFrame):
+def candidates_itm2():
     """
-    Return a list of possible candidates of departments based on the selected options.
+    Return a list of possible candidates of departments based on the selected options.\\
+    Departments are ordered by the quantity sold in the selected period.
     """
     # Load options from session state
     date: tuple[datetime.date] = st.session_state["date5"]
@@ -270,21 +200,7 @@ def candidates_itm2(df_itm: pd.DataFrame):
     store = st.session_state["store5"]
     if len(date) != 2:
         return []
-    left_date = pd.Timestamp(date[0])
-    right_date = pd.Timestamp(date[1]) + pd.Timedelta("1D")
-    df_itm = df_itm[(left_date <= df_itm["開始日時"]) & (df_itm["開始日時"] < right_date)]
-    if store == "西食堂" or store == "東カフェテリア":
-        df_itm = df_itm.query(f'アカウント名 == "{store}"')
-    df_itm = df_itm.set_index("開始日時")
-    if business_hours == "昼（11:00～14:00）":
-        df_itm = df_itm.between_time("11:00", "14:00")
-    elif business_hours == "夜（17:30～19:30）":
-        df_itm = df_itm.between_time("17:30", "19:30")
-    else:
-        df_itm = df_itm.between_time("11:00", "19:30")
-    df_itm = df_itm.reset_index(drop=False)
-    candidates = df_itm["部門"].unique().tolist()
-    return candidates
+    return query_department_ranking(st.session_state["pos_version"], st.session_state["daily_cube"], date, store, business_hours)
 
 #---------------Syllabus data---------------
 
@@ -317,8 +233,8 @@ def process_syllabus():
     If no valid data is found, return a list of empty DataFrames.
     """
     # Get syllabus data from session state
-    df_syl_west: pd.DataFrame = st.session_state["df_syllabus_west"].copy()
-    df_syl_east: pd.DataFrame = st.session_state["df_syllabus_east"].copy()
+    df_syl_west = get_dataset("df_syllabus_west")
+    df_syl_east = get_dataset("df_syllabus_east")
     # Get options from session state
     class_period = st.session_state["class_period"]
     year = st.session_state["year"]
@@ -349,6 +265,9 @@ def process_syllabus():
 
 #-----------------------------------------Contents-----------------------------------------
 
+# Time of a full run of the page
+page_start = time.perf_counter()
+
 # logo in the sidebar
 st.logo(favicon, size="large")
 
@@ -360,613 +279,736 @@ if "df_customers" not in st.session_state:
     st.stop() # Stop executing
 
 # Load data from session states
-df_cus = st.session_state["df_customers"].copy()
-df_itm = st.session_state["df_items"].copy()
+df_cus = get_dataset("df_customers")
 # be used to restric the range of date inputs
 min_date = st.session_state["min_date"]
 max_date = st.session_state["max_date"]
 
 # 1. number of customers by time of day
-with st.container(border=True):
-    st.write("##### 1日の時間帯ごとの客数の推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, min_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date1"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/timer: 集計スパン", 
-                options=["5min", "10min", "30min"], 
-                index=0, 
-                accept_new_options=False, 
-                key="span1"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh1"
-            )
-        with col4:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store1"
-            )
-    # Data processing and visualization
+@st.fragment
+def section_cus1() -> None:
+    """
+    Show the section of number of customers by time of day.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
     with st.container(border=True):
-        if len(st.session_state["date1"]) == 2:
-            df_cus_time = process_cus1(df_cus)
-            if not df_cus_time.empty:
-                # Identify dates with no customers (ex. holidays)
-                df_cus_time_sum = df_cus_time.sum(axis="index")
-                exclude_dates = df_cus_time_sum[df_cus_time_sum == 0].index.tolist()
-                # Plotly
-                fig = go.Figure()
-                # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                for date in df_cus_time.columns:
-                    if date.weekday() in [5, 6] or date in exclude_dates:  # Saturday and Sunday
-                        continue
-                    fig.add_trace(go.Scatter(
-                        x=df_cus_time.index, 
-                        y=df_cus_time[date], 
-                        mode="lines+markers", 
-                        name=date.strftime("%Y-%m-%d"), 
-                        line=dict(color=colors[st.session_state["store1"]]), 
-                        marker=dict(size=5), 
-                        hovertemplate="日付: %{meta}<br>時刻: %{x}<br>客数: %{y}人<extra></extra>", 
-                        meta=date.strftime("%Y-%m-%d (%a)"), 
-                        hoverlabel=dict(font=dict(size=15))
-                    ))
-                # Plot average if there are multiple columns
-                if len(df_cus_time.columns) >= 2:
-                    # Calculate the average for only weekdays (excluding weekends)
-                    ave = df_cus_time[
-                        [col for col in df_cus_time.columns if col.weekday() not in [5, 6] and col not in exclude_dates]
-                    ].mean(axis="columns")
-                    fig.add_trace(go.Scatter(
-                        x=df_cus_time.index, 
-                        y=ave, 
-                        mode="lines+markers", 
-                        name="平均", 
-                        line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
-                        marker=dict(size=5), 
-                        hovertemplate="平均<br>時刻: %{x}<br>客数: %{y:.1f}人<extra></extra>", 
-                        hoverlabel=dict(font=dict(size=15))
-                    ))
-                st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date1"]) == 2:
-            st.dataframe(df_cus_time)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_cus_time, index_flag=True), 
-                file_name=f"customers_by_time_{st.session_state['date1'][0]}-{st.session_state['date1'][1]}.csv", 
-                mime="text/csv"
-            )
+        st.write("##### 1日の時間帯ごとの客数の推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.date_input(
+                    label=":material/calendar_month: 日付", 
+                    value=(min_date, min_date), 
+                    min_value=min_date, 
+                    max_value=max_date, 
+                    key="date1"
+                )
+            with col2:
+                st.selectbox(
+                    label=":material/timer: 集計スパン", 
+                    options=["5min", "10min", "30min"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="span1"
+                )
+            with col3:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="bsh1"
+                )
+            with col4:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア"], 
+                    accept_new_options=False, 
+                    index=0, 
+                    key="store1"
+                )
+            col5, col6, _, _ = st.columns(4)
+            with col5:
+                st.selectbox(
+                    label=":material/stacked_line_chart: 描画方法", 
+                    options=RENDERING_MODES, 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="mode1", 
+                    help=f"「まとめて」では全ての日を1本の線にまとめて高速に描画します。「自動」では{PACKED_DAYS}日以上のときにまとめて描画します。"
+                )
+            with col6:
+                st.toggle(
+                    label="パーセンタイル帯（10%・50%・90%）", 
+                    value=False, 
+                    key="band1"
+                )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(st.session_state["date1"]) == 2:
+                df_cus_time = process_cus1(df_cus)
+                if not df_cus_time.empty:
+                    # Identify dates with no customers (ex. holidays)
+                    df_cus_time_sum = df_cus_time.sum(axis="index")
+                    exclude_dates = df_cus_time_sum[df_cus_time_sum == 0].index.tolist()
+                    # Weekdays with customers (excluding weekends and holidays)
+                    dates = [col for col in df_cus_time.columns if col.weekday() not in [5, 6] and col not in exclude_dates]
+                    mode = st.session_state["mode1"]
+                    is_packed = mode == "まとめて" or (mode == "自動" and len(dates) >= PACKED_DAYS)
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "cus1", 
+                        st.session_state["pos_version"], 
+                        st.session_state["date1"], 
+                        st.session_state["span1"], 
+                        st.session_state["bsh1"], 
+                        st.session_state["store1"], 
+                        st.session_state["mode1"], 
+                        st.session_state["band1"]
+                    )
+                    def build_figure() -> go.Figure:
+                        # Plotly
+                        fig = go.Figure()
+                        # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
+                        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
+                        if is_packed:
+                            # All days in a single WebGL trace on the time of day
+                            x, y, customdata = pack_days(df_cus_time, dates)
+                            fig.add_trace(go.Scattergl(
+                                x=x, 
+                                y=y, 
+                                customdata=customdata, 
+                                mode="lines+markers", 
+                                name=f"各日（{len(dates)}日）", 
+                                line=dict(color=colors[st.session_state["store1"]], width=1), 
+                                marker=dict(size=3), 
+                                hovertemplate="日付: %{customdata[0]}-%{customdata[1]:02d}-%{customdata[2]:02d}<br>時刻: %{x|%H:%M}<br>客数: %{y}人<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ))
+                            fig.update_xaxes(type="date", tickformat="%H:%M")
+                            x_slots = get_slot_times(df_cus_time)
+                            hover_time = "%{x|%H:%M}"
+                        else:
+                            for date in dates:
+                                fig.add_trace(go.Scatter(
+                                    x=df_cus_time.index, 
+                                    y=df_cus_time[date], 
+                                    mode="lines+markers", 
+                                    name=date.strftime("%Y-%m-%d"), 
+                                    line=dict(color=colors[st.session_state["store1"]]), 
+                                    marker=dict(size=5), 
+                                    hovertemplate="日付: %{meta}<br>時刻: %{x}<br>客数: %{y}人<extra></extra>", 
+                                    meta=date.strftime("%Y-%m-%d (%a)"), 
+                                    hoverlabel=dict(font=dict(size=15))
+                                ))
+                            x_slots = df_cus_time.index
+                            hover_time = "%{x}"
+                        # Plot the band of percentiles across days. The 90th percentile is filled down to the 10th.
+                        if st.session_state["band1"] and len(dates) >= 2:
+                            percentiles = get_percentiles(df_cus_time, dates)
+                            for values, name, line_color, fill in [
+                                (percentiles[0], "10パーセンタイル", "rgba(0, 0, 0, 0)", "none"), 
+                                (percentiles[2], "90パーセンタイル", "rgba(0, 0, 0, 0)", "tonexty"), 
+                                (percentiles[1], "中央値", "rgba(0, 0, 0, 0.5)", "none")
+                            ]:
+                                fig.add_trace(go.Scatter(
+                                    x=x_slots, 
+                                    y=values, 
+                                    mode="lines", 
+                                    name=name, 
+                                    line=dict(color=line_color), 
+                                    fill=fill, 
+                                    fillcolor="rgba(0, 0, 0, 0.1)", 
+                                    hovertemplate=f"{name}<br>時刻: {hover_time}<br>客数: %{{y:.1f}}人<extra></extra>", 
+                                    hoverlabel=dict(font=dict(size=15))
+                                ))
+                        # Plot average if there are multiple columns
+                        if len(df_cus_time.columns) >= 2:
+                            # Calculate the average for only weekdays (excluding weekends)
+                            ave = df_cus_time[dates].mean(axis="columns")
+                            fig.add_trace(go.Scatter(
+                                x=x_slots, 
+                                y=ave, 
+                                mode="lines+markers", 
+                                name="平均", 
+                                line=dict(color="rgba(0, 0, 0, 1)", dash="dot"), 
+                                marker=dict(size=5), 
+                                hovertemplate=f"平均<br>時刻: {hover_time}<br>客数: %{{y:.1f}}人<extra></extra>", 
+                                hoverlabel=dict(font=dict(size=15))
+                            ))
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
+                    st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
+                else:
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(st.session_state["date1"]) == 2:
+                st.dataframe(df_cus_time)
+                show_export(df_cus_time, file_name=f"customers_by_time_{st.session_state['date1'][0]}-{st.session_state['date1'][1]}", index=True, key="export1")
+        show_section_latency("visualize", start)
+
+
+section_cus1()
 
 # space
 st.write("")
 
 # 2. total number of customers per day
-with st.container(border=True):
-    st.write("##### 1日の合計客数の推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date2"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh2", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store2", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
-            )
-    # Data processing and visualization
+@st.fragment
+def section_cus2() -> None:
+    """
+    Show the section of total number of customers per day.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
     with st.container(border=True):
-        if len(st.session_state["date2"]) == 2:
-            df_cus_day = process_cus2(df_cus)
-            if not df_cus_day.empty:
-                stores = df_cus_day.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_cus_day = pd.merge(
-                        df_cus_day, 
-                        st.session_state["df_calendar"], 
-                        left_index=True, 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_cus_day.index, 
-                            y=df_cus_day[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_cus_day[["academic_year", "term", "class", "info"]].values.tolist(), 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
-                        ))
-                    st.plotly_chart(fig)
+        st.write("##### 1日の合計客数の推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.date_input(
+                    label=":material/calendar_month: 日付", 
+                    value=(min_date, max_date), 
+                    min_value=min_date, 
+                    max_value=max_date, 
+                    key="date2"
+                )
+            with col2:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="bsh2", 
+                    help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                )
+            with col3:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア", "両方"], 
+                    accept_new_options=False, 
+                    index=0, 
+                    key="store2", 
+                    help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
+                )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(st.session_state["date2"]) == 2:
+                df_cus_day = process_cus2()
+                if not df_cus_day.empty:
+                    stores = df_cus_day.columns
+                    # Add more information from the calendar data if available
+                    dimension = st.session_state.get("calendar_dimension")
+                    df_cus_day = attach_calendar(df_cus_day, dimension)
+                    # Rows in the selected range, downsampled for each store
+                    df_range = slice_selected_range(df_cus_day, "chart2")
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "cus2", 
+                        st.session_state["pos_version"], 
+                        st.session_state.get("calendar_version"), 
+                        st.session_state.get("syllabus_version"), 
+                        st.session_state["date2"], 
+                        st.session_state["bsh2"], 
+                        st.session_state["store2"], 
+                        get_selected_range("chart2")
+                    )
+                    def build_figure() -> go.Figure:
+                        # Plotly
+                        fig = go.Figure()
+                        # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
+                        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
+                        for store in stores:
+                            df_store = downsample(df_range, store)
+                            fig.add_trace(go.Scatter(
+                                x=df_store.index, 
+                                y=df_store[store], 
+                                mode="lines+markers", 
+                                marker=dict(size=5), 
+                                name=store, 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人"
+                                     + get_calendar_hovertemplate(dimension, store) + "<extra></extra>", 
+                                meta=get_calendar_meta(dimension, df_store.index, store), 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=colors[store])
+                            ))
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
+                    st.plotly_chart(fig, key="chart2", on_select="rerun", selection_mode="box")
+                    show_resolution(df_cus_day, df_range, fig)
+                # When nothing to show, display a sleeping hamburger
                 else:
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_cus_day.index, 
-                            y=df_cus_day[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<extra></extra>", 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
-                        ))
-                    st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date2"]) == 2:
-            st.dataframe(df_cus_day)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_cus_day, index_flag=True), 
-                file_name=f"customers_per_day_{st.session_state['date2'][0]}-{st.session_state['date2'][1]}.csv", 
-                mime="text/csv"
-            )
-        
-# space
-st.write("")
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(st.session_state["date2"]) == 2:
+                st.dataframe(df_cus_day)
+                show_export(df_cus_day, file_name=f"customers_per_day_{st.session_state['date2'][0]}-{st.session_state['date2'][1]}", index=True, key="export2")
+            
+        show_section_latency("visualize", start)
 
-# 3. ratio of payment methods
-with st.container(border=True):
-    st.write("##### 支払い方法の割合")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date3"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh3", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算して割合を計算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store3", 
-                help="「両方」を選択すると、東西両店舗のデータを合算して割合を計算します。"
-            )
-    # Data processing and visualization
-    with st.container(border=True):
-        if len(st.session_state["date3"]) == 2:
-            df_pm = filter_pm(df_cus)
-            if df_pm["合計利用者数"].sum() != 0:
-                fig = go.Figure()
-                fig.add_trace(go.Pie(
-                    values=df_pm["合計利用者数"], 
-                    labels=df_pm["支払い方法"], 
-                    hovertemplate="支払い方法: %{label}<br>合計利用者数: %{value:,}人<extra></extra>", 
-                    hoverlabel=dict(font=dict(size=15))
-                ))
-                st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date3"]) == 2:
-            st.dataframe(df_pm, hide_index=True)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_pm, index_flag=False), 
-                file_name=f"payments_{st.session_state['date3'][0]}-{st.session_state['date3'][1]}.csv", 
-                mime="text/csv"
-            )
+
+section_cus2()
 
 # space
 st.write("")
 
-# 4. sales by item
-with st.container(border=True):
-    st.write("##### 各商品ごとの売上推移")
-    # Options
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date4"
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh4", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
-            )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store4", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
-            )
-        with col4:
-            st.selectbox(
-                label=":material/calculate: 集計方法", 
-                options=["数量", "金額"], 
-                index=0, 
-                accept_new_options=False,
-                key="aggr4"
-            )
-        with col1:
-            st.selectbox(
-                label=":material/filter_alt: 商品の指定方法", 
-                options=["名前", "バーコード", "SKU"], 
-                index=0, 
-                accept_new_options=False,
-                key="mthd4"
-            )
-        with col2:
-            candidates = candidates_itm1(df_itm)
-            st.selectbox(
-                label=f":material/lunch_dining: {st.session_state['mthd4']}", 
-                options=candidates, 
-                index=0, 
-                accept_new_options=False,
-                key="item4"
-            )
-    # Data processing and visualization
+# 3. ratio of payment methods
+@st.fragment
+def section_pm() -> None:
+    """
+    Show the section of ratio of payment methods.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
     with st.container(border=True):
-        if len(st.session_state["date4"]) == 2:
-            df_sales_itm = process_itm1(df_itm)
-            if not df_sales_itm.empty:
-                stores = df_sales_itm.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_sales_itm = pd.merge(
-                        df_sales_itm, 
-                        st.session_state["df_calendar"], 
-                        left_on = "開始日時", 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_sales_itm.index, 
-                            y=df_sales_itm[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr4"] == "数量" else "%{y:,}円")
-                                 + "<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_sales_itm[["academic_year", "term", "class", "info"]].values.tolist(), 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
+        st.write("##### 支払い方法の割合")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.date_input(
+                    label=":material/calendar_month: 日付", 
+                    value=(min_date, max_date), 
+                    min_value=min_date, 
+                    max_value=max_date, 
+                    key="date3"
+                )
+            with col2:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="bsh3", 
+                    help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算して割合を計算します。"
+                )
+            with col3:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア", "両方"], 
+                    accept_new_options=False, 
+                    index=0, 
+                    key="store3", 
+                    help="「両方」を選択すると、東西両店舗のデータを合算して割合を計算します。"
+                )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(st.session_state["date3"]) == 2:
+                df_pm = filter_pm()
+                if df_pm["合計利用者数"].sum() != 0:
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "pm", 
+                        st.session_state["pos_version"], 
+                        st.session_state["date3"], 
+                        st.session_state["bsh3"], 
+                        st.session_state["store3"]
+                    )
+                    def build_figure() -> go.Figure:
+                        fig = go.Figure()
+                        fig.add_trace(go.Pie(
+                            values=df_pm["合計利用者数"], 
+                            labels=df_pm["支払い方法"], 
+                            hovertemplate="支払い方法: %{label}<br>合計利用者数: %{value:,}人<extra></extra>", 
+                            hoverlabel=dict(font=dict(size=15))
                         ))
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
                     st.plotly_chart(fig)
+                # When nothing to show, display a sleeping hamburger
                 else:
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_sales_itm.index, 
-                            y=df_sales_itm[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr4"] == "数量" else "%{y:,}円")
-                                 + "<extra></extra>", 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
-                        ))
-                    st.plotly_chart(fig)
-            # When nothing to show, display a sleeping hamburger
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date4"]) == 2:
-            tmp = df_sales_itm.rename(columns={
-                    "西食堂": f"{st.session_state['item4']}_西食堂", 
-                    "東カフェテリア": f"{st.session_state['item4']}_東カフェテリア"
-            })
-            st.dataframe(tmp)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(tmp, index_flag=True), 
-                file_name=f"sales_items_{st.session_state['date4'][0]}-{st.session_state['date4'][1]}.csv", 
-                mime="text/csv"
-            )
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(st.session_state["date3"]) == 2:
+                st.dataframe(df_pm, hide_index=True)
+                show_export(df_pm, file_name=f"payments_{st.session_state['date3'][0]}-{st.session_state['date3'][1]}", index=False, key="export3")
+        show_section_latency("visualize", start)
+
+
+section_pm()
 
 # space
 st.write("")
 
-# 5. sales by department
-with st.container(border=True):
-    st.write("##### 各部門ごとの売上推移")
-    # Options
+# 4. sales by item
+@st.fragment
+def section_itm1() -> None:
+    """
+    Show the section of sales by item.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
     with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.date_input(
-                label=":material/calendar_month: 日付", 
-                value=(min_date, max_date), 
-                min_value=min_date, 
-                max_value=max_date, 
-                key="date5"
+        st.write("##### 各商品ごとの売上推移")
+        # Options
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.date_input(
+                    label=":material/calendar_month: 日付", 
+                    value=(min_date, max_date), 
+                    min_value=min_date, 
+                    max_value=max_date, 
+                    key="date4"
                 )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
-                index=0, 
-                accept_new_options=False, 
-                key="bsh5", 
-                help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+            with col2:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="bsh4", 
+                    help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
                 )
-        with col3:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア", "両方"], 
-                accept_new_options=False, 
-                index=0, 
-                key="store5", 
-                help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
+            with col3:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア", "両方"], 
+                    accept_new_options=False, 
+                    index=0, 
+                    key="store4", 
+                    help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
                 )
-        with col4:
-            st.selectbox(
-                label=":material/calculate: 集計方法", 
-                options=["数量", "金額"], 
-                index=0, 
-                accept_new_options=False,
-                key="aggr5"
+            with col4:
+                st.selectbox(
+                    label=":material/calculate: 集計方法", 
+                    options=["数量", "金額"], 
+                    index=0, 
+                    accept_new_options=False,
+                    key="aggr4"
                 )
-        with col1:
-            candidates = candidates_itm2(df_itm)
-            st.selectbox(
-                label=":material/category: 部門", 
-                options=candidates, 
-                index=0, 
-                accept_new_options=False,
-                key="dpmt5"
+            with col1:
+                st.selectbox(
+                    label=":material/filter_alt: 商品の指定方法", 
+                    options=["名前", "バーコード", "SKU"], 
+                    index=0, 
+                    accept_new_options=False,
+                    key="mthd4"
                 )
-    # Data processing and visualization
-    with st.container(border=True):
-        if len(st.session_state["date5"]) == 2:
-            df_sales_dep = process_itm2(df_itm)
-            if not df_sales_dep.empty:
-                stores = df_sales_dep.columns
-                # Add more information from the calendar data if available
-                if "df_calendar" in st.session_state:
-                    df_sales_dep = pd.merge(
-                        df_sales_dep, 
-                        st.session_state["df_calendar"], 
-                        left_on = "開始日時", 
-                        right_on="date", 
-                        how="left"
-                    ).rename(columns={"date": "開始日時"}).set_index("開始日時")
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_sales_dep.index, 
-                            y=df_sales_dep[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
-                                 + "<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>", 
-                            meta=df_sales_dep[["academic_year", "term", "class", "info"]].values.tolist(), 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
-                        ))
-                    st.plotly_chart(fig)
+            with col2:
+                st.text_input(
+                    label=":material/search: 検索", 
+                    value="", 
+                    placeholder=f"{st.session_state['mthd4']}の一部を入力", 
+                    key="search4", 
+                    help=f"入力した文字を含む商品を、前方一致・売上数量の順に上位{SEARCH_RESULTS}件まで候補に表示します。全角・半角は区別しません。"
+                )
+            with col3:
+                candidates = candidates_itm1()
+                st.selectbox(
+                    label=f":material/lunch_dining: {st.session_state['mthd4']}", 
+                    options=candidates, 
+                    index=0, 
+                    accept_new_options=False,
+                    key="item4"
+                )
+        # Data processing and visualization
+        with st.container(border=True):
+            if len(st.session_state["date4"]) == 2:
+                df_sales_itm = process_itm1()
+                if not df_sales_itm.empty:
+                    stores = df_sales_itm.columns
+                    # Add more information from the calendar data if available
+                    dimension = st.session_state.get("calendar_dimension")
+                    df_sales_itm = attach_calendar(df_sales_itm, dimension)
+                    # Rows in the selected range, downsampled for each store
+                    df_range = slice_selected_range(df_sales_itm, "chart4")
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "itm1", 
+                        st.session_state["pos_version"], 
+                        st.session_state.get("calendar_version"), 
+                        st.session_state.get("syllabus_version"), 
+                        st.session_state["date4"], 
+                        st.session_state["bsh4"], 
+                        st.session_state["store4"], 
+                        st.session_state["aggr4"], 
+                        st.session_state["mthd4"], 
+                        st.session_state["item4"], 
+                        get_selected_range("chart4")
+                    )
+                    def build_figure() -> go.Figure:
+                        # Plotly
+                        fig = go.Figure()
+                        # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
+                        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
+                        for store in stores:
+                            df_store = downsample(df_range, store)
+                            fig.add_trace(go.Scatter(
+                                x=df_store.index, 
+                                y=df_store[store], 
+                                mode="lines+markers", 
+                                marker=dict(size=5), 
+                                name=store, 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
+                                     + ("%{y}個" if st.session_state["aggr4"] == "数量" else "%{y:,}円")
+                                     + get_calendar_hovertemplate(dimension, store) + "<extra></extra>", 
+                                meta=get_calendar_meta(dimension, df_store.index, store), 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=colors[store])
+                            ))
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
+                    st.plotly_chart(fig, key="chart4", on_select="rerun", selection_mode="box")
+                    show_resolution(df_sales_itm, df_range, fig)
+                # When nothing to show, display a sleeping hamburger
                 else:
-                    # Plotly
-                    fig = go.Figure()
-                    # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
-                    colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-                    for store in stores:
-                        fig.add_trace(go.Scatter(
-                            x=df_sales_dep.index, 
-                            y=df_sales_dep[store], 
-                            mode="lines+markers", 
-                            marker=dict(size=5), 
-                            name=store, 
-                            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
-                                 + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
-                                 + "<extra></extra>", 
-                            hoverlabel=dict(font=dict(size=15)), 
-                            line=dict(color=colors[store])
-                        ))
-                    st.plotly_chart(fig)
-            else:
-                st.image(sleeping)
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if len(st.session_state["date5"]) == 2:
-            tmp = df_sales_dep.rename(columns={
-                    "西食堂": f"{st.session_state['dpmt5']}_西食堂", 
-                    "東カフェテリア": f"{st.session_state['dpmt5']}_東カフェテリア"
-            })
-            st.dataframe(tmp)
-            st.download_button(
-                label=":material/download: `.csv`でダウンロード", 
-                data=convert_for_download(df_sales_dep, index_flag=False), 
-                file_name=f"sales_department_{st.session_state['date5'][0]}-{st.session_state['date5'][1]}.csv", 
-                mime="text/csv"
-            )
+                    st.image(sleeping)
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if len(st.session_state["date4"]) == 2:
+                tmp = df_sales_itm.rename(columns={
+                        "西食堂": f"{st.session_state['item4']}_西食堂", 
+                        "東カフェテリア": f"{st.session_state['item4']}_東カフェテリア"
+                })
+                st.dataframe(tmp)
+                show_export(tmp, file_name=f"sales_items_{st.session_state['date4'][0]}-{st.session_state['date4'][1]}", index=True, key="export4")
+        show_section_latency("visualize", start)
+
+
+section_itm1()
 
 # space
 st.write("")
 
-# 6. syllabus data
-with st.container(border=True):
-    st.write("##### 曜日ごとの対面講義履修者数")
-    # When syllabus data is not available
-    if "df_syllabus_west" not in st.session_state or "df_syllabus_east" not in st.session_state:
-        with st.container(border=True):
-            st.image(sleeping_no_syllabus)
-    # When syllabus data is available
-    else:
+# 5. sales by department
+@st.fragment
+def section_itm2() -> None:
+    """
+    Show the section of sales by department.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
+    with st.container(border=True):
+        st.write("##### 各部門ごとの売上推移")
         # Options
         with st.container(border=True):
-            st.multiselect(
-                label=":material/school: 時限", 
-                options=["1限", "2限", "3限", "4限", "5限"], 
-                default=["1限", "2限", "3限", "4限", "5限"], 
-                key="class_period"
-            )
-            year_candidates = candidates_syl()
-            st.multiselect(
-                label=":material/event: 年度", 
-                options=year_candidates, 
-                default=year_candidates[0], 
-                max_selections=3, 
-                key="year", 
-                help="最大3つまで選択できます。"
-            )
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.date_input(
+                    label=":material/calendar_month: 日付", 
+                    value=(min_date, max_date), 
+                    min_value=min_date, 
+                    max_value=max_date, 
+                    key="date5"
+                    )
+            with col2:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）", "夜（17:30～19:30）", "昼・夜"], 
+                    index=0, 
+                    accept_new_options=False, 
+                    key="bsh5", 
+                    help="「昼・夜」を選択すると、昼営業と夜営業のデータを合算します。"
+                    )
+            with col3:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア", "両方"], 
+                    accept_new_options=False, 
+                    index=0, 
+                    key="store5", 
+                    help="「両方」を選択すると、東西店舗の各グラフを重ね合わせて可視化します。"
+                    )
+            with col4:
+                st.selectbox(
+                    label=":material/calculate: 集計方法", 
+                    options=["数量", "金額"], 
+                    index=0, 
+                    accept_new_options=False,
+                    key="aggr5"
+                    )
+            with col1:
+                candidates = candidates_itm2()
+                st.selectbox(
+                    label=":material/category: 部門", 
+                    options=candidates, 
+                    index=0, 
+                    accept_new_options=False,
+                    key="dpmt5"
+                    )
         # Data processing and visualization
         with st.container(border=True):
-            df_syl_west, df_syl_east = process_syllabus()
-            if not df_syl_west.empty or not df_syl_east.empty:
-                years = [y[:4] for y in st.session_state["year"]]
-                terms = ["SPR", "SMR", "AUT", "WTR"]
-                titles = ["春学期", "夏学期", "秋学期", "冬学期"]
-                colors = [
-                    [(255, 127, 14), (255, 172, 100), (255, 211, 172)], 
-                    [(0, 104, 201), (107, 176, 241), (181, 219, 255)]
-                ]
-                fig = make_subplots(
-                    rows=2, cols=4, 
-                    subplot_titles=["春学期", "夏学期", "秋学期", "冬学期", "", "", "", ""], 
-                    shared_yaxes=True
-                )
-                # Plotly
-                for n_row, syl in enumerate([df_syl_west, df_syl_east]):
-                    for j, year in enumerate(years):
-                        for i, term in enumerate(terms):
-                            try:
-                                week = syl.loc[:, year + term]
-                                fig.add_trace(go.Bar(
-                                    x=week.index, 
-                                    y=week.values, 
-                                    marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
-                                    hovertemplate="対面講義履修者数: %{y:,}人<extra></extra>", 
-                                    name=year + "年度", 
-                                    showlegend=True if i == 0 else False, 
-                                    hoverlabel=dict(font=dict(size=15))
-                                ), row=n_row+1, col=i+1)
-                            except KeyError:
-                                fig.add_trace(go.Bar(
-                                    x=["月", "火", "水", "木", "金"], 
-                                    y=[0, 0, 0, 0, 0], 
-                                    marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
-                                    hovertemplate="データなし<extra></extra>", 
-                                    name=year + "年度", 
-                                    showlegend=True if i == 0 else False, 
-                                    hoverlabel=dict(font=dict(size=15))
-                                ), row=n_row+1, col=i+1)
-                fig.update_layout(barmode="group")
-                fig.update_yaxes(title_text="西キャンパス", row=1, col=1)
-                fig.update_yaxes(title_text="東キャンパス", row=2, col=1)
-                st.plotly_chart(fig)
-            else:
-                st.image(sleeping)
+            if len(st.session_state["date5"]) == 2:
+                df_sales_dep = process_itm2()
+                if not df_sales_dep.empty:
+                    stores = df_sales_dep.columns
+                    # Add more information from the calendar data if available
+                    dimension = st.session_state.get("calendar_dimension")
+                    df_sales_dep = attach_calendar(df_sales_dep, dimension)
+                    # Rows in the selected range, downsampled for each store
+                    df_range = slice_selected_range(df_sales_dep, "chart5")
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "itm2", 
+                        st.session_state["pos_version"], 
+                        st.session_state.get("calendar_version"), 
+                        st.session_state.get("syllabus_version"), 
+                        st.session_state["date5"], 
+                        st.session_state["bsh5"], 
+                        st.session_state["store5"], 
+                        st.session_state["aggr5"], 
+                        st.session_state["dpmt5"], 
+                        get_selected_range("chart5")
+                    )
+                    def build_figure() -> go.Figure:
+                        # Plotly
+                        fig = go.Figure()
+                        # tab:orange for "西食堂" and tab:blue for "東カフェテリア"
+                        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
+                        for store in stores:
+                            df_store = downsample(df_range, store)
+                            fig.add_trace(go.Scatter(
+                                x=df_store.index, 
+                                y=df_store[store], 
+                                mode="lines+markers", 
+                                marker=dict(size=5), 
+                                name=store, 
+                                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>売上: "
+                                     + ("%{y}個" if st.session_state["aggr5"] == "数量" else "%{y:,}円")
+                                     + get_calendar_hovertemplate(dimension, store) + "<extra></extra>", 
+                                meta=get_calendar_meta(dimension, df_store.index, store), 
+                                hoverlabel=dict(font=dict(size=15)), 
+                                line=dict(color=colors[store])
+                            ))
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
+                    st.plotly_chart(fig, key="chart5", on_select="rerun", selection_mode="box")
+                    show_resolution(df_sales_dep, df_range, fig)
+                else:
+                    st.image(sleeping)
         # Data
         with st.expander("データを見る", expanded=False):
-            tab1, tab2 = st.tabs(["西キャンパス", "東キャンパス"])
-            with tab1:
-                st.dataframe(df_syl_west)
-                st.download_button(
-                    label=":material/download: `.csv`でダウンロード", 
-                    data=convert_for_download(df_syl_west, index_flag=True), 
-                    file_name=f"syllabus_west.csv", 
-                    mime="text/csv"
+            if len(st.session_state["date5"]) == 2:
+                tmp = df_sales_dep.rename(columns={
+                        "西食堂": f"{st.session_state['dpmt5']}_西食堂", 
+                        "東カフェテリア": f"{st.session_state['dpmt5']}_東カフェテリア"
+                })
+                st.dataframe(tmp)
+                show_export(df_sales_dep, file_name=f"sales_department_{st.session_state['date5'][0]}-{st.session_state['date5'][1]}", index=False, key="export5")
+        show_section_latency("visualize", start)
+
+
+section_itm2()
+
+# space
+st.write("")
+
+# 6. syllabus data
+@st.fragment
+def section_syllabus() -> None:
+    """
+    Show the section of syllabus data.\\
+    This fragment is rerun without rerunning the whole page when its options are changed.
+    """
+    start = time.perf_counter()
+    with st.container(border=True):
+        st.write("##### 曜日ごとの対面講義履修者数")
+        # When syllabus data is not available
+        if "df_syllabus_west" not in st.session_state or "df_syllabus_east" not in st.session_state:
+            with st.container(border=True):
+                st.image(sleeping_no_syllabus)
+        # When syllabus data is available
+        else:
+            # Options
+            with st.container(border=True):
+                st.multiselect(
+                    label=":material/school: 時限", 
+                    options=["1限", "2限", "3限", "4限", "5限"], 
+                    default=["1限", "2限", "3限", "4限", "5限"], 
+                    key="class_period"
                 )
-            with tab2:
-                st.dataframe(df_syl_east)
-                st.download_button(
-                    label=":material/download: `.csv`でダウンロード", 
-                    data=convert_for_download(df_syl_east, index_flag=True), 
-                    file_name=f"syllabus_east.csv", 
-                    mime="text/csv"
+                year_candidates = candidates_syl()
+                st.multiselect(
+                    label=":material/event: 年度", 
+                    options=year_candidates, 
+                    default=year_candidates[0], 
+                    max_selections=3, 
+                    key="year", 
+                    help="最大3つまで選択できます。"
                 )
-
+            # Data processing and visualization
+            with st.container(border=True):
+                df_syl_west, df_syl_east = process_syllabus()
+                if not df_syl_west.empty or not df_syl_east.empty:
+                    # The figure is built only if it is not in the cache
+                    figure_key = (
+                        "syllabus", 
+                        st.session_state.get("syllabus_version"), 
+                        tuple(st.session_state["class_period"]), 
+                        tuple(st.session_state["year"])
+                    )
+                    def build_figure() -> go.Figure:
+                        years = [y[:4] for y in st.session_state["year"]]
+                        terms = ["SPR", "SMR", "AUT", "WTR"]
+                        titles = ["春学期", "夏学期", "秋学期", "冬学期"]
+                        colors = [
+                            [(255, 127, 14), (255, 172, 100), (255, 211, 172)], 
+                            [(0, 104, 201), (107, 176, 241), (181, 219, 255)]
+                        ]
+                        fig = make_subplots(
+                            rows=2, cols=4, 
+                            subplot_titles=["春学期", "夏学期", "秋学期", "冬学期", "", "", "", ""], 
+                            shared_yaxes=True
+                        )
+                        # Plotly
+                        for n_row, syl in enumerate([df_syl_west, df_syl_east]):
+                            for j, year in enumerate(years):
+                                for i, term in enumerate(terms):
+                                    try:
+                                        week = syl.loc[:, year + term]
+                                        fig.add_trace(go.Bar(
+                                            x=week.index, 
+                                            y=week.values, 
+                                            marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
+                                            hovertemplate="対面講義履修者数: %{y:,}人<extra></extra>", 
+                                            name=year + "年度", 
+                                            showlegend=True if i == 0 else False, 
+                                            hoverlabel=dict(font=dict(size=15))
+                                        ), row=n_row+1, col=i+1)
+                                    except KeyError:
+                                        fig.add_trace(go.Bar(
+                                            x=["月", "火", "水", "木", "金"], 
+                                            y=[0, 0, 0, 0, 0], 
+                                            marker=dict(color=f"rgba({colors[n_row][j][0]}, {colors[n_row][j][1]}, {colors[n_row][j][2]}, 1)"), 
+                                            hovertemplate="データなし<extra></extra>", 
+                                            name=year + "年度", 
+                                            showlegend=True if i == 0 else False, 
+                                            hoverlabel=dict(font=dict(size=15))
+                                        ), row=n_row+1, col=i+1)
+                        fig.update_layout(barmode="group")
+                        fig.update_yaxes(title_text="西キャンパス", row=1, col=1)
+                        fig.update_yaxes(title_text="東キャンパス", row=2, col=1)
+                        return fig
+                    fig = get_cached_figure(figure_key, build_figure)
+                    st.plotly_chart(fig)
+                else:
+                    st.image(sleeping)
+            # Data
+            with st.expander("データを見る", expanded=False):
+                tab1, tab2 = st.tabs(["西キャンパス", "東キャンパス"])
+                with tab1:
+                    st.dataframe(df_syl_west)
+                    show_export(df_syl_west, file_name="syllabus_west", index=True, key="export_syllabus_west")
+                with tab2:
+                    st.dataframe(df_syl_east)
+                    show_export(df_syl_east, file_name="syllabus_east", index=True, key="export_syllabus_east")
+        show_section_latency("visualize", start)
+
+
+section_syllabus()
+
+# Statistics of the caches of queries and figures
+for name, stats in [("クエリキャッシュ", get_query_stats()), ("グラフキャッシュ", get_query_stats(get_figure_cache()))]:
+    st.caption(
+        f"{name}：ヒット{stats['hits']:,}/{stats['hits'] + stats['misses']:,}回"
+        f"（{stats['entries']:,}件、{stats['nbytes'] / 1024**2:,.1f}MB）"
+    )
+show_page_latency("visualize", page_start)
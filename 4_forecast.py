@@ -1,4 +1,5 @@
 import streamlit as st
+import time
 from PIL import Image
 import pandas as pd
 import numpy as np
@@ -6,6 +7,12 @@ import plotly.graph_objects as go
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import root_mean_squared_error, mean_absolute_percentage_error
 from sklearn.linear_model import LinearRegression
+from utils.pos_filters import get_store_ranges, slice_rows, get_hours_mask
+from utils.latency import show_section_latency, show_page_latency
+from utils.session_data import get_dataset
+from utils.query_cache import cache_query, get_cached_figure
+from utils.exports import show_exports
+from utils.downsampling import downsample, get_selected_range, slice_selected_range, show_resolution
 
 
 #-----------------------------------------Settings-----------------------------------------
@@ -64,19 +71,14 @@ def check_options(store: str):
 
 #----------------Process POS data----------------
 
-def process_pos(df_cus: pd.DataFrame):
+def process_pos(df_cus: pd.DataFrame, store: str):
     """
-    Filter the DataFrame based on the selected options.\\
+    Filter the DataFrame based on the selected store.\\
     Return an empty DataFrame if no valid data is found.
     """
-    # Load option from session state
-    store = st.session_state["forecast_store"]
-    # Filter by store
-    df_cus = df_cus[df_cus["アカウント名"] == store]
-    # Filter by business hours
-    df_cus = df_cus.set_index("開始日時")
-    df_cus = df_cus.between_time("11:00", "14:00")
-    df_cus = df_cus.reset_index(drop=False)
+    # Filter by store and business hours
+    df_cus = slice_rows(df_cus, get_store_ranges(df_cus, store))
+    df_cus = df_cus[get_hours_mask(df_cus, "昼（11:00～14:00）")]
     if df_cus.empty:
         return pd.DataFrame()
     # Resample the DataFrame by day
@@ -178,13 +180,12 @@ def get_last_week_dummy(df_cal: pd.DataFrame) -> list:
 
 def process_calendar(df_cal: pd.DataFrame):
     """
-    Process calendar data.
+    Process calendar data and return a new DataFrame with the columns of features.
     """
-    df_cal["nweek"] = get_nweek(df_cal)
-    df_cal["holiday"] = get_holiday_dummy(df_cal)
-    df_cal["replaced"] = get_replaced_dummy(df_cal)
-    df_cal["first_week"] = get_first_week_dummy(df_cal)
-    df_cal["last_week"] = get_last_week_dummy(df_cal)
+    # Columns are added to a new DataFrame, so the calendar data in the session state is not modified
+    df_cal = df_cal.assign(nweek=get_nweek(df_cal), holiday=get_holiday_dummy(df_cal), replaced=get_replaced_dummy(df_cal))
+    # The dummies of the first and last weeks depend on "nweek"
+    df_cal = df_cal.assign(first_week=get_first_week_dummy(df_cal), last_week=get_last_week_dummy(df_cal))
     return df_cal
 
 
@@ -216,7 +217,7 @@ def concatenate_data(df_cus: pd.DataFrame, df_cal: pd.DataFrame, df_syl: pd.Data
         else:
             syl = float("nan")
         syllabus.append(syl)
-    df_cal["syllabus"] = syllabus
+    df_cal = df_cal.assign(syllabus=syllabus)
     # Gather all DataFrames
     df_main = pd.merge(
         df_cus, df_cal, how="outer", 
@@ -225,6 +226,16 @@ def concatenate_data(df_cus: pd.DataFrame, df_cal: pd.DataFrame, df_syl: pd.Data
     return df_main
 
 
+@cache_query
+def query_forecast_data(version: str, calendar_version: str | None, syllabus_version: str | None, store: str, _df_cus: pd.DataFrame, _df_cal: pd.DataFrame, _df_syl: pd.DataFrame) -> pd.DataFrame:
+    """
+    Process POS data of `store` and calendar data, and gather them with syllabus data into a single DataFrame.\\
+    The result is memoized by the versions of the data and the store (see `utils.query_cache`),
+    so revisiting the page does not process the data again.
+    """
+    return concatenate_data(process_pos(_df_cus, store), process_calendar(_df_cal), _df_syl)
+
+
 def split_data(df_main: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Split the DataFrame into training and prediction sets.
@@ -269,17 +280,11 @@ def callback_on_change():
     st.session_state["model_trained"] = False
 
 
-def convert_for_download(df: pd.DataFrame, index_flag: bool) -> bytes:
-    """
-    Convert the DataFrame to a CSV format encoded in Shift-JIS for download.\\
-    The `index` parameter determines whether to include the index in the CSV.\\
-    The option of `encoding` in `pd.DataFrame.to_csv()` is not supported when `path_or_buf` is `None`.
-    """
-    return df.to_csv(index=index_flag).encode("shift-jis")
-
-
 #-----------------------------------------Contents-----------------------------------------
 
+# Time of a full run of the page
+page_start = time.perf_counter()
+
 # logo in the sidebar
 st.logo(favicon, size="large")
 
@@ -298,198 +303,231 @@ if not_uploaded_files:
     )
     st.stop() # Stop execution
 
-# Initialize session state
-st.session_state["model_trained"] = False
+# Forecast
+@st.fragment
+def section_forecast() -> None:
+    """
+    Show the section of the model and its predictions.\\
+    This fragment is rerun without rerunning the whole page when its options are changed or the model is trained.
+    """
+    start = time.perf_counter()
+    # Initialize session state
+    st.session_state["model_trained"] = False
 
-with st.container(border=True):
-    st.write("##### :material/model_training: モデル構築・予測")
-    # Options and a button
-    with st.container(border=True):
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.selectbox(
-                label=":material/storefront: 店舗", 
-                options=["西食堂", "東カフェテリア"], 
-                index=0, 
-                key="forecast_store", 
-                on_change=callback_on_change
-            )
-        with col2:
-            st.selectbox(
-                label=":material/schedule: 営業時間", 
-                options=["昼（11:00～14:00）"], 
-                index=0, 
-                key="forecast_bsh", 
-                help="夜営業については、一部の会計データがPOSデータに記録されていないため予測できません。"
-            )
-        with col1:
-            st.button(
-                label="学習・予測する", 
-                key="train_predict_button", 
-                help="予測可能な範囲がない場合、学習のみ実行されます。"
-            )
-    # Data preparation
     with st.container(border=True):
-        # Check if the data is available for the selected options
-        if not check_options(st.session_state["forecast_store"]):
-            st.image(sleeping)
-            st.stop()
-        # When all data is ready, load them from session state
-        df_cus: pd.DataFrame = st.session_state["df_customers"].copy()
-        df_cal: pd.DataFrame = st.session_state["df_calendar"].copy()
-        if st.session_state["forecast_store"] == "西食堂":
-            df_syl: pd.DataFrame = st.session_state["df_syllabus_west"].copy()
-        else:
-            df_syl: pd.DataFrame = st.session_state["df_syllabus_east"].copy()     
-        # Process POS data
-        df_cus = process_pos(df_cus)
-        # Process calendar data
-        df_cal = process_calendar(df_cal)
-        # Gather all DataFrames
-        df_main = concatenate_data(df_cus, df_cal, df_syl)
-        if not df_main.empty:
-            # Split data into training and prediction sets
-            yX_tr, X_for_pred = split_data(df_main)
-            if yX_tr.empty:
-                st.image(sleeping_no_training_data)
-                st.stop() # Stop execution 
-        else:
-            st.image(sleeping)
-    # Train model
-    if st.session_state.get("train_predict_button", False):
-        with st.spinner("モデルを学習中...", show_time=True):
-            # Split data into training and validation sets
-            x_tr, x_va, y_tr, y_va = get_train_data(yX_tr)
-            # Train the model
-            model = train_model(np.log(y_tr), x_tr)
-            # Predict
-            y_tr_pred = np.exp(model.predict(x_tr))
-            y_va_pred = np.exp(model.predict(x_va))
-            y_pred = y_tr_pred.tolist() + y_va_pred.tolist()
-            if not X_for_pred.empty:
-                y_pred_future = np.exp(model.predict(X_for_pred)).tolist()
+        st.write("##### :material/model_training: モデル構築・予測")
+        # Options and a button
+        with st.container(border=True):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.selectbox(
+                    label=":material/storefront: 店舗", 
+                    options=["西食堂", "東カフェテリア"], 
+                    index=0, 
+                    key="forecast_store", 
+                    on_change=callback_on_change
+                )
+            with col2:
+                st.selectbox(
+                    label=":material/schedule: 営業時間", 
+                    options=["昼（11:00～14:00）"], 
+                    index=0, 
+                    key="forecast_bsh", 
+                    help="夜営業については、一部の会計データがPOSデータに記録されていないため予測できません。"
+                )
+            with col1:
+                st.button(
+                    label="学習・予測する", 
+                    key="train_predict_button", 
+                    help="予測可能な範囲がない場合、学習のみ実行されます。"
+                )
+        # Data preparation
+        with st.container(border=True):
+            # Check if the data is available for the selected options
+            if not check_options(st.session_state["forecast_store"]):
+                st.image(sleeping)
+                return
+            # When all data is ready, load them from session state
+            df_cus = get_dataset("df_customers")
+            df_cal = get_dataset("df_calendar")
+            if st.session_state["forecast_store"] == "西食堂":
+                df_syl = get_dataset("df_syllabus_west")
             else:
-                y_pred_future = []
-            # Calculate evaluation metrics
-            tr_rmse = root_mean_squared_error(y_tr, y_tr_pred)
-            va_rmse = root_mean_squared_error(y_va, y_va_pred)
-            tr_mape = mean_absolute_percentage_error(y_tr, y_tr_pred)
-            va_mape = mean_absolute_percentage_error(y_va, y_va_pred)
-            # Set session state variable
-            st.session_state["model_trained"] = True
-    # Plot graph
-    with st.container(border=True):
-        colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=yX_tr.index, 
-            y=yX_tr["客数"], 
-            name="実際の客数", 
-            mode="lines+markers", 
-            hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>",
-            hoverlabel=dict(font=dict(size=15)), 
-            meta=yX_tr[["academic_year", "term", "class", "info"]].values.tolist(), 
-            marker=dict(size=5), 
-            line=dict(color=colors[st.session_state["forecast_store"]])
-        ))
-        # Add training range rectangle
-        fig.add_shape(
-            type="rect",
-            xref="x", yref="paper",  
-            x0=yX_tr.index.min(), x1=yX_tr.index.max(), 
-            y0=0, y1=1, 
-            fillcolor="rgba(237, 168, 168, 0.2)", 
-            line_width=0, 
-            label=dict(text="学習範囲", textposition="top center", font=dict(size=15))
-        )
-        # Add predictable range rectangle
-        if not X_for_pred.empty:
-            fig.add_shape(
-                type="rect",
-                xref="x", yref="paper",  
-                x0=X_for_pred.index.min(), x1= X_for_pred.index.max(), 
-                y0=0, y1=1, 
-                fillcolor="LightGreen", 
-                opacity=0.2, 
-                line_width=0, 
-                label=dict(text="予測範囲", textposition="top center", font=dict(size=15))
+                df_syl = get_dataset("df_syllabus_east")
+            # Process and gather all DataFrames, or reuse the result for the same data and store
+            df_main = query_forecast_data(
+                st.session_state["pos_version"], 
+                st.session_state.get("calendar_version"), 
+                st.session_state.get("syllabus_version"), 
+                st.session_state["forecast_store"], 
+                df_cus, 
+                df_cal, 
+                df_syl
             )
-        # Add predicted values
-        if st.session_state.get("model_trained", False):
-            fig.add_trace(go.Scatter(
-                x=yX_tr.index, 
-                y=y_pred, 
-                mode="lines+markers", 
-                marker=dict(size=5), 
-                line=dict(color="rgba(0, 0, 0, 0.3)"), 
-                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>予測値: %{y:,.1f}人<extra></extra>", 
-                hoverlabel=dict(font=dict(size=15)), 
-                name="予測値"
-            ))
-        # Add future predicted values
-        if not X_for_pred.empty and st.session_state.get("model_trained", False):
-            fig.add_trace(go.Scatter(
-                x=X_for_pred.index, 
-                y=y_pred_future, 
-                mode="lines+markers", 
-                marker=dict(size=5), 
-                line=dict(color="rgba(0, 0, 0, 0.3)"), 
-                hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>予測値: %{y:,.1f}人<extra></extra>", 
-                hoverlabel=dict(font=dict(size=15)), 
-                showlegend=False
-            ))
-        st.plotly_chart(fig)
-    # Metrics
-    if st.session_state.get("model_trained", False):
-        st.info(
-            f"""
-            :material/check_circle: 学習済みモデルの評価指標
-             - 学習データにおける平均的な予測誤差：{tr_mape:.1%}（{tr_rmse:.1f}人）
-             - 検証データにおける平均的な予測誤差：{va_mape:.1%}（{va_rmse:.1f}人）
-            """
-        )
-    else:
-        st.info(
-            """
-            :material/check_circle: 学習済みモデルの評価指標
-             - まだモデルが学習されていません。
-            """
-        )
-    # Data
-    with st.expander("データを見る", expanded=False):
-        if st.session_state.get("model_trained", False):
-            if st.session_state["forecast_store"] == "西食堂":
-                store_name = "west"
+            if not df_main.empty:
+                # Split data into training and prediction sets
+                yX_tr, X_for_pred = split_data(df_main)
+                if yX_tr.empty:
+                    st.image(sleeping_no_training_data)
+                    return # Stop execution
             else:
-                store_name = "east"
-            if not X_for_pred.empty:
-                df_pred = pd.DataFrame(
-                    index=yX_tr.index.tolist() + X_for_pred.index.tolist(), 
-                    data={
-                        "実際の客数": yX_tr["客数"].tolist() + [float("nan")] * len(X_for_pred),
-                        "予測値": y_pred + y_pred_future
-                    }
-                ).rename_axis(index="日付")
-                st.dataframe(df_pred)
-                st.download_button(
-                        label=":material/download: `.csv`でダウンロード", 
-                        data=convert_for_download(df_pred, index_flag=True), 
-                        file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{X_for_pred.index.max().strftime("%Y-%m-%d")}.csv", 
-                        mime="text/csv"
+                st.image(sleeping)
+        # Train model
+        if st.session_state.get("train_predict_button", False):
+            with st.spinner("モデルを学習中...", show_time=True):
+                # Split data into training and validation sets
+                x_tr, x_va, y_tr, y_va = get_train_data(yX_tr)
+                # Train the model
+                model = train_model(np.log(y_tr), x_tr)
+                # Predict
+                y_tr_pred = np.exp(model.predict(x_tr))
+                y_va_pred = np.exp(model.predict(x_va))
+                y_pred = y_tr_pred.tolist() + y_va_pred.tolist()
+                if not X_for_pred.empty:
+                    y_pred_future = np.exp(model.predict(X_for_pred)).tolist()
+                else:
+                    y_pred_future = []
+                # Calculate evaluation metrics
+                tr_rmse = root_mean_squared_error(y_tr, y_tr_pred)
+                va_rmse = root_mean_squared_error(y_va, y_va_pred)
+                tr_mape = mean_absolute_percentage_error(y_tr, y_tr_pred)
+                va_mape = mean_absolute_percentage_error(y_va, y_va_pred)
+                # Set session state variable
+                st.session_state["model_trained"] = True
+        # Plot graph
+        with st.container(border=True):
+            colors = {"西食堂": "rgba(255, 127, 14, 0.7)", "東カフェテリア": "rgba(0, 104, 201, 0.7)"}
+            # Rows in the selected range, downsampled for each trace
+            df_range = slice_selected_range(yX_tr, "forecast_chart")
+            # The figure is built only if it is not in the cache
+            figure_key = (
+                "forecast", 
+                st.session_state["pos_version"], 
+                st.session_state.get("calendar_version"), 
+                st.session_state.get("syllabus_version"), 
+                st.session_state["forecast_store"], 
+                st.session_state["forecast_bsh"], 
+                st.session_state["model_trained"], 
+                get_selected_range("forecast_chart")
+            )
+            def build_figure() -> go.Figure:
+                df_actual = downsample(df_range, "客数")
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(
+                    x=df_actual.index, 
+                    y=df_actual["客数"], 
+                    name="実際の客数", 
+                    mode="lines+markers", 
+                    hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>客数: %{y:,}人<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}<extra></extra>",
+                    hoverlabel=dict(font=dict(size=15)), 
+                    meta=df_actual[["academic_year", "term", "class", "info"]].values.tolist(), 
+                    marker=dict(size=5), 
+                    line=dict(color=colors[st.session_state["forecast_store"]])
+                ))
+                # Add training range rectangle
+                fig.add_shape(
+                    type="rect",
+                    xref="x", yref="paper",  
+                    x0=yX_tr.index.min(), x1=yX_tr.index.max(), 
+                    y0=0, y1=1, 
+                    fillcolor="rgba(237, 168, 168, 0.2)", 
+                    line_width=0, 
+                    label=dict(text="学習範囲", textposition="top center", font=dict(size=15))
+                )
+                # Add predictable range rectangle
+                if not X_for_pred.empty:
+                    fig.add_shape(
+                        type="rect",
+                        xref="x", yref="paper",  
+                        x0=X_for_pred.index.min(), x1= X_for_pred.index.max(), 
+                        y0=0, y1=1, 
+                        fillcolor="LightGreen", 
+                        opacity=0.2, 
+                        line_width=0, 
+                        label=dict(text="予測範囲", textposition="top center", font=dict(size=15))
                     )
-            else:
-                df_pred = pd.DataFrame(
-                    index=yX_tr.index, 
-                    data={
-                        "実際の客数": yX_tr["客数"], 
-                        "予測値": y_pred
-                    }
-                ).rename_axis(index="日付")
-                st.dataframe(df_pred)
-                st.download_button(
-                        label=":material/download: `.csv`でダウンロード", 
-                        data=convert_for_download(df_pred, index_flag=True), 
-                        file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{yX_tr.index.max().strftime("%Y-%m-%d")}.csv", 
-                        mime="text/csv"
+                # Add predicted values
+                if st.session_state.get("model_trained", False):
+                    df_pred_tr = downsample(pd.DataFrame({"予測値": y_pred}, index=yX_tr.index).loc[df_range.index], "予測値")
+                    fig.add_trace(go.Scatter(
+                        x=df_pred_tr.index, 
+                        y=df_pred_tr["予測値"], 
+                        mode="lines+markers", 
+                        marker=dict(size=5), 
+                        line=dict(color="rgba(0, 0, 0, 0.3)"), 
+                        hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>予測値: %{y:,.1f}人<extra></extra>", 
+                        hoverlabel=dict(font=dict(size=15)), 
+                        name="予測値"
+                    ))
+                # Add future predicted values
+                if not X_for_pred.empty and st.session_state.get("model_trained", False):
+                    df_pred_future = downsample(
+                        slice_selected_range(pd.DataFrame({"予測値": y_pred_future}, index=X_for_pred.index), "forecast_chart"), 
+                        "予測値"
                     )
-
+                    fig.add_trace(go.Scatter(
+                        x=df_pred_future.index, 
+                        y=df_pred_future["予測値"], 
+                        mode="lines+markers", 
+                        marker=dict(size=5), 
+                        line=dict(color="rgba(0, 0, 0, 0.3)"), 
+                        hovertemplate="日付: %{x|%Y-%m-%d (%a)}<br>予測値: %{y:,.1f}人<extra></extra>", 
+                        hoverlabel=dict(font=dict(size=15)), 
+                        showlegend=False
+                    ))
+                # The shapes span the whole ranges, so the selected range is set explicitly
+                selected = get_selected_range("forecast_chart")
+                if selected is not None:
+                    fig.update_xaxes(range=list(selected))
+                return fig
+            fig = get_cached_figure(figure_key, build_figure)
+            st.plotly_chart(fig, key="forecast_chart", on_select="rerun", selection_mode="box")
+            show_resolution(yX_tr, df_range, fig)
+        # Metrics
+        if st.session_state.get("model_trained", False):
+            st.info(
+                f"""
+                :material/check_circle: 学習済みモデルの評価指標
+                 - 学習データにおける平均的な予測誤差：{tr_mape:.1%}（{tr_rmse:.1f}人）
+                 - 検証データにおける平均的な予測誤差：{va_mape:.1%}（{va_rmse:.1f}人）
+                """
+            )
+        else:
+            st.info(
+                """
+                :material/check_circle: 学習済みモデルの評価指標
+                 - まだモデルが学習されていません。
+                """
+            )
+        # Data
+        with st.expander("データを見る", expanded=False):
+            if st.session_state.get("model_trained", False):
+                if st.session_state["forecast_store"] == "西食堂":
+                    store_name = "west"
+                else:
+                    store_name = "east"
+                if not X_for_pred.empty:
+                    df_pred = pd.DataFrame(
+                        index=yX_tr.index.tolist() + X_for_pred.index.tolist(), 
+                        data={
+                            "実際の客数": yX_tr["客数"].tolist() + [float("nan")] * len(X_for_pred),
+                            "予測値": y_pred + y_pred_future
+                        }
+                    ).rename_axis(index="日付")
+                    st.dataframe(df_pred)
+                    show_exports(df_pred, file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{X_for_pred.index.max().strftime("%Y-%m-%d")}", index=True, key="export_pred")
+                else:
+                    df_pred = pd.DataFrame(
+                        index=yX_tr.index, 
+                        data={
+                            "実際の客数": yX_tr["客数"], 
+                            "予測値": y_pred
+                        }
+                    ).rename_axis(index="日付")
+                    st.dataframe(df_pred)
+                    show_exports(df_pred, file_name=f"pred_{store_name}_{yX_tr.index.min().strftime("%Y-%m-%d")}-{yX_tr.index.max().strftime("%Y-%m-%d")}", index=True, key="export_pred")
+        show_section_latency("forecast", start)
+
+
+section_forecast()
+show_page_latency("forecast", page_start)
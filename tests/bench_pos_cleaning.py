@@ -0,0 +1,61 @@
+import time
+import argparse
+
+import pandas as pd
+
+from utils.pos_cleaning import clean_pos_tables, merge_pos_tables, cleanup_pos
+from tests.ubiregi import make_pos_tables
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Numbers of rows of items benchmarked by default
+ITEM_ROWS = [1_000_000, 10_000_000]
+
+# Average number of items per checkout of the random tables
+ITEMS_PER_CHECKOUT = 2
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Benchmark of the POS cleaning on random tables shaped like the exports of Ubiregi (see `tests.ubiregi`).
+# Run from the root of the repository:
+#   python -m tests.bench_pos_cleaning                      # 1M and 10M rows of items
+#   python -m tests.bench_pos_cleaning --items 1000000 --reference
+# `--reference` also times `cleanup_pos()`, the original implementation, which needs much more time and memory.
+
+
+def run(n_items: int, reference: bool) -> None:
+    """
+    Print the time to clean and merge random tables with about `n_items` rows of items.
+    """
+    tables = make_pos_tables(0, n_items // ITEMS_PER_CHECKOUT, ITEMS_PER_CHECKOUT)
+    rows = sum(len(df) for df in tables)
+    print(f"{len(tables[1]):,} rows of items ({rows:,} rows in total)")
+
+    start = time.perf_counter()
+    df_cus, df_itm = merge_pos_tables(*clean_pos_tables(*tables))
+    seconds = time.perf_counter() - start
+    print(f"  clean_pos_tables + merge_pos_tables: {seconds:8.2f} s ({rows / seconds:,.0f} rows/s)")
+    del df_cus, df_itm
+
+    if reference:
+        start = time.perf_counter()
+        cleanup_pos(*tables)
+        seconds = time.perf_counter() - start
+        print(f"  cleanup_pos (reference):             {seconds:8.2f} s ({rows / seconds:,.0f} rows/s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the POS cleaning on random tables.")
+    parser.add_argument("--items", type=int, nargs="+", default=ITEM_ROWS, help="numbers of rows of items")
+    parser.add_argument("--reference", action="store_true", help="also time cleanup_pos()")
+    args = parser.parse_args()
+    # The app runs with copy-on-write (see `0_streamlit_app.py`)
+    pd.set_option("mode.copy_on_write", True)
+    for n_items in args.items:
+        run(n_items, args.reference)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import pandas as pd
+
+
+# The app runs with copy-on-write (see `0_streamlit_app.py`), so the tests do as well
+pd.set_option("mode.copy_on_write", True)
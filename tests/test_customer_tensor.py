@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from utils.pos_schema import concat_pos_tables
+from utils.customer_tensor import build_customer_tensor, update_customer_tensor
+from tests.test_pos_schema import split_pos_tables
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `update_customer_tensor()` aggregates only the appended customers,
+# and must give the same tensor as `build_customer_tensor()` on the concatenated tables.
+
+
+def assert_tensor_equal(tensor: dict, tensor_expected: dict) -> None:
+    """
+    Assert that two tensors of customers have the same stores, days, and arrays.
+    """
+    assert tensor["stores"] == tensor_expected["stores"]
+    assert tensor["day0"] == tensor_expected["day0"]
+    for name in ["slots", "daily", "checkouts"]:
+        np.testing.assert_array_equal(tensor[name], tensor_expected[name])
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(12))
+def test_update_same_as_build(seed: int) -> None:
+    old, new, _ = split_pos_tables(seed)
+    tensor = build_customer_tensor(old[0])
+    df_cus, _ = concat_pos_tables(*old, *new)
+    assert_tensor_equal(update_customer_tensor(tensor, new[0]), build_customer_tensor(df_cus))
+    # The given tensor is not modified
+    assert_tensor_equal(tensor, build_customer_tensor(old[0]))
+
+
+@pytest.mark.parametrize("empty", ["old", "new"])
+def test_update_empty(empty: str) -> None:
+    old, new, _ = split_pos_tables(0)
+    if empty == "old":
+        old = tuple(df.iloc[:0] for df in old)
+    else:
+        new = tuple(df.iloc[:0] for df in new)
+    df_cus, _ = concat_pos_tables(*old, *new)
+    assert_tensor_equal(update_customer_tensor(build_customer_tensor(old[0]), new[0]), build_customer_tensor(df_cus))
@@ -0,0 +1,139 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.pos_schema import BUSINESS_HOURS, concat_pos_tables
+from utils.pos_filters import BUSINESS_HOURS_OPTIONS, STORES
+from utils.daily_cube import (
+    DEPARTMENT_MEASURES, build_daily_cube, update_daily_cube, get_department_sales, get_department_ranking, get_payment_users
+)
+from tests.test_pos_schema import split_pos_tables
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Options of the charts checked against the reference. "その他" selects all stores and the whole opening hours.
+STORE_OPTIONS = STORES + ["両方"]
+HOURS_OPTIONS = list(BUSINESS_HOURS_OPTIONS) + ["その他"]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `update_daily_cube()` aggregates only the appended data, and must give the same cube as `build_daily_cube()`
+# on the concatenated tables. The charts served from the cube must also be the same as filtering the rows
+# by `between_time()` and resampling them by day, as the pages did before the cube.
+
+
+def assert_cube_equal(cube: dict, cube_expected: dict) -> None:
+    """
+    Assert that two cubes have the same stores, days, labels, and arrays.
+    """
+    assert cube["stores"] == cube_expected["stores"]
+    assert cube["day0"] == cube_expected["day0"]
+    for dim, measures in [("部門", DEPARTMENT_MEASURES), ("支払い方法", ["利用者数"])]:
+        assert cube[dim]["labels"] == cube_expected[dim]["labels"]
+        for measure in measures:
+            np.testing.assert_array_equal(cube[dim][measure], cube_expected[dim][measure])
+
+
+def filter_rows(df: pd.DataFrame, date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return the rows of `df` with "アカウント名" and "開始日時" selected by the options, by `between_time()`.
+    """
+    start, end = BUSINESS_HOURS[BUSINESS_HOURS_OPTIONS.get(business_hours, "open")]
+    df = df.set_index("開始日時").between_time(start, end).reset_index()
+    is_selected = (df["開始日時"] >= pd.Timestamp(date[0])) & (df["開始日時"] < pd.Timestamp(date[1]) + pd.Timedelta("1D"))
+    if store in STORES:
+        is_selected &= df["アカウント名"] == store
+    return df[is_selected].reset_index(drop=True)
+
+
+def join_checkouts(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the items with "アカウント名" and "開始日時" of their checkouts.
+    """
+    rows = df_itm["会計行"].to_numpy()
+    return df_itm.assign(アカウント名=df_cus["アカウント名"].array[rows], 開始日時=df_cus["開始日時"].to_numpy()[rows])
+
+
+def reference_department_sales(df_cus: pd.DataFrame, df_itm: pd.DataFrame, department: str, date: tuple[datetime.date], store: str, business_hours: str, measure: str) -> pd.DataFrame:
+    """
+    Return the daily `measure` of `department` by resampling the items of each store by day.
+    """
+    df = join_checkouts(df_cus, df_itm)
+    df = filter_rows(df[df["部門"] == department], date, store, business_hours)
+    if df.empty:
+        return pd.DataFrame()
+    df = df.groupby("アカウント名", observed=True).resample("1D", on="開始日時")[measure].sum().unstack(level=0)
+    df.columns = df.columns.astype("str")
+    return df
+
+
+def reference_payment_users(df_cus: pd.DataFrame, payment_methods: list[str], date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return the total number of users of each payment method by expanding the bit flags of the selected customers.
+    """
+    df = filter_rows(df_cus, date, store, business_hours)
+    flags = df["支払い方法"].to_numpy().astype("uint64")
+    users = [int(df["客数"][(flags >> np.uint64(m) & np.uint64(1)) > 0].sum()) for m in range(len(payment_methods))]
+    return pd.DataFrame({"支払い方法": payment_methods, "合計利用者数": np.array(users, dtype="int64")})
+
+
+def get_random_dates(df_cus: pd.DataFrame, rng: np.random.Generator) -> tuple[datetime.date]:
+    """
+    Return a random period around the dates of the customers.
+    """
+    first, last = df_cus["開始日時"].min().normalize(), df_cus["開始日時"].max().normalize()
+    dates = sorted(first + pd.Timedelta(days=int(d)) for d in rng.integers(-2, (last - first).days + 3, 2))
+    return dates[0].date(), dates[1].date()
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(12))
+def test_update_same_as_build(seed: int) -> None:
+    old, new, payment_methods = split_pos_tables(seed)
+    df_cus, df_itm = concat_pos_tables(*old, *new)
+    cube = build_daily_cube(*old, payment_methods)
+    assert_cube_equal(update_daily_cube(cube, *new, payment_methods), build_daily_cube(df_cus, df_itm, payment_methods))
+    # The given cube is not modified
+    assert_cube_equal(cube, build_daily_cube(*old, payment_methods))
+
+
+@pytest.mark.parametrize("empty", ["old", "new"])
+def test_update_empty(empty: str) -> None:
+    old, new, payment_methods = split_pos_tables(0)
+    if empty == "old":
+        old = tuple(df.iloc[:0] for df in old)
+    else:
+        new = tuple(df.iloc[:0] for df in new)
+    df_cus, df_itm = concat_pos_tables(*old, *new)
+    cube = update_daily_cube(build_daily_cube(*old, payment_methods), *new, payment_methods)
+    assert_cube_equal(cube, build_daily_cube(df_cus, df_itm, payment_methods))
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_charts_same_as_resample(seed: int) -> None:
+    old, new, payment_methods = split_pos_tables(seed)
+    df_cus, df_itm = concat_pos_tables(*old, *new)
+    cube = update_daily_cube(build_daily_cube(*old, payment_methods), *new, payment_methods)
+    rng = np.random.default_rng(seed)
+    for store in STORE_OPTIONS:
+        for business_hours in HOURS_OPTIONS:
+            date = get_random_dates(df_cus, rng)
+            pd.testing.assert_frame_equal(
+                get_payment_users(cube, date, store, business_hours),
+                reference_payment_users(df_cus, payment_methods, date, store, business_hours)
+            )
+            for department in cube["部門"]["labels"]:
+                for measure in ["数量", "金額"]:
+                    df = get_department_sales(cube, department, date, store, business_hours, measure)
+                    df_expected = reference_department_sales(df_cus, df_itm, department, date, store, business_hours, measure)
+                    pd.testing.assert_frame_equal(df, df_expected, check_dtype=False, check_freq=False)
+            # Departments sold in the period, in descending order of the quantity and then in the order of the labels
+            df = filter_rows(join_checkouts(df_cus, df_itm), date, store, business_hours)
+            totals = df.groupby("部門", observed=True)["数量"].sum()
+            expected = sorted(totals.index, key=lambda x: (-totals[x], cube["部門"]["labels"].index(x)))
+            assert get_department_ranking(cube, date, store, business_hours) == expected
@@ -0,0 +1,133 @@
+import os
+import sys
+import subprocess
+import functools
+
+import pandas as pd
+import pytest
+
+import utils.ingest_cache as ingest_cache
+from utils.pos_loader import load_zip_file, iter_pos_csv_batches
+from utils.pos_cleaning import clean_pos_tables, merge_pos_tables
+from tests.ubiregi import make_pos_tables, write_pos_zip
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Root of the repository, where the subprocesses are run
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Size in bytes of CSV text parsed at once in the tests of the batch mode, small enough to make many batches
+TEST_BATCH_BYTES = 4096
+
+# Numbers of checkouts of the small and large archives of the memory test, and the size of batches there
+MEMORY_CHECKOUTS = [50_000, 200_000]
+MEMORY_BATCH_BYTES = 256 * 1024
+
+# Script run in a subprocess to measure the memory of cleaning an archive in batches.
+# It prints the increase of the resident set size during the cleaning in bytes (see `measure_peak_memory()`),
+# or -1 if it is not available. Only the raw data is measured: `cache_put_batched()` then reads the cleaned tables
+# as a whole, which are the result of the loading and grow with the archive.
+MEMORY_SCRIPT = """
+import sys, zipfile, tempfile
+from utils.pos_loader import measure_peak_memory
+from utils.ingest_cache import write_cleaned_batches
+with tempfile.TemporaryDirectory() as out_dir, zipfile.ZipFile(sys.argv[1]) as zf, measure_peak_memory() as memory:
+    write_cleaned_batches(zf, out_dir)
+print(-1 if memory["peak"] is None else memory["peak"] - memory["start"])
+"""
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Large zip files are cleaned in batches (`cache_put_batched()` and `write_cleaned_batches()`).
+# The results must be the same as cleaning the whole zip file in memory after `merge_pos_tables()`,
+# and the memory usage for the raw data must not grow with the size of the zip file.
+
+
+def sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return `df` sorted by all columns with a new index.
+    """
+    return df.sort_values(list(df.columns), kind="stable").reset_index(drop=True)
+
+
+def measure_batched_memory(path: str) -> int:
+    """
+    Return the increase of the resident set size in bytes while a zip file is cleaned in batches in a new process.
+    """
+    env = dict(os.environ, POSCOPE_BATCH_BYTES=str(MEMORY_BATCH_BYTES))
+    result = subprocess.run(
+        [sys.executable, "-c", MEMORY_SCRIPT, path], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return int(result.stdout.split()[-1])
+
+
+@pytest.fixture
+def batched_cache(tmp_path, monkeypatch):
+    """
+    Use an empty cache in `tmp_path` and clean every zip file in small batches.
+    """
+    monkeypatch.setattr(ingest_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(ingest_cache, "LARGE_ZIP_BYTES", 0)
+    monkeypatch.setattr(ingest_cache, "iter_pos_csv_batches", functools.partial(iter_pos_csv_batches, block_size=TEST_BATCH_BYTES))
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batched_same_as_in_memory(seed: int, tmp_path, batched_cache) -> None:
+    path = tmp_path / "pos.zip"
+    write_pos_zip(path, make_pos_tables(seed, 2000))
+    with open(path, "rb") as f:
+        tables_in_memory = clean_pos_tables(*load_zip_file(f))
+    with open(path, "rb") as f:
+        tables = ingest_cache.cache_put_batched("key", f)
+    # Duplicates between batches are kept until `merge_pos_tables()`
+    for df, df_in_memory in zip(tables, tables_in_memory):
+        pd.testing.assert_frame_equal(sort_rows(df.drop_duplicates()), sort_rows(df_in_memory))
+    df_cus, df_itm = merge_pos_tables(*tables_in_memory)
+    df_cus_batched, df_itm_batched = merge_pos_tables(*tables)
+    assert len(df_cus) > 0 and len(df_itm) > 0
+    pd.testing.assert_frame_equal(sort_rows(df_cus_batched), sort_rows(df_cus))
+    pd.testing.assert_frame_equal(sort_rows(df_itm_batched), sort_rows(df_itm))
+    # The cached entry has the same tables
+    for df, df_cached in zip(tables, ingest_cache.cache_get("key")):
+        pd.testing.assert_frame_equal(df_cached, df)
+
+
+def test_batched_load_zip_files_cached(tmp_path, batched_cache) -> None:
+    paths = []
+    for seed in range(2):
+        paths.append(tmp_path / f"pos_{seed}.zip")
+        write_pos_zip(paths[-1], make_pos_tables(seed, 1000))
+    zip_files = [open(path, "rb") for path in paths]
+    try:
+        *tables, stats = ingest_cache.load_zip_files_cached(zip_files)
+        assert stats["cache_misses"] == 2
+        df_cus, df_itm = merge_pos_tables(*tables)
+        # The second loading reads the cached entries
+        *tables, stats = ingest_cache.load_zip_files_cached(zip_files)
+        assert stats["cache_hits"] == 2
+        df_cus_cached, df_itm_cached = merge_pos_tables(*tables)
+        expected = []
+        for zip_file in zip_files:
+            expected.append(clean_pos_tables(*load_zip_file(zip_file)))
+    finally:
+        for zip_file in zip_files:
+            zip_file.close()
+    df_cus_expected, df_itm_expected = merge_pos_tables(*(pd.concat([t[n] for t in expected], ignore_index=True) for n in range(3)))
+    for df, df_expected in [(df_cus, df_cus_expected), (df_itm, df_itm_expected), (df_cus_cached, df_cus), (df_itm_cached, df_itm)]:
+        pd.testing.assert_frame_equal(sort_rows(df), sort_rows(df_expected))
+
+
+def test_batched_memory_is_flat(tmp_path) -> None:
+    increases = []
+    for n_checkouts in MEMORY_CHECKOUTS:
+        path = str(tmp_path / f"pos_{n_checkouts}.zip")
+        write_pos_zip(path, make_pos_tables(0, n_checkouts))
+        increases.append(measure_batched_memory(path))
+    if min(increases) < 0:
+        pytest.skip("The resident set size is not available on this platform")
+    # The large archive is 4 times as large. Cleaned in memory, it takes about 4 times as much memory.
+    assert increases[1] < 2 * increases[0], [f"{increase / 1024**2:,.0f}MB" for increase in increases]
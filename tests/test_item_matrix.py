@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from utils.pos_schema import concat_pos_tables
+from utils.item_matrix import ITEM_KEYS, ITEM_MEASURES, build_item_matrices, update_item_matrices
+from tests.test_pos_schema import split_pos_tables
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `update_item_matrices()` aggregates only the appended items and indexes only the new labels,
+# and must give the same matrices and search indexes as `build_item_matrices()` on the concatenated tables.
+
+
+def assert_matrices_equal(matrices: dict, matrices_expected: dict) -> None:
+    """
+    Assert that two sets of item matrices have the same rows, entries, and search indexes.
+    """
+    for name in ["stores", "day0", "n_days"]:
+        assert matrices[name] == matrices_expected[name]
+    for key in ITEM_KEYS:
+        matrix, matrix_expected = matrices[key], matrices_expected[key]
+        assert matrix["items"].equals(matrix_expected["items"])
+        for name in ["indptr", "indices"] + ITEM_MEASURES:
+            np.testing.assert_array_equal(matrix[name], matrix_expected[name])
+        index, index_expected = matrix["search"], matrix_expected["search"]
+        assert index["names"] == index_expected["names"]
+        assert index["sorted_names"] == index_expected["sorted_names"]
+        np.testing.assert_array_equal(index["order"], index_expected["order"])
+        assert index["grams"].keys() == index_expected["grams"].keys()
+        for gram, posting in index["grams"].items():
+            np.testing.assert_array_equal(posting, index_expected["grams"][gram])
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(12))
+def test_update_same_as_build(seed: int) -> None:
+    old, new, _ = split_pos_tables(seed)
+    matrices = build_item_matrices(*old)
+    assert_matrices_equal(update_item_matrices(matrices, *new), build_item_matrices(*concat_pos_tables(*old, *new)))
+    # The given matrices are not modified
+    assert_matrices_equal(matrices, build_item_matrices(*old))
+
+
+@pytest.mark.parametrize("empty", ["old", "new"])
+def test_update_empty(empty: str) -> None:
+    old, new, _ = split_pos_tables(0)
+    if empty == "old":
+        old = tuple(df.iloc[:0] for df in old)
+    else:
+        new = tuple(df.iloc[:0] for df in new)
+    assert_matrices_equal(update_item_matrices(build_item_matrices(*old), *new), build_item_matrices(*concat_pos_tables(*old, *new)))
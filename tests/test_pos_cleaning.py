@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.pos_loader import concat_chunks
+from utils.pos_cleaning import clean_pos_tables, merge_pos_tables, cleanup_pos
+from tests.ubiregi import make_pos_tables, split_archives
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Columns of checkouts which `cleanup_pos()` copies into items
+CHECKOUT_COLUMNS = ["アカウント名", "会計ID", "開始日時", "会計日時"]
+
+SEEDS = range(30)
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `clean_pos_tables()` and `merge_pos_tables()` are compared with `cleanup_pos()`, the original implementation,
+# on random tables shaped like the exports of Ubiregi (see `tests.ubiregi`).
+# The order of rows is not part of the contract, so rows are sorted before comparing. Columns and dtypes must be equal.
+
+
+def sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return `df` sorted by all columns with a new index.
+    """
+    return df.sort_values(list(df.columns), kind="stable").reset_index(drop=True)
+
+
+def denormalize_items(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return items of `merge_pos_tables()` with the columns of their checkouts instead of "会計行", as in `cleanup_pos()`.
+    """
+    df_chk = df_cus[CHECKOUT_COLUMNS].take(df_itm["会計行"].to_numpy()).reset_index(drop=True)
+    return pd.concat([df_chk, df_itm.drop(columns=["会計行"])], axis="columns")
+
+
+def assert_same_as_reference(tables: tuple[pd.DataFrame, ...], df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> None:
+    """
+    Assert that customers and items are the same as those of `cleanup_pos()` on the raw `tables`, ignoring the order.
+    """
+    df_cus_ref, df_itm_ref = cleanup_pos(*tables)
+    assert len(df_cus) > 0 and len(df_itm) > 0
+    pd.testing.assert_frame_equal(sort_rows(df_cus), sort_rows(df_cus_ref))
+    pd.testing.assert_frame_equal(sort_rows(denormalize_items(df_cus, df_itm)), sort_rows(df_itm_ref))
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_same_as_cleanup_pos(seed: int) -> None:
+    n_checkouts = int(np.random.default_rng(seed).integers(50, 1000))
+    tables = make_pos_tables(seed, n_checkouts)
+    df_cus, df_itm = merge_pos_tables(*clean_pos_tables(*tables))
+    assert_same_as_reference(tables, df_cus, df_itm)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_archives_cleaned_separately(seed: int) -> None:
+    # Zip files are cleaned one by one (and cached), and merged after concatenating them
+    tables = make_pos_tables(seed, 500)
+    cleaned = [clean_pos_tables(*archive) for archive in split_archives(tables, n_archives=3)]
+    df_cus, df_itm = merge_pos_tables(*(concat_chunks([t[n] for t in cleaned]) for n in range(3)))
+    assert_same_as_reference(tables, df_cus, df_itm)
+
+
+def test_cancelled_records() -> None:
+    df_checkouts = pd.DataFrame({
+        "アカウント名": ["ub396203"] * 4,
+        "会計ID": ["1", "2", "3", "3"],
+        "開始日時": ["2024-04-01 12:00:00 +0900"] * 4,
+        "会計日時": ["2024-04-01 12:01:00 +0900"] * 4,
+        "削除日時": [np.nan, "2024-04-01 12:02:00 +0900", "2024-04-01 12:02:00 +0900", np.nan],
+        "金額": pd.array([500, pd.NA, 600, 700], dtype="Int64"),
+        "客数": pd.array([1, pd.NA, 1, 1], dtype="Int64")
+    })
+    df_items = pd.DataFrame({
+        "会計ID": ["1", "2", "3"],
+        "SKU": ["1000"] * 3,
+        "バーコード": [np.nan] * 3,
+        "名前": ["カレー"] * 3,
+        "数量": pd.array([1, 1, 1], dtype="Int64"),
+        "金額": pd.array([500, 500, 700], dtype="Int64"),
+        "部門": ["丼"] * 3
+    })
+    df_payments = pd.DataFrame({"会計ID": ["1", "2", "3", "3"], "支払い方法": ["現金", "現金", "現金", np.nan]})
+    df_cus, df_itm = merge_pos_tables(*clean_pos_tables(df_checkouts, df_items, df_payments))
+    # "2" is cancelled, and "3" is cancelled and registered again
+    assert df_cus["会計ID"].tolist() == ["1", "3"]
+    assert df_cus["金額"].tolist() == [500, 700]
+    assert df_cus["アカウント名"].tolist() == ["西食堂", "西食堂"]
+    assert df_itm["会計行"].tolist() == [0, 1]
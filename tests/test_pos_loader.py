@@ -0,0 +1,77 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.pos_loader import POS_MEMBERS, read_pos_csv, read_pos_csv_arrow, iter_pos_csv_batches, spool_to_disk
+from tests.ubiregi import make_pos_tables
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Cells read as NA by `pd.read_csv()` which pyarrow's CSV reader does not treat as NA by default
+NA_CELLS = ["None", "<NA>", "NA", "N/A", "n/a", "NaN", "nan", "null", "NULL", "#N/A", ""]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The pandas and pyarrow readers of CSV files in zip files must give the same DataFrames,
+# otherwise the parallel mode and the batch mode clean the same file differently,
+# and the cache keeps the result of whichever engine loaded the file first.
+# Large zip files are read from disk, and only the ones in memory are copied there (`spool_to_disk()`).
+
+
+def to_csv_file(df: pd.DataFrame) -> io.BytesIO:
+    """
+    Return the CSV file of `df` encoded in Shift-JIS, as in the zip files exported from Ubiregi.
+    """
+    f = io.BytesIO()
+    df.to_csv(f, index=False, encoding="shift-jis")
+    f.seek(0)
+    return f
+
+
+def with_na_cells(rng: np.random.Generator, df: pd.DataFrame, p: float = 0.1) -> pd.DataFrame:
+    """
+    Return `df` with random cells replaced by the text of `NA_CELLS`.
+    """
+    df = df.astype("object")
+    for col in df.columns:
+        is_na = rng.random(len(df)) < p
+        df.loc[is_na, col] = rng.choice(NA_CELLS, is_na.sum())
+    return df
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("member", list(POS_MEMBERS))
+def test_arrow_same_as_pandas(seed: int, member: str) -> None:
+    rng = np.random.default_rng(seed)
+    df = make_pos_tables(seed, 500)[list(POS_MEMBERS).index(member)]
+    df = with_na_cells(rng, df)
+    dtypes = POS_MEMBERS[member]
+    df_expected = read_pos_csv(to_csv_file(df), dtypes)
+    assert df_expected.isna().any().all()
+    pd.testing.assert_frame_equal(read_pos_csv_arrow(to_csv_file(df), dtypes), df_expected)
+    batches = list(iter_pos_csv_batches(to_csv_file(df), dtypes, block_size=4096))
+    assert len(batches) > 1
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), df_expected)
+
+
+def test_spool_only_in_memory(tmp_path) -> None:
+    path = tmp_path / "pos.zip"
+    path.write_bytes(b"zip")
+    with open(path, "rb") as f, spool_to_disk(f) as spooled:
+        assert spooled == str(path)
+    # Uploaded files have the name of the file on the client, which may exist in the working directory
+    f = io.BytesIO(b"zip")
+    f.name = str(path)
+    with spool_to_disk(f) as spooled:
+        assert spooled != str(path)
+        with open(spooled, "rb") as tmp:
+            assert tmp.read() == b"zip"
+    assert not os.path.exists(spooled)
+    assert path.exists()
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.pos_cleaning import clean_pos_tables, merge_pos_tables
+from utils.pos_schema import (
+    CATEGORICAL_COLUMNS, ROW_DTYPE, compact_pos_tables, sort_pos_tables, concat_categorical, concat_pos_tables, take_customers
+)
+from tests.ubiregi import make_pos_tables
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `concat_pos_tables()` merges the sorted new rows into the existing ones,
+# and must give the same tables as sorting the concatenated tables by `sort_pos_tables()`.
+
+
+def split_pos_tables(seed: int) -> tuple[tuple[pd.DataFrame, pd.DataFrame], tuple[pd.DataFrame, pd.DataFrame], list[str]]:
+    """
+    Return random compact tables of customers and items split into the existing ones and new ones,
+    and the payment methods of the bit flags in "支払い方法" of both.\\
+    Depending on `seed`, the new customers are random ones, include stores which the existing ones do not have,
+    or are later in time, and some start times are equal.
+    """
+    rng = np.random.default_rng(seed)
+    df_cus, df_itm = merge_pos_tables(*clean_pos_tables(*make_pos_tables(seed, int(rng.integers(10, 800)))))
+    if seed % 3 == 0:
+        df_cus = df_cus.assign(開始日時=df_cus["開始日時"].dt.floor("h"))
+    if seed % 3 == 1:
+        is_new = (df_cus["アカウント名"] != "西食堂").to_numpy() | (rng.random(len(df_cus)) < 0.1)
+    elif seed % 3 == 2:
+        is_new = (df_cus["開始日時"] >= df_cus["開始日時"].quantile(0.7)).to_numpy()
+    else:
+        is_new = rng.random(len(df_cus)) < 0.5
+    df_cus_old, df_itm_old, payment_methods = compact_pos_tables(*take_customers(df_cus, df_itm, ~is_new))
+    df_cus_new, df_itm_new, payment_methods = compact_pos_tables(*take_customers(df_cus, df_itm, is_new), payment_methods=payment_methods)
+    return (df_cus_old, df_itm_old), (df_cus_new, df_itm_new), payment_methods
+
+
+def sort_concatenated(df_cus: pd.DataFrame, df_itm: pd.DataFrame, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return the tables concatenated and sorted again as a whole by `sort_pos_tables()`.
+    """
+    df_itm_new = df_itm_new.assign(会計行=(df_itm_new["会計行"] + len(df_cus)).astype(ROW_DTYPE))
+    df_cus = concat_categorical([df_cus, df_cus_new], CATEGORICAL_COLUMNS["customers"])
+    df_itm = concat_categorical([df_itm, df_itm_new], CATEGORICAL_COLUMNS["items"])
+    return sort_pos_tables(df_cus, df_itm)
+
+
+#-------------Tests-------------
+
+@pytest.mark.parametrize("seed", range(30))
+def test_concat_same_as_sort(seed: int) -> None:
+    old, new, _ = split_pos_tables(seed)
+    df_cus, df_itm = concat_pos_tables(*old, *new)
+    df_cus_expected, df_itm_expected = sort_concatenated(*old, *new)
+    pd.testing.assert_frame_equal(df_cus, df_cus_expected)
+    pd.testing.assert_frame_equal(df_itm, df_itm_expected)
+
+
+@pytest.mark.parametrize("empty", ["old", "new"])
+def test_concat_empty(empty: str) -> None:
+    old, new, _ = split_pos_tables(0)
+    if empty == "old":
+        old = tuple(df.iloc[:0] for df in old)
+    else:
+        new = tuple(df.iloc[:0] for df in new)
+    df_cus, df_itm = concat_pos_tables(*old, *new)
+    df_cus_expected, df_itm_expected = sort_concatenated(*old, *new)
+    pd.testing.assert_frame_equal(df_cus, df_cus_expected)
+    pd.testing.assert_frame_equal(df_itm, df_itm_expected)
@@ -0,0 +1,147 @@
+import zipfile
+from typing import IO
+
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Values drawn for the random tables. "ub000000" is an account without a straightforward name.
+ACCOUNTS = ["ub396203", "ub396207", "ub000000"]
+NAMES = ["カレー", "ラーメン", "うどん", "定食A", "定食B", "サラダ", "みそ汁", "ライス大", "ライス小", "からあげ"]
+DEPARTMENTS = ["麺類", "丼", "定食", "サイド", "ドリンク"]
+PAYMENT_METHODS = ["現金", "交通系IC", "QR決済", "クレジット", "学生証"]
+# Codes are drawn from pools of strings, so large tables share the string objects
+SKUS = np.array([str(1000 + i) for i in range(100)], dtype=object)
+BARCODES = np.array([str(4900000000000 + i) for i in range(100)], dtype=object)
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Random tables shaped like checkouts.csv, items.csv, and payments.csv exported from Ubiregi,
+# with the dtypes of `utils.pos_loader` (strings with NaN and nullable integers).
+# They contain what the cleaning has to handle: cancelled checkouts, checkouts cancelled and registered again,
+# invalid quantities, empty payment methods, items and payments without checkouts,
+# checkouts without items or payments, exact duplicates of rows, and shuffled rows.
+
+
+def format_datetime(values: np.ndarray, slash: bool) -> np.ndarray:
+    """
+    Return datetime64 values as strings like "2024-04-01 12:00:00 +0900" (or "2024/04/01 ..." if `slash`).
+    """
+    text = pd.Series(np.datetime_as_string(values, unit="s")).str.replace("T", " ", regex=False)
+    if slash:
+        text = text.str.replace("-", "/", regex=False)
+    return (text + " +0900").to_numpy(dtype=object)
+
+
+def with_missing(rng: np.random.Generator, values: np.ndarray, p: float) -> np.ndarray:
+    """
+    Return an object array of `values` with NaN at the fraction `p` of the positions.
+    """
+    values = values.astype(object)
+    values[rng.random(len(values)) < p] = np.nan
+    return values
+
+
+def shuffle_with_duplicates(rng: np.random.Generator, df: pd.DataFrame, p: float = 0.05) -> pd.DataFrame:
+    """
+    Return `df` with the fraction `p` of its rows duplicated, in random order.
+    """
+    df = pd.concat([df, df.iloc[rng.integers(0, len(df), int(len(df) * p))]], ignore_index=True) if len(df) else df
+    return df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+
+
+def make_pos_tables(seed: int, n_checkouts: int, items_per_checkout: int = 2) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Return random DataFrames of checkouts, items, and payments with about `n_checkouts` checkouts
+    and `items_per_checkout` items per checkout on average.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_checkouts
+    # Some exports write dates with slashes
+    slash = bool(rng.random() < 0.3)
+    ids = (rng.permutation(n) + 10**9).astype(str).astype(object)
+    start = np.datetime64("2024-04-01T11:00:00") + rng.integers(0, 365, n) * np.timedelta64(1, "D") \
+        + rng.integers(0, 9 * 3600, n) * np.timedelta64(1, "s")
+    end = start + rng.integers(5, 300, n) * np.timedelta64(1, "s")
+    kind = rng.random(n)
+    is_cancelled = kind < 0.04
+    is_edited = (0.04 <= kind) & (kind < 0.07)
+
+    # Checkouts: cancelled ones have "削除日時" and may have empty numbers
+    deleted = np.where(is_cancelled, format_datetime(end + np.timedelta64(60, "s"), slash), np.nan)
+    amounts = rng.integers(100, 2000, n).astype(float)
+    amounts[is_cancelled & (rng.random(n) < 0.5)] = np.nan
+    df_checkouts = pd.DataFrame({
+        "アカウント名": rng.choice(np.array(ACCOUNTS, dtype=object), n, p=[0.45, 0.45, 0.1]),
+        "会計ID": ids,
+        "開始日時": format_datetime(start, slash),
+        "会計日時": format_datetime(end, slash),
+        "削除日時": deleted,
+        "金額": pd.array(amounts, dtype="Int64"),
+        "客数": pd.array(rng.integers(1, 4, n), dtype="Int64")
+    })
+    # Checkouts cancelled and registered again have both a cancelled record and a valid one
+    df_edited = df_checkouts[is_edited].assign(
+        削除日時=format_datetime(end[is_edited] + np.timedelta64(30, "s"), slash),
+        金額=pd.array(rng.integers(100, 2000, int(is_edited.sum())), dtype="Int64")
+    )
+    df_checkouts = pd.concat([df_checkouts, df_edited], ignore_index=True)
+
+    # Items: checkouts have 0 or more items, and some items have no checkout
+    counts = rng.poisson(items_per_checkout, n)
+    item_ids = np.repeat(ids, counts)
+    orphans = (rng.permutation(max(n // 100, 1)) + 2 * 10**9).astype(str).astype(object)
+    item_ids = np.concatenate([item_ids, orphans])
+    m = len(item_ids)
+    quantities = rng.integers(1, 4, m)
+    quantities[rng.random(m) < 0.01] = rng.choice([0, -1])
+    df_items = pd.DataFrame({
+        "会計ID": item_ids,
+        "SKU": with_missing(rng, SKUS[rng.integers(0, len(SKUS), m)], 0.03),
+        "バーコード": with_missing(rng, BARCODES[rng.integers(0, len(BARCODES), m)], 0.2),
+        "名前": rng.choice(np.array(NAMES, dtype=object), m),
+        "数量": pd.array(quantities, dtype="Int64"),
+        "金額": pd.array(rng.integers(100, 800, m), dtype="Int64"),
+        "部門": with_missing(rng, rng.choice(np.array(DEPARTMENTS, dtype=object), m), 0.02)
+    })
+
+    # Payments: checkouts have 0 to 2 methods, and empty methods are changes of payment
+    counts = rng.choice([0, 1, 2], n, p=[0.03, 0.77, 0.2])
+    payment_ids = np.concatenate([np.repeat(ids, counts), orphans])
+    df_payments = pd.DataFrame({
+        "会計ID": payment_ids,
+        "支払い方法": with_missing(rng, rng.choice(np.array(PAYMENT_METHODS, dtype=object), len(payment_ids)), 0.05)
+    })
+
+    return tuple(shuffle_with_duplicates(rng, df) for df in (df_checkouts, df_items, df_payments))
+
+
+def split_archives(tables: tuple[pd.DataFrame, ...], n_archives: int, overlap: float = 0.1) -> list[tuple[pd.DataFrame, ...]]:
+    """
+    Split the tables of `make_pos_tables()` into `n_archives` sets of tables by "会計ID", like monthly zip files.\\
+    The records of the fraction `overlap` of the checkouts are also in the next archive, like overlapping exports.
+    """
+    archives = []
+    for k in range(n_archives):
+        parts = []
+        for df in tables:
+            hashes = pd.util.hash_array(df["会計ID"].to_numpy()).astype("int64")
+            first = hashes % n_archives
+            is_overlap = (hashes // n_archives) % 100 < overlap * 100
+            parts.append(df[(first == k) | (is_overlap & ((first + 1) % n_archives == k))].reset_index(drop=True))
+        archives.append(tuple(parts))
+    return archives
+
+
+def write_pos_zip(f: str | IO[bytes], tables: tuple[pd.DataFrame, ...]) -> None:
+    """
+    Write the tables of `make_pos_tables()` into a zip file like the one exported from Ubiregi,
+    which has checkouts.csv, items.csv, and payments.csv encoded in Shift-JIS.
+    """
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as zf:
+        for member, df in zip(["checkouts.csv", "items.csv", "payments.csv"], tables):
+            with zf.open(member, "w") as out:
+                df.to_csv(out, index=False, encoding="shift-jis")
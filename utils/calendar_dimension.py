@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Columns of the calendar attached to daily data
+CALENDAR_FIELDS = ["academic_year", "term", "class", "info"]
+
+# Syllabus data of the campus of each store
+SYLLABUS_STORES = {"西食堂": "df_syllabus_west", "東カフェテリア": "df_syllabus_east"}
+
+# Periods counted in the number of students attending classes around lunch (the same as the features of the forecast)
+SYLLABUS_PERIODS = [1, 2, 3]
+
+# Terms with classes and the days of the week in the calendar and the syllabus data
+MAIN_TERMS = ["SPR", "SMR", "AUT", "WTR"]
+CLASS_DAYS = {"MON": "月", "TUE": "火", "WED": "水", "THU": "木", "FRI": "金"}
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The calendar is built once into a date dimension when calendar or syllabus data is committed.
+# The dimension holds the rows of the calendar with the number of students of each store, and the position of the row
+# for each day from the first date (-1 for days missing in the calendar). Daily charts look up the context of their
+# dates by position (`days - day0`) instead of merging the calendar on every rerun.
+
+
+def get_days(dates: np.ndarray) -> np.ndarray:
+    """
+    Return the number of days since 1970-01-01 of `dates` (datetime64).
+    """
+    return dates.astype("datetime64[D]").astype("int64")
+
+
+def get_syllabus_totals(df_cal: pd.DataFrame, df_syl: pd.DataFrame) -> np.ndarray:
+    """
+    Return the number of students attending classes in `SYLLABUS_PERIODS` for each row of `df_cal`.\\
+    NaN if the day has no classes or the syllabus data has no such term.
+    """
+    # Number of students by the day of the week (rows) and term (columns)
+    df_syl = df_syl[df_syl.index.get_level_values(1).isin(SYLLABUS_PERIODS)]
+    counts = df_syl.groupby(level=0).sum()
+    totals = np.full(len(df_cal), np.nan)
+    for i, (year, term, day) in enumerate(zip(df_cal["academic_year"], df_cal["term"], df_cal["class"])):
+        if term not in MAIN_TERMS or day not in CLASS_DAYS:
+            continue
+        col, row = str(year) + term, CLASS_DAYS[day]
+        if col in counts.columns and row in counts.index:
+            totals[i] = counts.at[row, col]
+    return totals
+
+
+def build_calendar_dimension(df_cal: pd.DataFrame, syllabus: dict[str, pd.DataFrame]) -> dict:
+    """
+    Build the date dimension of the calendar data.\\
+    `syllabus` maps stores to their syllabus data. Stores without syllabus data (ex. not uploaded yet) are left out.
+    """
+    df_cal = df_cal.drop_duplicates(subset="date").reset_index(drop=True)
+    days = get_days(df_cal["date"].to_numpy())
+    day0 = int(days.min())
+    positions = np.full(int(days.max()) - day0 + 1, -1, dtype="int64")
+    positions[days - day0] = np.arange(len(df_cal))
+    rows = df_cal.reindex(columns=CALENDAR_FIELDS)
+    for store, df_syl in syllabus.items():
+        rows[store] = get_syllabus_totals(rows, df_syl)
+    return {"day0": day0, "positions": positions, "rows": rows, "stores": list(syllabus)}
+
+
+def get_rows(dimension: dict, index: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Return the rows of the dimension for the dates in `index`, with `index` as the index.\\
+    Dates missing in the calendar have NaN, as a left merge of the calendar on the dates.
+    """
+    days = get_days(index.to_numpy()) - dimension["day0"]
+    is_inside = (days >= 0) & (days < len(dimension["positions"]))
+    positions = np.where(is_inside, dimension["positions"][np.where(is_inside, days, 0)], -1)
+    is_found = positions >= 0
+    rows = dimension["rows"].iloc[np.maximum(positions, 0)].set_axis(index)
+    if not is_found.all():
+        rows = rows.where(np.broadcast_to(is_found[:, None], rows.shape))
+    return rows
+
+
+def attach_calendar(df: pd.DataFrame, dimension: dict | None) -> pd.DataFrame:
+    """
+    Return `df` (indexed by date) with the columns of the calendar (`CALENDAR_FIELDS`) attached.\\
+    `df` is returned as it is if no calendar data is committed (`dimension` is None).
+    """
+    if dimension is None:
+        return df
+    return pd.concat([df, get_rows(dimension, df.index)[CALENDAR_FIELDS]], axis="columns")
+
+
+def get_calendar_hovertemplate(dimension: dict | None, store: str) -> str:
+    """
+    Return the part of a hovertemplate showing the calendar context of `get_calendar_meta()`.
+    """
+    if dimension is None:
+        return ""
+    template = "<br>学期: %{meta[0]}年度%{meta[1]}<br>講義情報: %{meta[2]}<br>その他情報: %{meta[3]}"
+    if store in dimension["stores"]:
+        template += "<br>履修者数（1～3限）: %{meta[4]:,}人"
+    return template
+
+
+def get_calendar_meta(dimension: dict | None, index: pd.DatetimeIndex, store: str) -> list | None:
+    """
+    Return the calendar context of the dates in `index` as the `meta` of a trace of `store`:
+    academic year, term, class, info, and the number of students of the store if available.
+    """
+    if dimension is None:
+        return None
+    columns = CALENDAR_FIELDS + ([store] if store in dimension["stores"] else [])
+    return get_rows(dimension, index)[columns].values.tolist()
@@ -0,0 +1,166 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.pos_schema import BUSINESS_HOURS
+from utils.pos_filters import BUSINESS_HOURS_OPTIONS, STORES, get_row_ranges
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Length of a time slot in minutes and the number of slots per day
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# Spans of the time of day chart and the number of slots in each of them
+SPAN_SLOTS = {"5min": 1, "10min": 2, "30min": 6}
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The number of customers ("客数") is aggregated once when POS data is committed,
+# and the charts of customers are served from the aggregated arrays instead of resampling checkouts on every run.
+# - "slots": 客数 by store, day, and 5-minute slot of "開始日時". Longer spans are sums of adjacent slots.
+# - "daily": 客数 by store, day, and business hours. Business hours include the last second (ex. 14:00:00),
+#   which cannot be expressed by slots, so they are aggregated with the bit flags in "時間帯".
+# - "checkouts": the number of checkouts in the same shape as "daily", to know the days with checkouts.
+# Days are counted from "day0", the first "日付番号" of the data. Stores are the categories of "アカウント名".
+# When data is appended, only the new data is aggregated and added to the existing arrays (`update_customer_tensor()`).
+
+
+def build_customer_tensor(df_cus: pd.DataFrame) -> dict:
+    """
+    Aggregate the number of customers of compact customers and return a dictionary of arrays.
+    """
+    stores = df_cus["アカウント名"].cat.categories.tolist()
+    codes = df_cus["アカウント名"].cat.codes.to_numpy().astype("int64")
+    days = df_cus["日付番号"].to_numpy().astype("int64")
+    day0 = int(days.min()) if len(days) else 0
+    n_days = int(days.max()) - day0 + 1 if len(days) else 0
+    day_pos = codes * n_days + (days - day0)
+    customers = df_cus["客数"].to_numpy()
+
+    slots = day_pos * SLOTS_PER_DAY + df_cus["分"].to_numpy() // SLOT_MINUTES
+    n_slots = len(stores) * n_days * SLOTS_PER_DAY
+    tensor = {
+        "stores": stores,
+        "day0": day0,
+        "slots": np.bincount(slots, weights=customers, minlength=n_slots).astype("int64").reshape(len(stores), n_days, SLOTS_PER_DAY),
+        "daily": np.zeros((len(stores), n_days, len(BUSINESS_HOURS)), dtype="int64"),
+        "checkouts": np.zeros((len(stores), n_days, len(BUSINESS_HOURS)), dtype="int64")
+    }
+    hours = df_cus["時間帯"].to_numpy()
+    for i in range(len(BUSINESS_HOURS)):
+        is_in_hours = (hours >> np.uint8(i) & 1).astype(bool)
+        n = len(stores) * n_days
+        tensor["daily"][:, :, i] = np.bincount(day_pos[is_in_hours], weights=customers[is_in_hours], minlength=n).reshape(len(stores), n_days)
+        tensor["checkouts"][:, :, i] = np.bincount(day_pos[is_in_hours], minlength=n).reshape(len(stores), n_days)
+    return tensor
+
+
+def update_customer_tensor(tensor: dict, df_cus_new: pd.DataFrame) -> dict:
+    """
+    Return a new tensor with compact customers appended.\\
+    Only the new data is aggregated, and the existing arrays are copied into arrays covering both.
+    New stores are added to the end, in the same order as the categories of "アカウント名" after `concat_pos_tables()`.
+    The given tensor is not modified.
+    """
+    new = build_customer_tensor(df_cus_new)
+    stores = tensor["stores"] + [s for s in new["stores"] if s not in tensor["stores"]]
+    # Days covered by either of the tensors
+    ranges = [(t["day0"], t["day0"] + t["daily"].shape[1]) for t in (tensor, new) if t["daily"].shape[1] > 0]
+    day0 = min(r[0] for r in ranges) if ranges else 0
+    n_days = max(r[1] for r in ranges) - day0 if ranges else 0
+
+    merged = {"stores": stores, "day0": day0}
+    for name in ["slots", "daily", "checkouts"]:
+        arr = np.zeros((len(stores), n_days, tensor[name].shape[2]), dtype="int64")
+        for t in (tensor, new):
+            s_idx = [stores.index(s) for s in t["stores"]]
+            offset = t["day0"] - day0
+            arr[s_idx, offset:offset + t[name].shape[1]] += t[name]
+        merged[name] = arr
+    return merged
+
+
+def to_date_index(tensor: dict, first: int, last: int) -> pd.DatetimeIndex:
+    """
+    Return the dates from the `first` to the `last` day of the tensor.
+    """
+    return pd.to_datetime(np.arange(tensor["day0"] + first, tensor["day0"] + last + 1), unit="D")
+
+
+#-------------Time of day-------------
+
+def get_customers_by_slot(tensor: dict, df_cus: pd.DataFrame, date: tuple[datetime.date], store: str, span: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return a DataFrame of the number of customers by time slot (rows, "HH:MM") and date (columns) of `store`.\\
+    This is the same as resampling the checkouts from `date[0]` to `date[1]` by `span`,
+    and selecting the slots which start within `business_hours` by `between_time()`.
+    Slots before the first checkout and after the last checkout are missing (NaN), as in `resample()`.\\
+    Return an empty DataFrame if there is no customer.
+    """
+    ranges = get_row_ranges(df_cus, date, store)
+    if len(ranges) != 1 or ranges[0][0] == ranges[0][1]:
+        return pd.DataFrame()
+    k = SPAN_SLOTS[span]
+    s = tensor["stores"].index(store)
+    # The first and last slots with checkouts
+    start, stop = ranges[0]
+    first_day, last_day = (int(df_cus["日付番号"].iat[i]) - tensor["day0"] for i in (start, stop - 1))
+    first_slot, last_slot = (int(df_cus["分"].iat[i]) // (SLOT_MINUTES * k) for i in (start, stop - 1))
+    counts = tensor["slots"][s, first_day:last_day + 1]
+    counts = counts.reshape(len(counts), SLOTS_PER_DAY // k, k).sum(axis=2).astype("float64")
+    counts[0, :first_slot] = np.nan
+    counts[-1, last_slot + 1:] = np.nan
+    # Slots starting within the business hours, including both ends
+    start_time, end_time = BUSINESS_HOURS[BUSINESS_HOURS_OPTIONS.get(business_hours, "open")]
+    minutes = np.arange(SLOTS_PER_DAY // k) * SLOT_MINUTES * k
+    lower, upper = (int(t[:2]) * 60 + int(t[3:]) for t in (start_time, end_time))
+    in_hours = (lower <= minutes) & (minutes <= upper)
+    counts = counts[:, in_hours].T
+    if np.nansum(counts) == 0:
+        return pd.DataFrame()
+    df = pd.DataFrame(
+        counts,
+        index=[f"{m // 60:02d}:{m % 60:02d}" for m in minutes[in_hours]],
+        columns=pd.Index(to_date_index(tensor, first_day, last_day).date, name="日付")
+    )
+    df = df.dropna(axis="index", how="all").dropna(axis="columns", how="all")
+    if not df.isna().any(axis=None):
+        df = df.astype("int64")
+    return df
+
+
+#-------------Daily-------------
+
+def get_customers_by_day(tensor: dict, date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return a DataFrame of the number of customers in `business_hours` by date (rows) and store (columns).\\
+    This is the same as resampling the checkouts of each store by day.
+    Days before the first checkout and after the last checkout of each store are missing (NaN).\\
+    Return an empty DataFrame if there is no checkout.
+    """
+    h = list(BUSINESS_HOURS).index(BUSINESS_HOURS_OPTIONS.get(business_hours, "open"))
+    n_days = tensor["daily"].shape[1]
+    left = max(int((pd.Timestamp(date[0]) - pd.Timestamp("1970-01-01")).days) - tensor["day0"], 0)
+    right = min(int((pd.Timestamp(date[1]) - pd.Timestamp("1970-01-01")).days) - tensor["day0"], n_days - 1)
+    if left > right:
+        return pd.DataFrame()
+    columns = {}
+    for s, name in enumerate(tensor["stores"]):
+        if store in STORES and name != store:
+            continue
+        days = np.flatnonzero(tensor["checkouts"][s, left:right + 1, h]) + left
+        if len(days):
+            columns[name] = pd.Series(tensor["daily"][s, days[0]:days[-1] + 1, h], index=to_date_index(tensor, days[0], days[-1]))
+    if not columns:
+        return pd.DataFrame()
+    df = pd.DataFrame(columns)
+    # All columns are float if any day is missing, as in `unstack()`
+    if df.isna().any(axis=None):
+        df = df.astype("float64")
+    df.index.name = "開始日時"
+    df.columns.name = "アカウント名"
+    return df
@@ -0,0 +1,184 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.pos_schema import BUSINESS_HOURS
+from utils.pos_filters import BUSINESS_HOURS_OPTIONS, STORES
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Measures of items aggregated by department. "明細数" is the number of rows of items, to know the days with sales.
+DEPARTMENT_MEASURES = ["数量", "金額", "明細数"]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Sales by department and users of payment methods are aggregated by day when POS data is committed,
+# and the charts are served from the aggregated arrays instead of filtering rows on every run.
+# - "部門": 数量, 金額, and 明細数 by store, day, business hours, and department
+# - "支払い方法": 利用者数 (客数 of checkouts using the method) by store, day, business hours, and payment method
+# Business hours are the bits of "時間帯", so each checkout is counted in every business hours it belongs to.
+# Days are counted from "day0", and stores, departments, and payment methods are lists of labels.
+# When data is appended, only the new data is aggregated and added to the existing arrays (`update_daily_cube()`).
+
+
+def get_day_number(d: datetime.date) -> int:
+    """
+    Return the number of days since 1970-01-01, the same as "日付番号".
+    """
+    return int((pd.Timestamp(d) - pd.Timestamp("1970-01-01")).days)
+
+
+def build_daily_cube(df_cus: pd.DataFrame, df_itm: pd.DataFrame, payment_methods: list[str]) -> dict:
+    """
+    Aggregate compact customers and items by day and return a dictionary of arrays.
+    """
+    stores = df_cus["アカウント名"].cat.categories.tolist()
+    departments = df_itm["部門"].cat.categories.tolist()
+    days = df_cus["日付番号"].to_numpy().astype("int64")
+    day0 = int(days.min()) if len(days) else 0
+    n_days = int(days.max()) - day0 + 1 if len(days) else 0
+    day_pos = df_cus["アカウント名"].cat.codes.to_numpy().astype("int64") * n_days + (days - day0)
+    hours = df_cus["時間帯"].to_numpy()
+    n = len(stores) * n_days
+
+    cube = {
+        "stores": stores,
+        "day0": day0,
+        "部門": {"labels": departments},
+        "支払い方法": {"labels": list(payment_methods), "利用者数": np.zeros((len(stores), n_days, len(BUSINESS_HOURS), len(payment_methods)), dtype="int64")}
+    }
+    for measure in DEPARTMENT_MEASURES:
+        cube["部門"][measure] = np.zeros((len(stores), n_days, len(BUSINESS_HOURS), len(departments)), dtype="int64")
+
+    # Items by department
+    cus_rows = df_itm["会計行"].to_numpy()
+    itm_pos = day_pos[cus_rows] * len(departments) + df_itm["部門"].cat.codes.to_numpy().astype("int64")
+    itm_hours = hours[cus_rows]
+    weights = {"数量": df_itm["数量"].to_numpy(), "金額": df_itm["金額"].to_numpy(), "明細数": None}
+    for i in range(len(BUSINESS_HOURS)):
+        is_in_hours = (itm_hours >> np.uint8(i) & 1).astype(bool)
+        for measure, w in weights.items():
+            w = None if w is None else w[is_in_hours]
+            sums = np.bincount(itm_pos[is_in_hours], weights=w, minlength=n * len(departments))
+            cube["部門"][measure][:, :, i] = sums.reshape(len(stores), n_days, len(departments))
+
+    # Users of payment methods, weighted by the number of customers
+    flags = df_cus["支払い方法"].to_numpy().astype("uint64")
+    customers = df_cus["客数"].to_numpy()
+    for i in range(len(BUSINESS_HOURS)):
+        is_in_hours = (hours >> np.uint8(i) & 1).astype(bool)
+        for m in range(len(payment_methods)):
+            is_used = is_in_hours & ((flags >> np.uint64(m) & np.uint64(1)) > 0)
+            sums = np.bincount(day_pos[is_used], weights=customers[is_used], minlength=n)
+            cube["支払い方法"]["利用者数"][:, :, i, m] = sums.reshape(len(stores), n_days)
+    return cube
+
+
+def update_daily_cube(cube: dict, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame, payment_methods: list[str]) -> dict:
+    """
+    Return a new cube with compact customers and items appended.\\
+    Only the new data is aggregated, and the existing arrays are copied into arrays covering both.
+    `payment_methods` must be the list used to compact the new data, which extends the existing one.
+    The given cube is not modified.
+    """
+    new = build_daily_cube(df_cus_new, df_itm_new, payment_methods)
+    stores = cube["stores"] + [s for s in new["stores"] if s not in cube["stores"]]
+    # Days covered by either of the cubes
+    ranges = [(c["day0"], c["day0"] + c["部門"]["数量"].shape[1]) for c in (cube, new) if c["部門"]["数量"].shape[1] > 0]
+    day0 = min(r[0] for r in ranges) if ranges else 0
+    n_days = max(r[1] for r in ranges) - day0 if ranges else 0
+
+    merged = {"stores": stores, "day0": day0}
+    for dim, measures in [("部門", DEPARTMENT_MEASURES), ("支払い方法", ["利用者数"])]:
+        labels = cube[dim]["labels"] + [x for x in new[dim]["labels"] if x not in cube[dim]["labels"]]
+        merged[dim] = {"labels": labels}
+        for measure in measures:
+            arr = np.zeros((len(stores), n_days, len(BUSINESS_HOURS), len(labels)), dtype="int64")
+            for c in (cube, new):
+                values = c[dim][measure]
+                s_idx = [stores.index(s) for s in c["stores"]]
+                l_idx = [labels.index(x) for x in c[dim]["labels"]]
+                offset = c["day0"] - day0
+                arr[np.ix_(s_idx, range(offset, offset + values.shape[1]), range(len(BUSINESS_HOURS)), l_idx)] += values
+            merged[dim][measure] = arr
+    return merged
+
+
+def get_selection(cube: dict, date: tuple[datetime.date], store: str, business_hours: str) -> tuple[list[int], slice, int] | None:
+    """
+    Return the indices of stores, the slice of days, and the index of business hours selected by the options.\\
+    Return `None` if no day of the cube is selected.
+    """
+    h = list(BUSINESS_HOURS).index(BUSINESS_HOURS_OPTIONS.get(business_hours, "open"))
+    n_days = cube["部門"]["数量"].shape[1]
+    left = max(get_day_number(date[0]) - cube["day0"], 0)
+    right = min(get_day_number(date[1]) - cube["day0"], n_days - 1)
+    if left > right:
+        return None
+    stores = [s for s, name in enumerate(cube["stores"]) if store not in STORES or name == store]
+    return stores, slice(left, right + 1), h
+
+
+#-------------Sales by department-------------
+
+def get_department_sales(cube: dict, department: str, date: tuple[datetime.date], store: str, business_hours: str, measure: str) -> pd.DataFrame:
+    """
+    Return a DataFrame of daily `measure` of `department` by date (rows) and store (columns).\\
+    This is the same as resampling the items of each store by day.
+    Days before the first sale and after the last sale of each store are missing (NaN).\\
+    Return an empty DataFrame if the department was not sold.
+    """
+    selection = get_selection(cube, date, store, business_hours)
+    if selection is None or department not in cube["部門"]["labels"]:
+        return pd.DataFrame()
+    stores, days, h = selection
+    k = cube["部門"]["labels"].index(department)
+    columns = {}
+    for s in stores:
+        sold = np.flatnonzero(cube["部門"]["明細数"][s, days, h, k]) + days.start
+        if len(sold):
+            first, last = sold[0], sold[-1]
+            dates = pd.to_datetime(np.arange(first, last + 1) + cube["day0"], unit="D")
+            columns[cube["stores"][s]] = pd.Series(cube["部門"][measure][s, first:last + 1, h, k], index=dates)
+    if not columns:
+        return pd.DataFrame()
+    df = pd.DataFrame(columns)
+    # All columns are float if any day is missing, as in `unstack()`
+    if df.isna().any(axis=None):
+        df = df.astype("float64")
+    df.index.name = "開始日時"
+    df.columns.name = "アカウント名"
+    return df
+
+
+def get_department_ranking(cube: dict, date: tuple[datetime.date], store: str, business_hours: str, measure: str = "数量") -> list[str]:
+    """
+    Return the departments sold in the selected period, in descending order of the total `measure`.\\
+    Departments with the same total are in the order of the labels.
+    """
+    selection = get_selection(cube, date, store, business_hours)
+    if selection is None:
+        return []
+    stores, days, h = selection
+    totals = cube["部門"][measure][stores, days, h].sum(axis=(0, 1))
+    sold = np.flatnonzero(cube["部門"]["明細数"][stores, days, h].sum(axis=(0, 1)))
+    order = sold[np.argsort(-totals[sold], kind="stable")]
+    return [cube["部門"]["labels"][k] for k in order]
+
+
+#-------------Payment methods-------------
+
+def get_payment_users(cube: dict, date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return a DataFrame of the total number of users ("合計利用者数") of each payment method in the selected period.\\
+    Checkouts with multiple payment methods are counted for each of them.
+    """
+    users = np.zeros(len(cube["支払い方法"]["labels"]), dtype="int64")
+    selection = get_selection(cube, date, store, business_hours)
+    if selection is not None:
+        stores, days, h = selection
+        users = cube["支払い方法"]["利用者数"][stores, days, h].sum(axis=(0, 1))
+    return pd.DataFrame({"支払い方法": cube["支払い方法"]["labels"], "合計利用者数": users})
@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Maximum number of points of a daily trace sent to the browser
+MAX_POINTS = int(os.environ.get("POSCOPE_MAX_POINTS", 500))
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The daily charts of the visualize and forecast pages are downsampled on the server with
+# Largest-Triangle-Three-Buckets (LTTB), so a chart of several years sends at most `MAX_POINTS` points per trace
+# and its hover information (`meta`) is built only for them. LTTB keeps the point forming the largest triangle
+# in each bucket, so peaks and dips remain visible unlike averaging or taking every n-th day.
+# Selecting a range on a chart (box selection) reruns its section with the rows in the range only,
+# which are shown at full resolution as long as they fit in the budget. Double-click clears the selection.
+
+
+def get_lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Return the indices of `n_out` points selected from (x, y) with Largest-Triangle-Three-Buckets.\\
+    The first and the last points are always kept. All indices are returned if there are not more points than `n_out`.
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    indices = np.empty(n_out, dtype="int64")
+    indices[0], indices[-1] = 0, n - 1
+    # Boundaries of the buckets of the points between the first and the last ones
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        if i < n_out - 3:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the area of the triangles formed with the selected point and the average
+        areas = np.abs(
+            (x[selected] - avg_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (avg_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def downsample(df: pd.DataFrame, column: str, n_points: int = MAX_POINTS) -> pd.DataFrame:
+    """
+    Return the rows of `df` (indexed by date) to plot `column` with at most `n_points` points.\\
+    `df` is returned as it is if it has no more rows than `n_points`. Otherwise missing values are dropped
+    and the rows are selected with `get_lttb_indices()`, so the other columns (ex. hover information) follow the points.
+    """
+    if len(df) <= n_points:
+        return df
+    df = df[df[column].notna()]
+    if df.empty:
+        return df
+    # Days since the first date as x, which keeps the areas of the triangles in a moderate range
+    x = ((df.index - df.index[0]) / pd.Timedelta(days=1)).to_numpy(dtype="float64")
+    y = df[column].to_numpy(dtype="float64")
+    return df.iloc[get_lttb_indices(x, y, n_points)]
+
+
+def get_selected_range(key: str) -> tuple[pd.Timestamp, pd.Timestamp] | None:
+    """
+    Return the range of dates selected with the box selection on the chart of `key`, or None if nothing is selected.
+    """
+    state = st.session_state.get(key)
+    if state is None:
+        return None
+    boxes = state["selection"]["box"]
+    if not boxes or len(boxes[0]["x"]) != 2:
+        return None
+    # Dates of a box are strings of varying precision (ex. "2024-04-01", "2024-04-01 12:34:56.789")
+    start, end = sorted(pd.Timestamp(x) for x in boxes[0]["x"])
+    return start, end
+
+
+def slice_selected_range(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """
+    Return the rows of `df` (indexed by date) in the range selected on the chart of `key`.\\
+    All rows are returned if nothing is selected or the range contains less than 2 rows (ex. after changing the dates).
+    """
+    selected = get_selected_range(key)
+    if selected is None:
+        return df
+    start, end = selected
+    df_range = df[(df.index >= start) & (df.index <= end)]
+    if len(df_range) < 2:
+        return df
+    return df_range
+
+
+def show_resolution(df: pd.DataFrame, df_range: pd.DataFrame, fig: go.Figure) -> None:
+    """
+    Show the number of points of the chart `fig` of `df` and how to change the range.\\
+    `df_range` is the result of `slice_selected_range()`.
+    """
+    # The largest number of points of a trace
+    n_shown = max((len(trace.x) for trace in fig.data), default=0)
+    if len(df_range) < len(df):
+        text = (
+            f":material/zoom_in: {df_range.index.min():%Y-%m-%d}～{df_range.index.max():%Y-%m-%d}を表示中"
+            f"（{n_shown:,}/{len(df_range):,}点）。ダブルクリックで全期間に戻ります。"
+        )
+    elif n_shown < len(df):
+        text = (
+            f":material/zoom_in: {len(df):,}点から{n_shown:,}点に間引いて表示中。"
+            "グラフ上で範囲をドラッグすると、その期間を詳しく表示します。"
+        )
+    else:
+        return
+    st.caption(text)
@@ -0,0 +1,145 @@
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+from openpyxl import Workbook
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Formats of the downloaded files: extension and MIME type
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+}
+
+# Number of rows converted at once. Larger chunks are faster but use more memory.
+EXPORT_CHUNK_ROWS = int(os.environ.get("POSCOPE_EXPORT_CHUNK_ROWS", 50000))
+
+# Maximum number of rows of a worksheet, including the header
+XLSX_MAX_ROWS = 1048576
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The "データを見る" expanders of the visualize page export their DataFrames only when requested:
+# the file is written when "ファイルを作成" is clicked, and the download button is shown until the next rerun.
+# Predictions of the forecast page exist only in the run training the model, so they are written at once in all formats.
+# Files are written chunk by chunk into a buffer, so the whole DataFrame never exists as a single string.
+# Streamlit keeps the file in memory until it is downloaded, so the buffer is passed as it is without copying.
+
+
+def write_csv(df: pd.DataFrame, buffer: io.BytesIO, index: bool) -> None:
+    """
+    Write `df` as a CSV file encoded in Shift-JIS, `EXPORT_CHUNK_ROWS` rows at a time.
+    """
+    df.to_csv(buffer, index=index, encoding="shift-jis", chunksize=EXPORT_CHUNK_ROWS)
+
+
+def write_parquet(df: pd.DataFrame, buffer: io.BytesIO, index: bool) -> None:
+    """
+    Write `df` as a Parquet file with a row group for each chunk of `EXPORT_CHUNK_ROWS` rows.
+    """
+    # Column names of Parquet must be strings (ex. dates in the columns of customers by time of day)
+    df = df.rename(columns=str)
+    schema = pa.Schema.from_pandas(df, preserve_index=index)
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=index))
+
+
+def write_xlsx(df: pd.DataFrame, buffer: io.BytesIO, index: bool) -> None:
+    """
+    Write `df` as an XLSX file with a write-only workbook, which streams rows instead of keeping the cells in memory.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header = [str(name) if name is not None else "" for name in df.index.names] if index else []
+    sheet.append(header + [str(col) for col in df.columns])
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        if index:
+            chunk = chunk.reset_index()
+        # Missing values are written as empty cells
+        chunk = chunk.astype(object)
+        for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(buffer)
+
+
+def export_dataframe(df: pd.DataFrame, format: str, index: bool) -> io.BytesIO:
+    """
+    Write `df` in `format` (one of `EXPORT_FORMATS`) and return the buffer.
+    """
+    buffer = io.BytesIO()
+    if format == "CSV":
+        write_csv(df, buffer, index)
+    elif format == "Parquet":
+        write_parquet(df, buffer, index)
+    else:
+        write_xlsx(df, buffer, index)
+    return buffer
+
+
+def show_download_button(buffer: io.BytesIO, format: str, file_name: str, key: str) -> None:
+    """
+    Show the button to download the file in `buffer` written in `format` as `file_name` (without extension).
+    """
+    extension, mime = EXPORT_FORMATS[format]
+    # Downloading does not rerun the page, so the file remains available until the next rerun
+    st.download_button(
+        label=f":material/download: `.{extension}`でダウンロード",
+        data=buffer,
+        file_name=f"{file_name}.{extension}",
+        mime=mime,
+        key=key,
+        on_click="ignore"
+    )
+
+
+def get_export_formats(df: pd.DataFrame) -> list[str]:
+    """
+    Return the formats in which `df` can be exported.
+    """
+    formats = list(EXPORT_FORMATS)
+    # Worksheets have a limited number of rows
+    if len(df) + 1 > XLSX_MAX_ROWS:
+        formats.remove("XLSX")
+    return formats
+
+
+def show_export(df: pd.DataFrame, file_name: str, index: bool, key: str) -> None:
+    """
+    Show the options to download `df` as `file_name` (without extension).\\
+    The file is written only when "ファイルを作成" is clicked. `key` identifies the widgets.
+    """
+    col1, col2, _, _ = st.columns(4, vertical_alignment="bottom")
+    with col1:
+        format = st.selectbox(
+            label=":material/description: 形式",
+            options=get_export_formats(df),
+            index=0,
+            accept_new_options=False,
+            key=f"{key}_format",
+            help="CSVはShift-JISで出力します。"
+        )
+    with col2:
+        if st.button(label=":material/build: ファイルを作成", key=f"{key}_create"):
+            with st.spinner("ファイルを作成中...", show_time=True):
+                buffer = export_dataframe(df, format, index)
+            show_download_button(buffer, format, file_name, f"{key}_download")
+
+
+def show_exports(df: pd.DataFrame, file_name: str, index: bool, key: str) -> None:
+    """
+    Show the buttons to download `df` as `file_name` (without extension) in all formats.\\
+    This is for small results which exist only in the current run (ex. predictions), so the files are written at once.
+    """
+    for col, format in zip(st.columns(4), get_export_formats(df)):
+        with col:
+            show_download_button(export_dataframe(df, format, index), format, file_name, f"{key}_{format}")
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import tempfile
+from typing import IO, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.pos_loader import (
+    POS_MEMBERS, LARGE_ZIP_BYTES, load_zip_file, map_zip_files, concat_chunks, measure_peak_memory,
+    get_file_size, spool_to_disk, iter_pos_csv_batches
+)
+from utils.pos_cleaning import clean_pos_tables, clean_checkouts, clean_items, clean_payments
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Directory to store the cache and its size limit in bytes
+CACHE_DIR = os.environ.get("POSCOPE_CACHE_DIR", os.path.join(".cache", "ingest"))
+CACHE_MAX_BYTES = int(os.environ.get("POSCOPE_CACHE_MAX_BYTES", 1024**3))
+
+# Increment this number when the format of the cached tables changes (ex. `clean_pos_tables()` is modified),
+# so that the entries created by older versions are invalidated.
+SCHEMA_VERSION = 2
+
+# Names of the cached tables
+TABLES = ["checkouts", "items", "payments"]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+#--------------Cache entries--------------
+
+def hash_file(f: IO[bytes]) -> str:
+    """
+    Return the SHA-256 hash of the content of a file-like object.\\
+    The position of the file is reset to the beginning.
+    """
+    f.seek(0)
+    digest = hashlib.file_digest(f, "sha256").hexdigest()
+    f.seek(0)
+    return digest
+
+
+def get_entry_dir(key: str) -> str:
+    """
+    Return the directory of the cache entry.
+    """
+    return os.path.join(CACHE_DIR, key)
+
+
+def read_meta(entry_dir: str) -> dict | None:
+    """
+    Return the metadata of the cache entry, or `None` if it is missing or broken.
+    """
+    try:
+        with open(os.path.join(entry_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cache_get(key: str, tables: list[str] = TABLES) -> tuple[pd.DataFrame, ...] | None:
+    """
+    Return the cached DataFrames of checkouts, items, and payments, or `None` if they are not cached.\\
+    Entries with a different schema version are deleted.
+    Other kinds of entries (ex. workbooks in `utils.workbook_loader`) are read by giving the names of their tables.
+    """
+    entry_dir = get_entry_dir(key)
+    meta = read_meta(entry_dir)
+    if meta is None:
+        return None
+    if meta.get("schema_version") != SCHEMA_VERSION:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+    try:
+        dfs = tuple(pd.read_parquet(os.path.join(entry_dir, f"{table}.parquet")) for table in tables)
+        # The modification time of the metadata is used as the last access time for LRU eviction
+        os.utime(os.path.join(entry_dir, "meta.json"))
+    except (OSError, ValueError):
+        # The entry may be evicted by another session while reading
+        return None
+    return dfs
+
+
+def cache_put(key: str, dfs: tuple[pd.DataFrame, ...], tables: list[str] = TABLES) -> None:
+    """
+    Store the DataFrames of checkouts, items, and payments as Parquet files and evict old entries.\\
+    The files are written into a temporary directory first and then renamed,
+    so other sessions never read a half-written entry.
+    Other kinds of entries are stored by giving the names of their tables.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=CACHE_DIR)
+    try:
+        for table, df in zip(tables, dfs):
+            df.to_parquet(os.path.join(tmp_dir, f"{table}.parquet"), index=False)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"schema_version": SCHEMA_VERSION, "created": time.time()}, f)
+        try:
+            os.rename(tmp_dir, get_entry_dir(key))
+        except OSError:
+            # The same entry has been created by another session
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict_cache()
+
+
+def cache_put_batched(key: str, zip_file: IO[bytes]) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Clean a large zip file in batches, store the results in the cache, and return the cleanuped DataFrames.\\
+    The zip file is read from disk (uploaded files are spooled there first) and its members are streamed from there,
+    and the cleanuped batches are appended to the Parquet files of the entry,
+    so the memory usage for raw data does not grow with the size of the zip file.
+    The cleanuped DataFrames returned are read from the entry as a whole, and they do grow with it.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=CACHE_DIR)
+    try:
+        with spool_to_disk(zip_file) as path, zipfile.ZipFile(path) as zf:
+            write_cleaned_batches(zf, tmp_dir)
+        # The entry may be larger than the cache itself, so read the tables before it can be evicted
+        tables = tuple(pd.read_parquet(os.path.join(tmp_dir, f"{table}.parquet")) for table in TABLES)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"schema_version": SCHEMA_VERSION, "created": time.time()}, f)
+        try:
+            os.rename(tmp_dir, get_entry_dir(key))
+        except OSError:
+            # The same entry has been created by another session
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict_cache()
+    return tables
+
+
+def write_cleaned_batches(zf: zipfile.ZipFile, out_dir: str) -> None:
+    """
+    Clean checkouts.csv, items.csv, and payments.csv in a zip file batch by batch and write Parquet files into `out_dir`.\\
+    The result is the same as `clean_pos_tables()` except that duplicates between batches are kept,
+    which are dropped in `merge_pos_tables()` anyway.\\
+    Whether a checkout has to be removed depends on other rows, so the zip file is read twice.
+    The first pass reads only narrow columns and collects the candidates:
+    "会計ID" of cancelled records and of invalid items.
+    The second pass cleans the batches. Checkouts are cleaned first, so that the checkouts
+    which have both cancelled and valid records are known before items and payments.
+    """
+    members = set(zf.namelist())
+
+    def iter_batches(member: str, cols: list[str] | None = None):
+        if member not in members:
+            return
+        dtypes = POS_MEMBERS[member]
+        if cols is not None:
+            dtypes = {col: dtypes[col] for col in cols}
+        with zf.open(member) as f:
+            yield from iter_pos_csv_batches(f, dtypes)
+
+    # First pass
+    cancelled_ids = []
+    invalid_ids = []
+    for df in iter_batches("checkouts.csv", ["会計ID", "削除日時"]):
+        cancelled_ids.append(df.loc[df["削除日時"].notna(), "会計ID"].unique())
+    for df in iter_batches("items.csv", ["会計ID", "数量"]):
+        invalid_ids.append(df.loc[df["数量"].le(0).fillna(False).to_numpy(dtype=bool), "会計ID"].unique())
+    cancelled_ids = pd.unique(np.concatenate(cancelled_ids or [np.array([], dtype="object")]))
+    invalid_ids = pd.unique(np.concatenate(invalid_ids or [np.array([], dtype="object")]))
+
+    # Second pass
+    valid_ids = []
+
+    def clean_checkout_batches():
+        for df in iter_batches("checkouts.csv"):
+            # Cancelled checkouts with a valid record are not removed
+            is_valid = df["削除日時"].isna() & df["会計ID"].isin(cancelled_ids)
+            valid_ids.append(df.loc[is_valid, "会計ID"].unique())
+            yield clean_checkouts(df, invalid_ids)
+
+    write_parquet_batches(
+        os.path.join(out_dir, "checkouts.parquet"),
+        clean_checkout_batches(),
+        clean_checkouts(concat_chunks([], POS_MEMBERS["checkouts.csv"]), invalid_ids)
+    )
+    valid_ids = np.concatenate(valid_ids or [np.array([], dtype="object")])
+    drop_ids = pd.unique(np.concatenate([cancelled_ids[~pd.Index(cancelled_ids).isin(valid_ids)], invalid_ids]))
+    for member, table, clean in [("items.csv", "items", clean_items), ("payments.csv", "payments", clean_payments)]:
+        write_parquet_batches(
+            os.path.join(out_dir, f"{table}.parquet"),
+            (clean(df, drop_ids) for df in iter_batches(member)),
+            clean(concat_chunks([], POS_MEMBERS[member]), drop_ids)
+        )
+
+
+def write_parquet_batches(path: str, dfs: Iterator[pd.DataFrame], df_empty: pd.DataFrame) -> None:
+    """
+    Write DataFrames into a single Parquet file one by one.\\
+    The schema is taken from the first non-empty DataFrame.
+    If all of them are empty, `df_empty` is written instead, so the file always exists.
+    """
+    writer = None
+    try:
+        for df in dfs:
+            if df.empty:
+                continue
+            if writer is None:
+                schema = pa.Schema.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        df_empty.to_parquet(path, index=False)
+
+
+def evict_cache(max_bytes: int = CACHE_MAX_BYTES) -> None:
+    """
+    Delete stale entries and the least recently used entries until the total size is within `max_bytes`.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        entry_dir = os.path.join(CACHE_DIR, name)
+        # Skip temporary directories being written
+        if name.startswith(".") or not os.path.isdir(entry_dir):
+            continue
+        meta = read_meta(entry_dir)
+        if meta is None or meta.get("schema_version") != SCHEMA_VERSION:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            continue
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+            last_access = os.path.getmtime(os.path.join(entry_dir, "meta.json"))
+        except OSError:
+            continue
+        entries.append((last_access, size, entry_dir))
+    # Keep the most recently used entries
+    total = 0
+    for _, size, entry_dir in sorted(entries, reverse=True):
+        total += size
+        if total > max_bytes:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+#--------------Cached loading--------------
+
+def load_zip_files_cached(zip_files: list[IO[bytes]], parallel: bool = False, keys: list[str] | None = None, on_progress: Callable[[int], None] | None = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Load zip files and return DataFrames of checkouts, items, and payments cleanuped by `clean_pos_tables()`,
+    and a dictionary of statistics.\\
+    Each zip file is identified by the hash of its content.
+    Cached zip files are loaded from Parquet files, and the others are loaded, cleanuped, and cached.
+    Large zip files are spooled to disk and cleaned in batches (see `cache_put_batched()`).\\
+    The statistics contain the number of rows, elapsed seconds, rows per second,
+    the peak resident set size during the loading and its increase from the start in bytes (see `measure_peak_memory()`),
+    and the numbers of cache hits and misses.\\
+    `keys` can be given when the hashes of the zip files have already been calculated.\\
+    `on_progress(rows)` is called with the number of cleanuped rows every time a zip file is ready.
+    It may be called from multiple threads, and an exception raised in it stops the loading.
+    """
+    start = time.perf_counter()
+    if keys is None:
+        keys = [hash_file(zip_file) for zip_file in zip_files]
+    if on_progress is None:
+        on_progress = lambda rows: None
+    # The memory is measured during this loading, not over the lifetime of the process
+    with measure_peak_memory() as memory:
+        tables = []
+        for key in keys:
+            t = cache_get(key)
+            if t is not None:
+                on_progress(sum(len(df) for df in t))
+            tables.append(t)
+        missing = [i for i, t in enumerate(tables) if t is None]
+        # Load and clean up the zip files that are not cached
+        engine = "pyarrow" if parallel else "pandas"
+
+        # Each zip file is cached as soon as it is cleanuped,
+        # so the finished zip files are not parsed again even if the loading is stopped halfway.
+        # Zip files larger than `LARGE_ZIP_BYTES` are cleaned in batches to bound the memory usage.
+        def load_and_clean(i: int) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+            if get_file_size(zip_files[i]) > LARGE_ZIP_BYTES:
+                t = cache_put_batched(keys[i], zip_files[i])
+            else:
+                t = clean_pos_tables(*load_zip_file(zip_files[i], engine=engine))
+                cache_put(keys[i], t)
+            on_progress(sum(len(df) for df in t))
+            return t
+
+        cleaned = map_zip_files(load_and_clean, missing, parallel=parallel)
+        for i, t in zip(missing, cleaned):
+            tables[i] = t
+        # Concatenate the DataFrames of all zip files at once
+        results = []
+        for n in range(len(TABLES)):
+            dfs = [t[n] for t in tables if not t[n].empty]
+            if dfs:
+                results.append(concat_chunks(dfs))
+            elif tables:
+                results.append(tables[0][n])
+            else:
+                results.append(pd.DataFrame())
+        df_checkouts, df_items, df_payments = results
+    seconds = time.perf_counter() - start
+    rows = len(df_checkouts) + len(df_items) + len(df_payments)
+    stats = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds > 0 else float("nan"),
+        "peak_memory": memory["peak"],
+        "memory_increase": None if memory["peak"] is None else memory["peak"] - memory["start"],
+        "cache_hits": len(zip_files) - len(missing),
+        "cache_misses": len(missing)
+    }
+    return df_checkouts, df_items, df_payments, stats
@@ -0,0 +1,159 @@
+import time
+import threading
+
+import streamlit as st
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Session state where the jobs of the current session are stored by name
+JOBS_KEY = "ingest_jobs"
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Jobs run in background threads, so the UI is not blocked and the user can move to other pages.
+# Background threads must not touch `st.session_state`.
+# A job only fills its own dictionary, and the result is committed to the session state
+# by `commit_finished_jobs()` in the script thread, so other pages never see half-loaded data.
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a background job when the user cancels it.
+    """
+
+
+#-------------Background-------------
+
+def check_cancelled(job: dict) -> None:
+    """
+    Raise `JobCancelled` if the job has been cancelled.
+    """
+    if job["cancel"].is_set():
+        raise JobCancelled()
+
+
+def report_progress(job: dict, rows: int = 0, done: int = 1) -> None:
+    """
+    Add the number of finished files and parsed rows to the progress of the job.\\
+    This function may be called from multiple threads.
+    It also works as a cancellation point, so the job stops after the current file.
+    """
+    with job["lock"]:
+        job["progress"]["done"] += done
+        job["progress"]["rows"] += rows
+    check_cancelled(job)
+
+
+def set_total(job: dict, total: int) -> None:
+    """
+    Set the number of files to be processed by the job.
+    """
+    with job["lock"]:
+        job["progress"]["total"] = total
+
+
+def run_job(job: dict, target, args: tuple) -> None:
+    """
+    Run `target(job, *args)` in a background thread and store the result or the error in the job.\\
+    The status is set last, so the result is always available when the status is "done".
+    """
+    try:
+        job["result"] = target(job, *args)
+        job["status"] = "done"
+    except JobCancelled:
+        job["status"] = "cancelled"
+    except Exception as e:
+        job["error"] = e
+        job["status"] = "failed"
+    job["finished"] = time.time()
+
+
+#----------------Script----------------
+
+def start_job(name: str, target, *args, on_done=None) -> dict:
+    """
+    Start `target(job, *args)` in a background thread and register the job in the session state as `name`.\\
+    `target` must not touch `st.session_state`; everything it needs has to be passed in `args`.\\
+    `on_done(result)` is called in the script thread by `commit_finished_jobs()` when the job has finished successfully.
+    """
+    job = {
+        "name": name,
+        "status": "running",
+        "progress": {"done": 0, "total": 0, "rows": 0},
+        "result": None,
+        "error": None,
+        "on_done": on_done,
+        "committed": False,
+        "started": time.time(),
+        "finished": None,
+        "cancel": threading.Event(),
+        "lock": threading.Lock()
+    }
+    if JOBS_KEY not in st.session_state:
+        st.session_state[JOBS_KEY] = {}
+    st.session_state[JOBS_KEY][name] = job
+    threading.Thread(target=run_job, args=(job, target, args), name=f"ingest-{name}", daemon=True).start()
+    return job
+
+
+def get_job(name: str) -> dict | None:
+    """
+    Return the job registered as `name`, or `None` if there is no such job.
+    """
+    return st.session_state.get(JOBS_KEY, {}).get(name)
+
+
+def is_running(name: str) -> bool:
+    """
+    Return `True` if the job registered as `name` is running.
+    """
+    job = get_job(name)
+    return job is not None and job["status"] == "running"
+
+
+def cancel_job(name: str) -> None:
+    """
+    Request the job registered as `name` to stop.
+    The job stops at the next cancellation point and nothing is committed.
+    """
+    job = get_job(name)
+    if job is not None:
+        job["cancel"].set()
+
+
+def pop_finished_job(name: str) -> dict | None:
+    """
+    Remove the job registered as `name` from the session state and return it if it has finished and been committed.\\
+    Otherwise, return `None`. This is used to show the result of a job only once.
+    """
+    job = get_job(name)
+    if job is None or not job["committed"]:
+        return None
+    return st.session_state[JOBS_KEY].pop(name)
+
+
+def get_running_jobs() -> list[dict]:
+    """
+    Return a list of running jobs of the current session.
+    """
+    return [job for job in st.session_state.get(JOBS_KEY, {}).values() if job["status"] == "running"]
+
+
+def commit_finished_jobs() -> None:
+    """
+    Commit the results of finished jobs to the session state by calling their `on_done()`.\\
+    This function is called at the beginning of every script run, so the results are committed
+    whichever page the user is on. Each job is committed only once.
+    """
+    for job in list(st.session_state.get(JOBS_KEY, {}).values()):
+        if job["status"] == "running" or job["committed"]:
+            continue
+        job["committed"] = True
+        if job["status"] == "done" and job["on_done"] is not None:
+            try:
+                job["on_done"](job["result"])
+            except Exception as e:
+                job["error"] = e
+                job["status"] = "failed"
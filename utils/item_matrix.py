@@ -0,0 +1,198 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.pos_schema import BUSINESS_HOURS
+from utils.pos_filters import STORES, get_hours_bit
+from utils.item_search import build_search_index, update_search_index
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Columns used to look up items, and the columns aggregated for them
+ITEM_KEYS = ["名前", "バーコード", "SKU"]
+ITEM_MEASURES = ["数量", "金額"]
+
+# Number of possible values of "時間帯"
+HOURS_VALUES = 2 ** len(BUSINESS_HOURS)
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Sales of items are aggregated once when POS data is committed into sparse matrices of
+# (store, day, value of "時間帯") × item, one for each column in `ITEM_KEYS`.
+# Items are the categories of the column, and the matrices are stored column by column (like CSC):
+# the entries of the j-th item are `indices[indptr[j]:indptr[j + 1]]` (rows) and the same range of each measure.
+# The entries in a period are selected once by `select_entries()`. The sales of an item are then a slice of the arrays,
+# and the totals of all items for the search (see `utils.item_search`) are a single `np.bincount()`.
+# Items are sold in positive quantities, so an entry exists if and only if the item was sold.
+# Each matrix also has the search index of its items (see `utils.item_search`).
+# When data is appended, only the new data is aggregated and merged into the existing entries (`update_item_matrices()`).
+
+
+def build_item_matrices(df_cus: pd.DataFrame, df_itm: pd.DataFrame, search: bool = True) -> dict:
+    """
+    Aggregate the sales of compact items by store, day, business hours, and item, and return the sparse matrices.\\
+    The search indexes of the items are not built if `search` is `False`.
+    """
+    stores = df_cus["アカウント名"].cat.categories.tolist()
+    days = df_cus["日付番号"].to_numpy().astype("int64")
+    day0 = int(days.min()) if len(days) else 0
+    n_days = int(days.max()) - day0 + 1 if len(days) else 0
+    # Rows of the checkouts of items
+    cus_rows = df_itm["会計行"].to_numpy()
+    codes = df_cus["アカウント名"].cat.codes.to_numpy().astype("int64")[cus_rows]
+    hours = df_cus["時間帯"].to_numpy().astype("int64")[cus_rows]
+    rows = (codes * n_days + days[cus_rows] - day0) * HOURS_VALUES + hours
+    n_rows = len(stores) * n_days * HOURS_VALUES
+
+    matrices = {"stores": stores, "day0": day0, "n_days": n_days}
+    for key in ITEM_KEYS:
+        items = df_itm[key].cat.categories
+        # Sort the entries by item and row, and sum the duplicates
+        entries, inverse = np.unique(df_itm[key].cat.codes.to_numpy().astype("int64") * n_rows + rows, return_inverse=True)
+        matrix = {
+            "items": items,
+            "indptr": np.searchsorted(entries // n_rows, np.arange(len(items) + 1)),
+            "indices": (entries % n_rows).astype("int64")
+        }
+        if search:
+            matrix["search"] = build_search_index(items)
+        for measure in ITEM_MEASURES:
+            matrix[measure] = np.bincount(inverse, weights=df_itm[measure].to_numpy(), minlength=len(entries)).astype("int64")
+        matrices[key] = matrix
+    return matrices
+
+
+def convert_rows(matrices: dict, rows: np.ndarray, stores: list[str], day0: int, n_days: int) -> np.ndarray:
+    """
+    Return the rows of the matrices converted to the rows of matrices with `stores` and days from `day0` to `day0 + n_days - 1`.\\
+    The stores of `matrices` must be in `stores`, and its days in the range.
+    """
+    codes = np.array([stores.index(s) for s in matrices["stores"]], dtype="int64")
+    n_days_old = max(matrices["n_days"], 1)
+    days = rows // HOURS_VALUES % n_days_old + matrices["day0"] - day0
+    return (codes[rows // HOURS_VALUES // n_days_old] * n_days + days) * HOURS_VALUES + rows % HOURS_VALUES
+
+
+def update_item_matrices(matrices: dict, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame) -> dict:
+    """
+    Return new matrices with compact customers and items appended.\\
+    Only the new data is aggregated, and its entries are inserted into the existing ones, which are already sorted.
+    New stores and items are added to the end, in the same order as the categories after `concat_pos_tables()`,
+    and only the new items are added to the search indexes.
+    The given matrices are not modified.
+    """
+    new = build_item_matrices(df_cus_new, df_itm_new, search=False)
+    stores = matrices["stores"] + [s for s in new["stores"] if s not in matrices["stores"]]
+    # Days covered by either of the matrices
+    ranges = [(m["day0"], m["day0"] + m["n_days"]) for m in (matrices, new) if m["n_days"] > 0]
+    day0 = min(r[0] for r in ranges) if ranges else 0
+    n_days = max(r[1] for r in ranges) - day0 if ranges else 0
+    n_rows = len(stores) * n_days * HOURS_VALUES
+
+    merged = {"stores": stores, "day0": day0, "n_days": n_days}
+    for key in ITEM_KEYS:
+        matrix, matrix_new = matrices[key], new[key]
+        items = matrix["items"].append(matrix_new["items"].difference(matrix["items"]))
+        # Existing stores and items keep their positions, so the existing entries stay sorted after the conversion
+        entries = np.repeat(np.arange(len(matrix["items"]), dtype="int64"), np.diff(matrix["indptr"])) * n_rows \
+            + convert_rows(matrices, matrix["indices"], stores, day0, n_days)
+        codes_new = items.get_indexer(matrix_new["items"]).astype("int64")
+        entries_new = np.repeat(codes_new, np.diff(matrix_new["indptr"])) * n_rows \
+            + convert_rows(new, matrix_new["indices"], stores, day0, n_days)
+        order = np.argsort(entries_new, kind="stable")
+        entries_new = entries_new[order]
+        # Sales on the rows of existing entries are added to them, and the others are inserted
+        positions = np.searchsorted(entries, entries_new)
+        is_found = np.zeros(len(entries_new), dtype=bool)
+        in_range = positions < len(entries)
+        is_found[in_range] = entries[positions[in_range]] == entries_new[in_range]
+        entries = np.insert(entries, positions[~is_found], entries_new[~is_found])
+        merged[key] = {
+            "items": items,
+            "indptr": np.searchsorted(entries // n_rows, np.arange(len(items) + 1)),
+            "indices": entries % n_rows,
+            "search": update_search_index(matrix["search"], items)
+        }
+        for measure in ITEM_MEASURES:
+            values = matrix[measure].copy()
+            values_new = matrix_new[measure][order]
+            values[positions[is_found]] += values_new[is_found]
+            merged[key][measure] = np.insert(values, positions[~is_found], values_new[~is_found])
+    return merged
+
+
+def get_row_mask(matrices: dict, rows: np.ndarray, date: tuple[datetime.date], store: str, business_hours: str) -> np.ndarray:
+    """
+    Return a boolean array selecting rows of the matrices by date, store, and business hours.
+    """
+    bit = get_hours_bit(business_hours)
+    days = rows // HOURS_VALUES % matrices["n_days"] + matrices["day0"]
+    left, right = ((pd.Timestamp(d) - pd.Timestamp("1970-01-01")).days for d in date)
+    is_selected = (((rows % HOURS_VALUES) & bit) > 0) & (left <= days) & (days <= right)
+    if store in STORES:
+        code = matrices["stores"].index(store) if store in matrices["stores"] else -1
+        is_selected &= rows // HOURS_VALUES // matrices["n_days"] == code
+    return is_selected
+
+
+def select_entries(matrices: dict, key: str, date: tuple[datetime.date], store: str, business_hours: str) -> np.ndarray:
+    """
+    Return a boolean array selecting the entries of the matrix of `key` by date, store, and business hours.\\
+    The same array is shared by the sales of an item and the totals of items.
+    """
+    return get_row_mask(matrices, matrices[key]["indices"], date, store, business_hours)
+
+
+#-------------Sales of an item-------------
+
+def get_item_sales(matrices: dict, key: str, item: str, is_selected: np.ndarray, measure: str) -> pd.DataFrame:
+    """
+    Return a DataFrame of daily `measure` of `item` by date (rows) and store (columns).\\
+    `key` is one of `ITEM_KEYS` by which `item` is looked up, and `is_selected` is returned by `select_entries()`.\\
+    This is the same as resampling the items of each store by day.
+    Days before the first sale and after the last sale of each store are missing (NaN).\\
+    Return an empty DataFrame if the item was not sold.
+    """
+    matrix = matrices[key]
+    if item not in matrix["items"]:
+        return pd.DataFrame()
+    j = matrix["items"].get_loc(item)
+    start, stop = matrix["indptr"][j], matrix["indptr"][j + 1]
+    is_selected = is_selected[start:stop]
+    rows = matrix["indices"][start:stop][is_selected]
+    values = matrix[measure][start:stop][is_selected]
+    codes = rows // HOURS_VALUES // matrices["n_days"]
+    days = rows // HOURS_VALUES % matrices["n_days"]
+    columns = {}
+    for s, name in enumerate(matrices["stores"]):
+        is_store = codes == s
+        if not is_store.any():
+            continue
+        first, last = days[is_store].min(), days[is_store].max()
+        sales = np.bincount(days[is_store] - first, weights=values[is_store], minlength=last - first + 1).astype("int64")
+        dates = pd.to_datetime(np.arange(first, last + 1) + matrices["day0"], unit="D")
+        columns[name] = pd.Series(sales, index=dates)
+    if not columns:
+        return pd.DataFrame()
+    df = pd.DataFrame(columns)
+    # All columns are float if any day is missing, as in `unstack()`
+    if df.isna().any(axis=None):
+        df = df.astype("float64")
+    df.index.name = "開始日時"
+    df.columns.name = "アカウント名"
+    return df
+
+
+#-------------Totals of items-------------
+
+def get_item_totals(matrices: dict, key: str, is_selected: np.ndarray) -> np.ndarray:
+    """
+    Return the total quantity of each item (category of `key`) in the entries selected by `select_entries()`.\\
+    The total is positive if and only if the item was sold in the selection.
+    """
+    matrix = matrices[key]
+    items = np.repeat(np.arange(len(matrix["items"])), np.diff(matrix["indptr"]))[is_selected]
+    return np.bincount(items, weights=matrix["数量"][is_selected], minlength=len(matrix["items"]))
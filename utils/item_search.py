@@ -0,0 +1,134 @@
+import os
+import bisect
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Maximum number of items returned by a search (candidates of the selectbox)
+SEARCH_RESULTS = int(os.environ.get("POSCOPE_SEARCH_RESULTS", 100))
+
+# Sizes of the n-grams indexed for the search of substrings
+GRAM_SIZES = (1, 2)
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Items ("名前", "バーコード", and "SKU") are looked up with an index built once with the item matrices
+# (see `utils.item_matrix`). Labels are normalized with NFKC, so full-width and half-width characters match each other.
+# Prefixes are found by binary search on the sorted labels, which works as a trie without building nodes,
+# and substrings by intersecting the lists of items containing each n-gram of the query.
+# The matches are scoped by the totals of items in the selected period, store, and business hours,
+# so only items sold there are returned, prefix matches first and then in descending order of sales.
+# When data is appended, only the labels of new items are indexed (`update_search_index()`).
+
+
+def normalize_text(text) -> str:
+    """
+    Return the text normalized for the search: NFKC, lower case, and without spaces.
+    """
+    return unicodedata.normalize("NFKC", str(text)).lower().replace(" ", "")
+
+
+def get_grams(name: str) -> set[str]:
+    """
+    Return the n-grams of a normalized label.
+    """
+    return {name[k:k + size] for size in GRAM_SIZES for k in range(len(name) - size + 1)}
+
+
+def build_search_index(items: pd.Index) -> dict:
+    """
+    Build the search index of the labels of `items`. Items are identified by their positions (category codes).
+    """
+    names = [normalize_text(item) for item in items]
+    order = sorted(range(len(names)), key=names.__getitem__)
+    postings = defaultdict(list)
+    for j, name in enumerate(names):
+        for gram in get_grams(name):
+            postings[gram].append(j)
+    return {
+        "names": names,
+        "sorted_names": [names[j] for j in order],
+        "order": np.array(order, dtype="int64"),
+        "grams": {gram: np.array(items, dtype="int64") for gram, items in postings.items()}
+    }
+
+
+def update_search_index(index: dict, items: pd.Index) -> dict:
+    """
+    Return a new search index of `items`, whose first items are the ones indexed by `index`.\\
+    Only the labels of the new items are normalized and indexed. The given index is not modified.
+    """
+    n = len(index["names"])
+    new_names = [normalize_text(item) for item in items[n:]]
+    if not new_names:
+        return index
+    names = index["names"] + new_names
+    # New items come after the existing items with the same label, as in the stable sort of `build_search_index()`
+    new_order = sorted(range(n, len(names)), key=names.__getitem__)
+    positions = [bisect.bisect_right(index["sorted_names"], names[j]) for j in new_order]
+    order = np.insert(index["order"], positions, new_order)
+    postings = defaultdict(list)
+    for j in range(n, len(names)):
+        for gram in get_grams(names[j]):
+            postings[gram].append(j)
+    grams = dict(index["grams"])
+    for gram, new_items in postings.items():
+        grams[gram] = np.concatenate([grams.get(gram, np.array([], dtype="int64")), np.array(new_items, dtype="int64")])
+    return {
+        "names": names,
+        "sorted_names": [names[j] for j in order],
+        "order": order,
+        "grams": grams
+    }
+
+
+def find_prefix(index: dict, query: str) -> np.ndarray:
+    """
+    Return the positions of the items whose normalized labels start with `query` (normalized).
+    """
+    left = bisect.bisect_left(index["sorted_names"], query)
+    right = bisect.bisect_left(index["sorted_names"], query + "\U0010ffff")
+    return index["order"][left:right]
+
+
+def find_substring(index: dict, query: str) -> np.ndarray:
+    """
+    Return the positions of the items whose normalized labels contain `query` (normalized), in ascending order.
+    """
+    size = min(len(query), max(GRAM_SIZES))
+    grams = {query[k:k + size] for k in range(len(query) - size + 1)}
+    if any(gram not in index["grams"] for gram in grams):
+        return np.array([], dtype="int64")
+    # Intersect from the rarest n-gram, so the candidates shrink quickly
+    candidates = None
+    for gram in sorted(grams, key=lambda gram: len(index["grams"][gram])):
+        posting = index["grams"][gram]
+        candidates = posting if candidates is None else np.intersect1d(candidates, posting, assume_unique=True)
+    # Having all n-grams does not mean containing the query when it is longer than the n-grams
+    if len(query) > size:
+        candidates = np.array([j for j in candidates if query in index["names"][j]], dtype="int64")
+    return candidates
+
+
+def search_items(index: dict, items: pd.Index, query: str, totals: np.ndarray, n: int = SEARCH_RESULTS) -> list:
+    """
+    Return the top `n` items matching `query` among the items with positive `totals` (sold in the selection).\\
+    Prefix matches come first, and then items are in descending order of `totals` and in the order of the categories.
+    All sold items are candidates if `query` is empty, so the candidates are the best-selling items in the selection.
+    """
+    query = normalize_text(query)
+    if query:
+        matched = find_substring(index, query)
+        matched = matched[totals[matched] > 0]
+        is_prefix = np.isin(matched, find_prefix(index, query))
+    else:
+        matched = np.flatnonzero(totals > 0)
+        is_prefix = np.zeros(len(matched), dtype=bool)
+    order = np.lexsort((matched, -totals[matched], ~is_prefix))
+    return items[matched[order[:n]]].tolist()
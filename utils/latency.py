@@ -0,0 +1,33 @@
+import time
+
+import streamlit as st
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Each section of the visualize and forecast pages is a fragment (`st.fragment`),
+# so changing its options reruns only the section instead of the whole page.
+# The time to update a section is shown with the time of the last full run of the page,
+# which is what every change of options took before the sections were fragments.
+
+
+def show_section_latency(page: str, start: float) -> None:
+    """
+    Show the time since `start` (`time.perf_counter()`) as the latency of a section of `page`.
+    """
+    ms = (time.perf_counter() - start) * 1000
+    text = f":material/timer: 更新時間：{ms:,.0f}ms"
+    full_ms = st.session_state.get("page_latency", {}).get(page)
+    if full_ms is not None:
+        text += f"（ページ全体の再実行：{full_ms:,.0f}ms）"
+    st.caption(text)
+
+
+def show_page_latency(page: str, start: float) -> None:
+    """
+    Show the time since `start` (`time.perf_counter()`) as the latency of a full run of `page`, and keep it in the session state.\\
+    Call this at the end of the page, outside of fragments, so that it is updated only by full runs.
+    """
+    ms = (time.perf_counter() - start) * 1000
+    st.session_state.setdefault("page_latency", {})[page] = ms
+    st.caption(f":material/timer: ページ全体の更新時間：{ms:,.0f}ms")
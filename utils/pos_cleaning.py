@@ -0,0 +1,228 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Formats of date and time in the CSV files exported from Ubiregi (ex. "2024-04-01 12:00:00 +0900").
+# Only the local time (the first 19 characters) is parsed with these formats, which is much faster than "%z".
+# They are tried in order, and pandas infers the format only when none of them matches.
+DATETIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"]
+# What may follow the local time: a UTC offset such as " +0900", "+09:00", or "Z"
+TZ_SUFFIX = re.compile(r" ?([+-]\d{2}:?\d{2}|Z)?")
+
+# Account names to more straightforward ones
+ACCOUNT_NAMES = {"ub396203": "西食堂", "ub396207": "東カフェテリア"}
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+def parse_datetime(s: pd.Series) -> pd.Series:
+    """
+    Parse a Series of date and time strings and drop the time zone.\\
+    The local time is kept, ex. "2024-04-01 12:00:00 +0900" becomes 2024-04-01 12:00:00.\\
+    The formats in `DATETIME_FORMATS` are tried first, and the format is inferred by pandas if none of them matches.
+    """
+    # Only a few distinct suffixes (usually only " +0900") have to be checked
+    suffixes = s.str.slice(19).dropna().unique() if pd.api.types.is_string_dtype(s) else [None]
+    if all(suffix is not None and TZ_SUFFIX.fullmatch(suffix) for suffix in suffixes):
+        local = s.str.slice(0, 19)
+        for fmt in DATETIME_FORMATS:
+            try:
+                return pd.to_datetime(local, format=fmt)
+            except ValueError:
+                continue
+    parsed = pd.to_datetime(s)
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        return parsed.dt.tz_localize(None)
+    if parsed.dtype == "object":
+        # Mixed time zones cannot be handled in a vectorized way
+        return parsed.map(lambda x: x.tz_localize(None)).astype("datetime64[ns]")
+    return parsed
+
+
+def get_cancelled_ids(df_checkouts: pd.DataFrame) -> np.ndarray:
+    """
+    Return "会計ID" of cancelled checkouts.\\
+    Non-NA value in "削除日時" means that the record is cancelled.
+    A checkout is regarded as cancelled only when none of its records is valid.
+    """
+    is_cancelled = df_checkouts["削除日時"].notna().to_numpy()
+    valid_ids = df_checkouts["会計ID"][~is_cancelled]
+    cancelled_ids = df_checkouts["会計ID"][is_cancelled]
+    return cancelled_ids[~cancelled_ids.isin(valid_ids)].unique()
+
+
+def get_invalid_ids(df_items: pd.DataFrame) -> np.ndarray:
+    """
+    Return "会計ID" of checkouts with invalid items.\\
+    A negative value in "数量" seems to indicate that the transaction has been cancelled, so remove those records.
+    While there seems no record with zero value in "数量", remove those records as well.
+    """
+    return df_items["会計ID"][df_items["数量"].le(0).fillna(False).to_numpy(dtype=bool)].unique()
+
+
+def clean_checkouts(df_checkouts: pd.DataFrame, drop_ids: np.ndarray) -> pd.DataFrame:
+    """
+    Return a cleanuped DataFrame of checkouts without cancelled records and checkouts in `drop_ids`.
+    """
+    df_checkouts = df_checkouts[
+        ["アカウント名", "会計ID", "開始日時", "会計日時", "削除日時", "金額", "客数"]
+    ]
+    df_checkouts = df_checkouts[df_checkouts["削除日時"].isna().to_numpy()].drop(columns=["削除日時"])
+    df_checkouts = df_checkouts[~df_checkouts["会計ID"].isin(drop_ids)]
+    df_checkouts = df_checkouts.drop_duplicates(subset="会計ID")
+    # Change the account names and modify the data types
+    df_checkouts = df_checkouts.assign(**{
+        "アカウント名": df_checkouts["アカウント名"].replace(ACCOUNT_NAMES), 
+        "開始日時": parse_datetime(df_checkouts["開始日時"]), 
+        "会計日時": parse_datetime(df_checkouts["会計日時"])
+    })
+    return df_checkouts.astype({"会計ID": "str", "金額": "int", "客数": "int"})
+
+
+def clean_items(df_items: pd.DataFrame, drop_ids: np.ndarray) -> pd.DataFrame:
+    """
+    Return a cleanuped DataFrame of items without checkouts in `drop_ids`.\\
+    Items have no key, so duplicates are dropped by all columns.
+    """
+    df_items = df_items[
+        ["会計ID", "SKU", "バーコード",  "名前", "数量", "金額", "部門"]
+    ]
+    df_items = df_items[~df_items["会計ID"].isin(drop_ids)]
+    df_items = df_items.drop_duplicates()
+    return df_items.astype({"会計ID": "str", "SKU": "str", "バーコード": "str",
+                            "名前": "str", "数量": "int", "金額": "int", "部門": "str"})
+
+
+def clean_payments(df_payments: pd.DataFrame, drop_ids: np.ndarray) -> pd.DataFrame:
+    """
+    Return a cleanuped DataFrame of payments without checkouts in `drop_ids`.\\
+    Empty entries in "支払い方法" are change of payment, so they are removed.
+    """
+    df_payments = df_payments[["会計ID", "支払い方法"]]
+    df_payments = df_payments[~df_payments["会計ID"].isin(drop_ids)]
+    df_payments = df_payments[df_payments["支払い方法"].notna()]
+    df_payments = df_payments.drop_duplicates(subset=["会計ID", "支払い方法"])
+    return df_payments.astype({"会計ID": "str", "支払い方法": "str"})
+
+
+def clean_pos_tables(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Return cleanuped DataFrames of checkouts, items, and payments.\\
+    Each record is cleaned independently of the other zip files,
+    so this function can be applied to every zip file separately and the results can be cached.\\
+    Payments are kept in a long format (会計ID, 支払い方法) and one-hot encoded in `merge_pos_tables()`.\\
+    Records are removed by semi-joins on "会計ID" instead of merging DataFrames.\\
+    Each table is cleaned by its own function once the checkouts to be removed are known,
+    so large zip files can be cleaned in batches (see `utils.ingest_cache`).
+    """
+    # Remove the cancelled and invalid checkouts from all DataFrames at once
+    drop_ids = pd.unique(np.concatenate([get_cancelled_ids(df_checkouts), get_invalid_ids(df_items)]))
+    df_checkouts = clean_checkouts(df_checkouts, drop_ids)
+    df_items = clean_items(df_items, drop_ids)
+    df_payments = clean_payments(df_payments, drop_ids)
+    return df_checkouts, df_items, df_payments
+
+
+def merge_pos_tables(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Merge DataFrames cleanuped by `clean_pos_tables()` and return DataFrames of customers and items.\\
+    The DataFrames may be concatenated from multiple zip files, so duplicates between zip files are dropped here.\\
+    Rows are joined by integer positions of "会計ID", and the order of rows is the same as `pd.merge()`.\\
+    Items are normalized: instead of copying the columns of checkouts into every item,
+    "会計行" holds the row position of the checkout in the DataFrame of customers.
+    The columns of checkouts for items are gathered by `take()` with "会計行".
+    """
+    # Drop duplicates between zip files
+    df_checkouts = df_checkouts.drop_duplicates(subset="会計ID")
+    df_items = df_items.drop_duplicates()
+    df_payments = df_payments.drop_duplicates(subset=["会計ID", "支払い方法"])
+
+    # One-hot encoding on "支払い方法" to cope with multiple payment methods in a single checkout.
+    pay_codes, pay_ids = pd.factorize(df_payments["会計ID"])
+    pm_codes, pms = pd.factorize(df_payments["支払い方法"], sort=True)
+    onehot = np.zeros((len(pay_ids), len(pms)), dtype="int")
+    np.add.at(onehot, (pay_codes, pm_codes), 1)
+
+    # Inner join of checkouts and payments
+    pos = pd.Index(pay_ids).get_indexer(df_checkouts["会計ID"])
+    has_payment = pos >= 0
+    df_customers = df_checkouts[has_payment].reset_index(drop=True)
+    df_customers[list(pms)] = onehot[pos[has_payment]]
+
+    # Inner join of customers and items
+    # Items are ordered by the customers, and the original order is kept within the same customer.
+    pos = pd.Index(df_customers["会計ID"]).get_indexer(df_items["会計ID"])
+    has_customer = pos >= 0
+    pos = pos[has_customer]
+    order = np.argsort(pos, kind="stable")
+    df_items = df_items[has_customer].drop(columns=["会計ID"]).take(order).reset_index(drop=True)
+    df_items.insert(0, "会計行", pos[order])
+
+    return df_customers, df_items
+
+
+def cleanup_pos(df_checkouts: pd.DataFrame, df_items: pd.DataFrame, df_payments: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return cleanuped POS data with the original implementation, which merges DataFrames to filter records.\\
+    This is kept only as the reference implementation for the equivalence tests of `clean_pos_tables()` and
+    `merge_pos_tables()` (see `tests/test_pos_cleaning.py`). The app does not call it.\\
+    Unlike `merge_pos_tables()`, items have the columns of their checkouts instead of "会計行".
+    """
+    # Filter columns
+    df_checkouts = df_checkouts[
+        ["アカウント名", "会計ID", "開始日時", "会計日時", "削除日時", "金額", "客数"]
+    ]
+    df_items = df_items[
+        ["会計ID", "SKU", "バーコード",  "名前", "数量", "金額", "部門"]
+    ]
+    df_payments = df_payments[["会計ID", "支払い方法"]]
+
+    # Drop duplicates
+    df_checkouts = df_checkouts.drop_duplicates()
+    df_items = df_items.drop_duplicates()
+    df_payments = df_payments.drop_duplicates()
+
+    # Delete cancelled records
+    # Non-NA value in "削除日時" means that the record is cancelled
+    cancelled = df_checkouts[["会計ID", "削除日時"]]
+    df_checkouts = df_checkouts[df_checkouts["削除日時"].isna()].drop(columns=["削除日時"])
+    df_items = pd.merge(df_items, cancelled, on="会計ID", how="left")
+    df_items = df_items[df_items["削除日時"].isna()].drop(columns=["削除日時"])
+    df_payments = pd.merge(df_payments, cancelled, on="会計ID", how="left")
+    df_payments = df_payments[df_payments["削除日時"].isna()].drop(columns=["削除日時"])
+
+    # Empty entries in "支払い方法" are change of payment, so remove them
+    df_payments = df_payments[df_payments["支払い方法"].notna()]
+
+    # A negative value in "数量" seems to indicate that the transaction has been cancelled, so remove those records.
+    # While there seems no record with zero value in "数量", remove those records as well.
+    invalid_cnt = df_items.query('数量 <= 0')["会計ID"].to_list()
+    df_checkouts = df_checkouts[~df_checkouts["会計ID"].isin(invalid_cnt)]
+    df_items = df_items[~df_items["会計ID"].isin(invalid_cnt)]
+    df_payments = df_payments[~df_payments["会計ID"].isin(invalid_cnt)]
+
+    # Change the account names to more straightforward ones
+    df_checkouts = df_checkouts.replace({"アカウント名": ACCOUNT_NAMES})
+
+    # One-hot encoding on "支払い方法" to cope with multiple payment methods in a single checkout.
+    df_payments = pd.get_dummies(df_payments, columns=["支払い方法"], 
+                                 prefix="", prefix_sep="", dtype="int")
+    df_payments = df_payments.groupby("会計ID").sum().reset_index()
+
+    # Modigy the data types
+    df_checkouts["開始日時"] = pd.to_datetime(df_checkouts["開始日時"]).map(lambda x: x.tz_localize(None))
+    df_checkouts["会計日時"] = pd.to_datetime(df_checkouts["会計日時"]).map(lambda x: x.tz_localize(None))
+    df_checkouts = df_checkouts.astype({"会計ID": "str", "金額": "int", "客数": "int"})
+    df_items = df_items.astype({"会計ID": "str", "SKU": "str", "バーコード": "str", 
+                                "名前": "str", "数量": "int", "金額": "int", "部門": "str"})
+    df_payments = df_payments.astype({"会計ID": "str"})
+
+    # Merge the DataFrames
+    df_customers = pd.merge(df_checkouts, df_payments, on="会計ID", how="inner")
+    df_items = pd.merge(df_customers[["アカウント名", "会計ID", "開始日時", "会計日時"]], df_items, on="会計ID", how="inner")
+
+    return df_customers, df_items
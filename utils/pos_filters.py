@@ -0,0 +1,93 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.pos_schema import BUSINESS_HOURS
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Options of business hours in the pages and their keys in `BUSINESS_HOURS`
+BUSINESS_HOURS_OPTIONS = {
+    "昼（11:00～14:00）": "lunch",
+    "夜（17:30～19:30）": "dinner",
+    "昼・夜": "open"
+}
+
+# Options of stores which select a single store. The others (ex. "両方") select all stores.
+STORES = ["西食堂", "東カフェテリア"]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Filters on the tables compacted by `compact_pos_tables()`.
+# Customers are sorted by store and "開始日時", so stores and dates are selected as ranges of rows found by binary search.
+# A single range is returned as a slice without copying, and the cost depends on the size of the range,
+# not on the whole history. Business hours are then applied to the selected rows with the bit flags in "時間帯".
+
+
+#-------------Row ranges-------------
+
+def get_store_ranges(df_cus: pd.DataFrame, store: str) -> list[tuple[int, int]]:
+    """
+    Return the ranges of rows of customers of `store`, as a list of (start, stop).\\
+    Every store has its own range if `store` is not one of `STORES`.
+    """
+    codes = df_cus["アカウント名"].cat.codes.to_numpy()
+    categories = df_cus["アカウント名"].cat.categories
+    if store not in STORES:
+        targets = range(len(categories))
+    elif store in categories:
+        targets = [categories.get_loc(store)]
+    else:
+        targets = []
+    ranges = []
+    for code in targets:
+        # The keys must have the same type as the array, otherwise the whole array is converted
+        start, stop = np.searchsorted(codes, np.array([code, code + 1], dtype=codes.dtype))
+        if start < stop:
+            ranges.append((int(start), int(stop)))
+    return ranges
+
+
+def get_row_ranges(df_cus: pd.DataFrame, date: tuple[datetime.date], store: str) -> list[tuple[int, int]]:
+    """
+    Return the ranges of rows of customers of `store` from `date[0]` to `date[1]`, including both ends.
+    """
+    left_date = np.datetime64(pd.Timestamp(date[0]), "ns")
+    right_date = np.datetime64(pd.Timestamp(date[1]) + pd.Timedelta("1D"), "ns")
+    start_times = df_cus["開始日時"].to_numpy()
+    ranges = []
+    for start, stop in get_store_ranges(df_cus, store):
+        left, right = np.searchsorted(start_times[start:stop], np.array([left_date, right_date]))
+        ranges.append((start + int(left), start + int(right)))
+    return ranges
+
+
+def slice_rows(df: pd.DataFrame, ranges: list[tuple[int, int]]) -> pd.DataFrame:
+    """
+    Return the rows of `df` in the ranges. The index is kept.\\
+    A single range is a slice of `df` and nothing is copied.
+    """
+    if len(ranges) == 1:
+        return df.iloc[ranges[0][0]:ranges[0][1]]
+    return pd.concat([df.iloc[start:stop] for start, stop in ranges]) if ranges else df.iloc[:0]
+
+
+#-------------Business hours-------------
+
+def get_hours_bit(business_hours: str) -> np.uint8:
+    """
+    Return the bit of `business_hours`, one of `BUSINESS_HOURS_OPTIONS`, in "時間帯".
+    Any other value selects the whole opening hours.
+    """
+    hours = BUSINESS_HOURS_OPTIONS.get(business_hours, "open")
+    return np.uint8(1) << np.uint8(list(BUSINESS_HOURS).index(hours))
+
+
+def get_hours_mask(df_cus: pd.DataFrame, business_hours: str) -> np.ndarray:
+    """
+    Return a boolean array selecting checkouts started in `business_hours`.
+    """
+    return (df_cus["時間帯"].to_numpy() & get_hours_bit(business_hours)) > 0
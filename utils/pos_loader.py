@@ -0,0 +1,291 @@
+import os
+import shutil
+import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from pandas._libs.parsers import STR_NA_VALUES
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Only the columns used by `clean_pos_tables()` are parsed.
+# The dtypes are fixed so that pandas does not need to infer them for every file.
+# Integers are read as nullable integers because cancelled records may have empty cells.
+# Date and time columns are kept as strings here and parsed in `clean_pos_tables()`.
+CHECKOUTS_DTYPES = {
+    "アカウント名": "str",
+    "会計ID": "str",
+    "開始日時": "str",
+    "会計日時": "str",
+    "削除日時": "str",
+    "金額": "Int64",
+    "客数": "Int64"
+}
+ITEMS_DTYPES = {
+    "会計ID": "str",
+    "SKU": "str",
+    "バーコード": "str",
+    "名前": "str",
+    "数量": "Int64",
+    "金額": "Int64",
+    "部門": "str"
+}
+PAYMENTS_DTYPES = {
+    "会計ID": "str",
+    "支払い方法": "str"
+}
+
+# Files in a zip file exported from Ubiregi and their dtypes
+POS_MEMBERS = {
+    "checkouts.csv": CHECKOUTS_DTYPES,
+    "items.csv": ITEMS_DTYPES,
+    "payments.csv": PAYMENTS_DTYPES
+}
+
+# The same dtypes for pyarrow's CSV reader
+ARROW_TYPES = {"str": pa.string(), "Int64": pa.int64()}
+# int64 columns in pyarrow may contain nulls, so convert them into nullable integers in pandas
+ARROW_TO_PANDAS = {pa.int64(): pd.Int64Dtype()}
+# Cells read as NA by pyarrow. pyarrow's defaults differ from those of `pd.read_csv()` (ex. "None" and "<NA>"),
+# and cached tables do not depend on the engine which loaded the file first only if both engines use the same values.
+ARROW_NULL_VALUES = sorted(STR_NA_VALUES)
+
+# Zip files larger than this size in bytes are spooled to disk and cleaned in batches.
+# Parsed in memory at once, a zip file takes about 30 times its size.
+LARGE_ZIP_BYTES = int(os.environ.get("POSCOPE_LARGE_ZIP_BYTES", 32 * 1024**2))
+# Size in bytes of CSV text parsed at once in the batch mode.
+# pyarrow reads up to 32 blocks ahead in the background, so the memory usage is bounded by about 32 times this size.
+BATCH_BYTES = int(os.environ.get("POSCOPE_BATCH_BYTES", 1024**2))
+
+# Interval in seconds to sample the memory usage during a loading, and the size of a memory page in bytes
+MEMORY_SAMPLING_SECONDS = 0.01
+PAGE_BYTES = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+def read_pos_csv(f: IO[bytes], dtypes: dict[str, str]) -> pd.DataFrame:
+    """
+    Read a CSV file encoded in Shift-JIS from a file-like object.\\
+    Only the columns in `dtypes` are parsed.
+    """
+    return pd.read_csv(f, encoding="shift-jis", usecols=list(dtypes), dtype=dtypes)
+
+
+def read_pos_csv_arrow(f: IO[bytes], dtypes: dict[str, str]) -> pd.DataFrame:
+    """
+    Read a CSV file encoded in Shift-JIS from a file-like object with pyarrow's multithreaded CSV reader.\\
+    The file is transcoded from Shift-JIS to UTF-8 while reading.\\
+    Only the columns in `dtypes` are parsed, and the result has the same dtypes as `read_pos_csv()`.
+    """
+    table = pa_csv.read_csv(
+        f,
+        read_options=pa_csv.ReadOptions(encoding="shift_jis", use_threads=True),
+        convert_options=get_convert_options(dtypes)
+    )
+    return arrow_to_pandas(table, dtypes)
+
+
+def get_convert_options(dtypes: dict[str, str]) -> pa_csv.ConvertOptions:
+    """
+    Return the options of pyarrow's CSV reader to parse the columns in `dtypes` like `read_pos_csv()`.
+    """
+    return pa_csv.ConvertOptions(
+        include_columns=list(dtypes),
+        column_types={col: ARROW_TYPES[dtype] for col, dtype in dtypes.items()},
+        # The same cells as `pd.read_csv()` are NA, including empty strings
+        null_values=ARROW_NULL_VALUES,
+        strings_can_be_null=True
+    )
+
+
+def arrow_to_pandas(table: pa.Table, dtypes: dict[str, str]) -> pd.DataFrame:
+    """
+    Convert a table read by pyarrow's CSV reader into a DataFrame with the same dtypes as `read_pos_csv()`.
+    """
+    df = table.to_pandas(types_mapper=ARROW_TO_PANDAS.get)
+    # Nulls in string columns become `None` in pyarrow, but `NaN` in pandas.
+    # `where()` keeps the columns as object, while `fillna()` would downcast all-null columns (deprecated).
+    str_cols = [col for col, dtype in dtypes.items() if dtype == "str"]
+    df[str_cols] = df[str_cols].where(df[str_cols].notna(), np.nan)
+    return df
+
+
+def iter_pos_csv_batches(f: IO[bytes], dtypes: dict[str, str], block_size: int = BATCH_BYTES) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV file encoded in Shift-JIS from a file-like object in batches of about `block_size` bytes.\\
+    The memory usage is bounded by `block_size` (see `BATCH_BYTES`) and does not depend on the size of the file.\\
+    Each batch has the same dtypes as `read_pos_csv()`. Empty or all-NA batches are skipped.
+    """
+    reader = pa_csv.open_csv(
+        f,
+        read_options=pa_csv.ReadOptions(encoding="shift_jis", block_size=block_size),
+        convert_options=get_convert_options(dtypes)
+    )
+    for batch in reader:
+        df = arrow_to_pandas(pa.Table.from_batches([batch]), dtypes)
+        if df.empty or df.isna().all().all():
+            continue
+        yield df
+
+
+def read_pos_zip(zip_file: IO[bytes], engine: str = "pandas") -> dict[str, list[pd.DataFrame]]:
+    """
+    Read checkouts.csv, items.csv, and payments.csv in a zip file and return a dictionary of lists of DataFrames.\\
+    Each member is streamed from the zip file without buffering the whole member in memory.\\
+    `engine` is either "pandas" or "pyarrow".\\
+    Empty or all-NA DataFrames are skipped.
+    """
+    read_csv = read_pos_csv_arrow if engine == "pyarrow" else read_pos_csv
+    chunks = {member: [] for member in POS_MEMBERS}
+    with zipfile.ZipFile(zip_file) as zf:
+        for file in zf.namelist():
+            if file not in POS_MEMBERS:
+                continue
+            with zf.open(file) as f:
+                tmp = read_csv(f, POS_MEMBERS[file])
+            # Concatenate with empty or all-NA DataFrame will be deprecated,
+            # so if the loaded DataFrame is empty or all-NA, skip it.
+            if tmp.empty or tmp.isna().all().all():
+                continue
+            chunks[file].append(tmp)
+    return chunks
+
+
+def concat_chunks(chunks: list[pd.DataFrame], dtypes: dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Concatenate DataFrames at once.\\
+    Return an empty DataFrame if there is nothing to concatenate.
+    If `dtypes` is given, the empty DataFrame has the columns and dtypes of `dtypes`.
+    """
+    if not chunks:
+        if dtypes is None:
+            return pd.DataFrame()
+        return pd.DataFrame(columns=list(dtypes)).astype(dtypes)
+    return pd.concat(chunks, axis="index", ignore_index=True)
+
+
+def get_file_size(f: IO[bytes]) -> int:
+    """
+    Return the size of a file-like object in bytes.
+    The position of the file is reset to the beginning.
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    return size
+
+
+def get_file_path(f: IO[bytes]) -> str | None:
+    """
+    Return the path of a file-like object if it is a file opened from disk, otherwise `None`.\\
+    Uploaded files also have a name (the name of the file on the client), so the name must be the opened file itself.
+    """
+    path = getattr(f, "name", None)
+    if not isinstance(path, str):
+        return None
+    try:
+        return path if os.path.samestat(os.fstat(f.fileno()), os.stat(path)) else None
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def spool_to_disk(f: IO[bytes]) -> Iterator[str]:
+    """
+    Yield the path of a file-like object on disk, copying it into a temporary file in chunks if it is in memory.\\
+    A zip file opened from the path is read from disk on demand,
+    so its members can be streamed without holding the archive in memory.
+    Files already on disk (ex. in the watched folder) are not copied. The temporary file is deleted on exit.
+    """
+    path = get_file_path(f)
+    if path is not None:
+        yield path
+        return
+    f.seek(0)
+    fd, path = tempfile.mkstemp(prefix="poscope-", suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            shutil.copyfileobj(f, tmp, BATCH_BYTES)
+        f.seek(0)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def load_zip_file(zip_file: IO[bytes], engine: str = "pandas") -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Load a single zip file and return DataFrames of checkouts, items, and payments.\\
+    Missing or empty files result in empty DataFrames with the expected columns,
+    so the DataFrames can be passed to `clean_pos_tables()` as they are.
+    """
+    chunks = read_pos_zip(zip_file, engine=engine)
+    return tuple(concat_chunks(chunks[member], dtypes) for member, dtypes in POS_MEMBERS.items())
+
+
+def map_zip_files(func, zip_files: list, parallel: bool = False) -> list:
+    """
+    Apply `func` to every zip file and return a list of the results in the order of `zip_files`.\\
+    When `parallel` is `True`, the zip files are distributed over a thread pool.
+    Decompression and parsing release the GIL, so threads are enough to use multiple cores.\\
+    If `func` raises an exception (ex. the loading is cancelled), the zip files not started yet are skipped.
+    """
+    if parallel and len(zip_files) > 1:
+        max_workers = min(len(zip_files), os.cpu_count() or 1)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            return list(executor.map(func, zip_files))
+        finally:
+            executor.shutdown(cancel_futures=True)
+    return [func(zip_file) for zip_file in zip_files]
+
+
+def get_rss() -> int | None:
+    """
+    Return the current resident set size of the process in bytes.\\
+    Return `None` if it is not available on the platform (only Linux provides "/proc/self/statm").
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_BYTES
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@contextmanager
+def measure_peak_memory(interval: float = MEMORY_SAMPLING_SECONDS) -> Iterator[dict]:
+    """
+    Sample the resident set size every `interval` seconds in a background thread while the block runs,
+    and yield a dictionary which has the results after the block:
+    "start" is the resident set size before the block, and "peak" is the largest one during the block in bytes.\\
+    Unlike the peak of the whole process (`ru_maxrss`), the values are not affected by earlier loads of a long-running server.
+    They are `None` if the resident set size is not available.\\
+    The resident set size is shared by the whole process, so other sessions loading at the same time are included.
+    """
+    usage = {"start": get_rss(), "peak": None}
+    if usage["start"] is None:
+        yield usage
+        return
+    usage["peak"] = usage["start"]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            usage["peak"] = max(usage["peak"], get_rss() or 0)
+
+    thread = threading.Thread(target=sample, name="measure-peak-memory", daemon=True)
+    thread.start()
+    try:
+        yield usage
+    finally:
+        stop.set()
+        thread.join()
+        usage["peak"] = max(usage["peak"], get_rss() or 0)
@@ -0,0 +1,102 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.query_cache import cache_query
+from utils.customer_tensor import get_customers_by_slot, get_customers_by_day
+from utils.item_matrix import select_entries, get_item_sales, get_item_totals
+from utils.item_search import search_items
+from utils.daily_cube import get_department_sales, get_department_ranking, get_payment_users
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# Queries of the visualize page.
+# Each query takes the version of the POS data ("pos_version" in the session state), the aggregated data,
+# and the options as explicit arguments, so it does not depend on the session state and is memoized by `cache_query()`.
+# The data is passed with arguments starting with an underscore, which are identified by the version.
+# Reruns with the same options and sessions following the same watched folder share the results.
+
+
+#-------------Customers-------------
+
+@cache_query
+def query_customers_by_slot(version: str, _tensor: dict, _df_cus: pd.DataFrame, date: tuple[datetime.date], store: str, span: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return the number of customers by time slot and date. See `get_customers_by_slot()`.
+    """
+    return get_customers_by_slot(_tensor, _df_cus, date, store, span, business_hours)
+
+
+@cache_query
+def query_customers_by_day(version: str, _tensor: dict, date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return the number of customers by date and store. See `get_customers_by_day()`.
+    """
+    return get_customers_by_day(_tensor, date, store, business_hours)
+
+
+@cache_query
+def query_payment_users(version: str, _cube: dict, date: tuple[datetime.date], store: str, business_hours: str) -> pd.DataFrame:
+    """
+    Return the total number of users of each payment method. See `get_payment_users()`.
+    """
+    return get_payment_users(_cube, date, store, business_hours)
+
+
+#-------------Items-------------
+
+@cache_query
+def query_item_entries(version: str, _matrices: dict, key: str, date: tuple[datetime.date], store: str, business_hours: str) -> np.ndarray:
+    """
+    Return the entries of the item matrix selected by the options. See `select_entries()`.\\
+    The chart of an item and the list of candidates share the same selection.
+    """
+    return select_entries(_matrices, key, date, store, business_hours)
+
+
+@cache_query
+def query_item_sales(version: str, _matrices: dict, key: str, item: str, date: tuple[datetime.date], store: str, business_hours: str, measure: str) -> pd.DataFrame:
+    """
+    Return the daily sales of an item by date and store. See `get_item_sales()`.
+    """
+    is_selected = query_item_entries(version, _matrices, key, date, store, business_hours)
+    return get_item_sales(_matrices, key, item, is_selected, measure)
+
+
+@cache_query
+def query_item_totals(version: str, _matrices: dict, key: str, date: tuple[datetime.date], store: str, business_hours: str) -> np.ndarray:
+    """
+    Return the total quantity of each item in the selected period. See `get_item_totals()`.
+    """
+    is_selected = query_item_entries(version, _matrices, key, date, store, business_hours)
+    return get_item_totals(_matrices, key, is_selected)
+
+
+@cache_query
+def query_item_search(version: str, _matrices: dict, key: str, query: str, date: tuple[datetime.date], store: str, business_hours: str) -> list:
+    """
+    Return the items sold in the selected period which match `query`, best matches first. See `search_items()`.\\
+    The totals are shared by all queries in the same period, so typing a query only searches the index.
+    """
+    totals = query_item_totals(version, _matrices, key, date, store, business_hours)
+    return search_items(_matrices[key]["search"], _matrices[key]["items"], query, totals)
+
+
+#-------------Departments-------------
+
+@cache_query
+def query_department_sales(version: str, _cube: dict, department: str, date: tuple[datetime.date], store: str, business_hours: str, measure: str) -> pd.DataFrame:
+    """
+    Return the daily sales of a department by date and store. See `get_department_sales()`.
+    """
+    return get_department_sales(_cube, department, date, store, business_hours, measure)
+
+
+@cache_query
+def query_department_ranking(version: str, _cube: dict, date: tuple[datetime.date], store: str, business_hours: str) -> list[str]:
+    """
+    Return the departments sold in the selected period in descending order of quantity. See `get_department_ranking()`.
+    """
+    return get_department_ranking(_cube, date, store, business_hours)
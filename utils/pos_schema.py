@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Columns of customers other than payment methods
+CUSTOMER_COLUMNS = ["アカウント名", "会計ID", "開始日時", "会計日時", "金額", "客数"]
+
+# Low-cardinality text columns stored as categoricals
+CATEGORICAL_COLUMNS = {
+    "customers": ["アカウント名"],
+    "items": ["SKU", "バーコード", "名前", "部門"]
+}
+
+# Integer columns downcast to the narrowest type
+INTEGER_COLUMNS = {
+    "customers": ["金額", "客数"],
+    "items": ["数量", "金額"]
+}
+
+# Columns of customers derived from "開始日時" when the tables are compacted, so that pages can filter checkouts
+# with integer masks instead of `set_index()` and `between_time()` on every run.
+# 日付番号: days since 1970-01-01, 分: minute of the day, 曜日: 0 (Monday) to 6 (Sunday), 時間帯: bit flags of `BUSINESS_HOURS`
+TIME_COLUMNS = ["日付番号", "分", "曜日", "時間帯"]
+
+# Business hours whose i-th item is the i-th bit in "時間帯".
+# Both ends are included, as in `pd.DataFrame.between_time()`.
+BUSINESS_HOURS = {
+    "lunch": ("11:00", "14:00"),
+    "dinner": ("17:30", "19:30"),
+    "open": ("11:00", "19:30")
+}
+
+# Customers are kept sorted by store and "開始日時", so that date ranges can be found by binary search.
+# Items refer to their checkouts by the row position in customers, and are grouped in the same order.
+# The type is fixed (not downcast) so that the positions do not overflow when appending.
+ROW_DTYPE = "int32"
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+#-------------Payment methods-------------
+
+def get_flag_dtype(n_methods: int) -> str:
+    """
+    Return the narrowest unsigned integer type that can hold `n_methods` bit flags.
+    """
+    for dtype in ["uint8", "uint16", "uint32", "uint64"]:
+        if n_methods <= np.dtype(dtype).itemsize * 8:
+            return dtype
+    raise ValueError(f"Too many payment methods: {n_methods}")
+
+
+def pack_payment_methods(df_onehot: pd.DataFrame, payment_methods: list[str]) -> pd.Series:
+    """
+    Pack one-hot columns of payment methods into a single column of bit flags.\\
+    The i-th bit corresponds to `payment_methods[i]`. Methods not in `df_onehot` are regarded as unused.
+    """
+    dtype = get_flag_dtype(len(payment_methods))
+    flags = np.zeros(len(df_onehot), dtype=dtype)
+    for i, pm in enumerate(payment_methods):
+        if pm in df_onehot.columns:
+            flags |= (df_onehot[pm].to_numpy() > 0).astype(dtype) << np.array(i, dtype=dtype)
+    return pd.Series(flags, index=df_onehot.index, name="支払い方法")
+
+
+#--------------Time columns--------------
+
+def get_time_columns(start: pd.Series) -> dict[str, np.ndarray]:
+    """
+    Return the columns in `TIME_COLUMNS` derived from a Series of "開始日時".
+    """
+    ns_per_day = 24 * 60 * 60 * 10**9
+    days, time_of_day = np.divmod(start.to_numpy(dtype="datetime64[ns]").astype("int64"), ns_per_day)
+    hours = np.zeros(len(start), dtype="uint8")
+    for i, (start_time, end_time) in enumerate(BUSINESS_HOURS.values()):
+        lower = pd.Timedelta(f"{start_time}:00").value
+        upper = pd.Timedelta(f"{end_time}:00").value
+        hours |= ((lower <= time_of_day) & (time_of_day <= upper)).astype("uint8") << np.uint8(i)
+    return {
+        "日付番号": days.astype("int32"),
+        "分": (time_of_day // (60 * 10**9)).astype("int16"),
+        # 1970-01-01 is Thursday
+        "曜日": ((days + 3) % 7).astype("int8"),
+        "時間帯": hours
+    }
+
+
+#--------------Compact tables--------------
+
+def downcast_integers(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    """
+    Downcast integer columns to the narrowest signed integer type.
+    """
+    return df.assign(**{col: pd.to_numeric(df[col], downcast="integer") for col in cols})
+
+
+def compact_pos_tables(df_cus: pd.DataFrame, df_itm: pd.DataFrame, payment_methods: list[str] | None = None) -> tuple[pd.DataFrame, pd.DataFrame, list[str]]:
+    """
+    Convert DataFrames of customers and items returned by `merge_pos_tables()` into a compact schema,
+    and return them with the list of payment methods.\\
+    Low-cardinality text columns become categoricals, integers are downcast,
+    and one-hot columns of payment methods are packed into bit flags in the column "支払い方法".
+    The columns in `TIME_COLUMNS` are added to customers, and the tables are sorted by `sort_pos_tables()`.\\
+    When `payment_methods` is given (ex. when appending), the existing order is kept and new methods are added to the end,
+    so the bit flags of the existing data remain valid.
+    """
+    pms_onehot = [col for col in df_cus.columns if col not in CUSTOMER_COLUMNS]
+    payment_methods = list(payment_methods or [])
+    payment_methods += sorted(set(pms_onehot) - set(payment_methods))
+    flags = pack_payment_methods(df_cus[pms_onehot], payment_methods)
+    df_cus = df_cus[CUSTOMER_COLUMNS].assign(支払い方法=flags, **get_time_columns(df_cus["開始日時"]))
+    df_cus = df_cus.astype({col: "category" for col in CATEGORICAL_COLUMNS["customers"]})
+    df_cus = downcast_integers(df_cus, INTEGER_COLUMNS["customers"])
+    df_itm = df_itm.astype({"会計行": ROW_DTYPE} | {col: "category" for col in CATEGORICAL_COLUMNS["items"]})
+    df_itm = downcast_integers(df_itm, INTEGER_COLUMNS["items"])
+    df_cus, df_itm = sort_pos_tables(df_cus, df_itm)
+    return df_cus, df_itm, payment_methods
+
+
+def sort_pos_tables(df_cus: pd.DataFrame, df_itm: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Sort compact DataFrames of customers by store and "開始日時", and reorder items in the same order.\\
+    "会計行" of items is renumbered. The original order is kept for checkouts with the same store and time,
+    and for items of the same checkout. Nothing is copied if the customers are already sorted.
+    """
+    order = np.lexsort((df_cus["開始日時"].to_numpy(), df_cus["アカウント名"].cat.codes.to_numpy()))
+    if (order == np.arange(len(order))).all():
+        return df_cus, df_itm
+    new_pos = np.empty_like(order)
+    new_pos[order] = np.arange(len(order))
+    rows = new_pos[df_itm["会計行"].to_numpy()]
+    item_order = np.argsort(rows, kind="stable")
+    df_cus = df_cus.take(order).reset_index(drop=True)
+    df_itm = df_itm.take(item_order).assign(会計行=rows[item_order].astype(ROW_DTYPE)).reset_index(drop=True)
+    return df_cus, df_itm
+
+
+def concat_categorical(dfs: list[pd.DataFrame], cols: list[str]) -> pd.DataFrame:
+    """
+    Concatenate DataFrames while keeping categorical columns as categoricals.\\
+    The categories of the first DataFrame are kept in order and the new ones are added to the end.
+    """
+    dfs = list(dfs)
+    for col in cols:
+        categories = pd.Index(dfs[0][col].cat.categories)
+        for df in dfs[1:]:
+            categories = categories.append(df[col].cat.categories.difference(categories))
+        dfs = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in dfs]
+    return pd.concat(dfs, axis="index", ignore_index=True)
+
+
+def search_sorted_rows(codes: np.ndarray, times: np.ndarray, codes_new: np.ndarray, times_new: np.ndarray) -> np.ndarray:
+    """
+    Return the positions to insert new rows into existing rows, both sorted by store codes and times.\\
+    New rows are placed after the existing rows with the same store and time, as a stable sort of the concatenation.
+    """
+    positions = np.empty(len(codes_new), dtype="int64")
+    for code in np.unique(codes_new):
+        # The keys must have the same type as the array, otherwise the whole array is converted
+        key = np.array(code, dtype=codes.dtype)
+        start, stop = np.searchsorted(codes, key, side="left"), np.searchsorted(codes, key, side="right")
+        start_new, stop_new = np.searchsorted(codes_new, key, side="left"), np.searchsorted(codes_new, key, side="right")
+        positions[start_new:stop_new] = start + np.searchsorted(times[start:stop], times_new[start_new:stop_new], side="right")
+    return positions
+
+
+def merge_order(n_rows: int, order_new: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """
+    Return the indexer which merges `n_rows` sorted rows and new rows.\\
+    `order_new` is the indexer of the new rows in sorted order, and `positions` are the insert positions
+    of them returned by `np.searchsorted()` on the sorted rows.
+    """
+    is_new = np.zeros(n_rows + len(order_new), dtype=bool)
+    is_new[positions + np.arange(len(positions))] = True
+    order = np.empty(len(is_new), dtype="int64")
+    order[is_new] = order_new
+    order[~is_new] = np.arange(n_rows)
+    return order
+
+
+def concat_pos_tables(df_cus: pd.DataFrame, df_itm: pd.DataFrame, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Append compact DataFrames of new customers and items to the existing ones.\\
+    The new DataFrames must be compacted with the payment methods of the existing ones,
+    so that the bit flags have the same meaning.\\
+    Both must be sorted by `sort_pos_tables()`. Only the new rows are sorted here, and they are merged into
+    the existing rows at the positions found by binary search per store, so the cost of sorting does not grow with the history.
+    The result is the same as sorting the concatenated tables by `sort_pos_tables()`.
+    """
+    n_cus, n_itm = len(df_cus), len(df_itm)
+    df_itm_new = df_itm_new.assign(会計行=(df_itm_new["会計行"] + n_cus).astype(ROW_DTYPE))
+    df_cus = concat_categorical([df_cus, df_cus_new], CATEGORICAL_COLUMNS["customers"])
+    df_itm = concat_categorical([df_itm, df_itm_new], CATEGORICAL_COLUMNS["items"])
+
+    # New stores are added to the end of the categories, so the new customers may have to be sorted again by the codes.
+    # They are already sorted by time within each store, so a stable sort of the codes is enough.
+    codes = df_cus["アカウント名"].cat.codes.to_numpy()
+    times = df_cus["開始日時"].to_numpy()
+    order_new = n_cus + np.argsort(codes[n_cus:], kind="stable")
+    positions = search_sorted_rows(codes[:n_cus], times[:n_cus], codes[order_new], times[order_new])
+    order = merge_order(n_cus, order_new, positions)
+    if (order[n_cus:] == np.arange(n_cus, len(order))).all():
+        return df_cus, df_itm
+    new_pos = np.empty_like(order)
+    new_pos[order] = np.arange(len(order))
+
+    # Items of the existing customers stay in order, so only the new items are sorted and merged
+    rows = new_pos[df_itm["会計行"].to_numpy()]
+    item_order_new = n_itm + np.argsort(rows[n_itm:], kind="stable")
+    item_order = merge_order(n_itm, item_order_new, np.searchsorted(rows[:n_itm], rows[item_order_new]))
+    df_cus = df_cus.take(order).reset_index(drop=True)
+    df_itm = df_itm.take(item_order).assign(会計行=rows[item_order].astype(ROW_DTYPE)).reset_index(drop=True)
+    return df_cus, df_itm
+
+
+#-------------Normalized items-------------
+
+def select_items(df_itm: pd.DataFrame, is_selected: np.ndarray) -> pd.DataFrame:
+    """
+    Return items whose checkouts are selected by the boolean array `is_selected` over the rows of customers.
+    """
+    return df_itm[is_selected[df_itm["会計行"].to_numpy()]]
+
+
+def take_customers(df_cus: pd.DataFrame, df_itm: pd.DataFrame, is_selected: np.ndarray) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Return the customers selected by the boolean array `is_selected` and their items.\\
+    "会計行" of the items is renumbered to refer to the rows of the selected customers.
+    """
+    new_pos = np.cumsum(is_selected) - 1
+    df_itm = select_items(df_itm, is_selected)
+    df_itm = df_itm.assign(会計行=new_pos[df_itm["会計行"].to_numpy()].astype(df_itm["会計行"].dtype))
+    return df_cus[is_selected].reset_index(drop=True), df_itm.reset_index(drop=True)
+
+
+#--------------Memory report--------------
+
+def get_memory_report(tables: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Return a DataFrame of the number of rows and the memory usage in bytes of each table.
+    """
+    return pd.DataFrame(
+        {
+            "行数": [len(df) for df in tables.values()],
+            "メモリ使用量（バイト）": [int(df.memory_usage(index=True, deep=True).sum()) for df in tables.values()]
+        },
+        index=pd.Index(list(tables), name="テーブル")
+    )
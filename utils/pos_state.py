@@ -0,0 +1,171 @@
+import uuid
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.pos_schema import compact_pos_tables, concat_pos_tables, take_customers
+from utils.pos_filters import get_store_ranges
+from utils.customer_tensor import build_customer_tensor, update_customer_tensor
+from utils.item_matrix import build_item_matrices, update_item_matrices
+from utils.daily_cube import build_daily_cube, update_daily_cube
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# These functions are shared by the upload page and the watched folder (`utils.watch_folder`),
+# which updates the POS data of every session without the upload page.
+
+
+#-------------IDs of checkouts-------------
+
+# "会計ID" of the checkouts already added is kept as a sorted array of fixed-width strings, not a set of Python strings.
+# It is built once where the data is committed and shared by the sessions (ex. all sessions following the watched folder),
+# and new checkouts are found by binary search when appending.
+
+def build_id_index(df_cus: pd.DataFrame) -> np.ndarray:
+    """
+    Return the sorted array of "会計ID" of customers.
+    """
+    return np.sort(df_cus["会計ID"].to_numpy().astype(str))
+
+
+def is_new_id(ids: np.ndarray, values: pd.Series) -> np.ndarray:
+    """
+    Return a boolean array indicating whether each of `values` is not in the sorted array `ids`.
+    """
+    values = values.to_numpy().astype(str)
+    positions = np.searchsorted(ids, values)
+    is_found = np.zeros(len(values), dtype=bool)
+    in_range = positions < len(ids)
+    is_found[in_range] = ids[positions[in_range]] == values[in_range]
+    return ~is_found
+
+
+def merge_id_index(ids: np.ndarray, df_cus_new: pd.DataFrame) -> np.ndarray:
+    """
+    Return a new sorted array of "会計ID" with the new customers added. The given array is not modified.
+    """
+    new_ids = build_id_index(df_cus_new)
+    # Widen the strings first, otherwise longer IDs are truncated to the width of `ids`
+    ids = ids.astype(np.promote_types(ids.dtype, new_ids.dtype), copy=False)
+    return np.insert(ids, np.searchsorted(ids, new_ids), new_ids)
+
+
+#-------------Shared dataset-------------
+
+# The compact tables and everything aggregated from them are kept together in a dataset (a dictionary).
+# A dataset is built once where the data is committed (the background job of the upload page or the watcher thread),
+# and sessions keep references to it, so nothing is aggregated again in the script thread or for every session.
+# When data is appended, only the new data is aggregated and a new dataset is returned.
+# Datasets may be shared by sessions and threads, so they are never modified.
+
+def build_pos_dataset(df_cus: pd.DataFrame, df_itm: pd.DataFrame, payment_methods: list[str]) -> dict:
+    """
+    Return a dataset of compact customers and items with all the aggregated data.\\
+    `payment_methods` is the list of payment methods corresponding to the bit flags in "支払い方法" of `df_cus`.
+    """
+    return {
+        "df_customers": df_cus,
+        "df_items": df_itm,
+        "payment_methods": payment_methods,
+        # The number of customers for the charts of customers
+        "customer_tensor": build_customer_tensor(df_cus),
+        # Sales of items for the chart of sales by item
+        "item_matrices": build_item_matrices(df_cus, df_itm),
+        # Sales by department and users of payment methods by day
+        "daily_cube": build_daily_cube(df_cus, df_itm, payment_methods),
+        # "会計ID" to skip already added checkouts in the append mode
+        "ids": build_id_index(df_cus)
+    }
+
+
+def append_pos_dataset(dataset: dict, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame) -> dict:
+    """
+    Return a new dataset with DataFrames of customers and items returned by `merge_pos_tables()` appended.\\
+    Checkouts whose "会計ID" already exists in the dataset are dropped.
+    Only the new data is aggregated, so the time mostly depends on the size of the new data, not the whole history.
+    The given dataset is not modified.
+    """
+    # Drop checkouts which have already been added
+    is_new = is_new_id(dataset["ids"], df_cus_new["会計ID"])
+    df_cus_new, df_itm_new = take_customers(df_cus_new, df_itm_new, is_new)
+    # Keep the bit flags of payment methods consistent with the existing data
+    df_cus_new, df_itm_new, payment_methods = compact_pos_tables(df_cus_new, df_itm_new, dataset["payment_methods"])
+    df_cus, df_itm = concat_pos_tables(dataset["df_customers"], dataset["df_items"], df_cus_new, df_itm_new)
+    return {
+        "df_customers": df_cus,
+        "df_items": df_itm,
+        "payment_methods": payment_methods,
+        "customer_tensor": update_customer_tensor(dataset["customer_tensor"], df_cus_new),
+        "item_matrices": update_item_matrices(dataset["item_matrices"], df_cus_new, df_itm_new),
+        "daily_cube": update_daily_cube(dataset["daily_cube"], df_cus_new, df_itm_new, payment_methods),
+        "ids": merge_id_index(dataset["ids"], df_cus_new)
+    }
+
+
+#-------------Session states-------------
+
+def set_session_state_pos(dataset: dict, append: bool = False, version: str | None = None) -> None:
+    """
+    Set the session states related with POS data to a dataset returned by `build_pos_dataset()` or `append_pos_dataset()`.\\
+    The session keeps references to the dataset, so nothing is copied or aggregated here.\\
+    When `append` is `True`, the loaded zip files are added to the ones already added instead of replacing them.\\
+    `version` identifies the data in the cache of queries (see `utils.pos_queries`). A new one is generated if not given.
+    """
+    st.session_state["pos_dataset"] = dataset
+    # main DataFrames
+    st.session_state["df_customers"] = dataset["df_customers"]
+    st.session_state["df_items"] = dataset["df_items"]
+    st.session_state["payment_methods"] = dataset["payment_methods"]
+    st.session_state["pos_version"] = version or uuid.uuid4().hex
+    # Aggregated data for the pages
+    st.session_state["customer_tensor"] = dataset["customer_tensor"]
+    st.session_state["item_matrices"] = dataset["item_matrices"]
+    st.session_state["daily_cube"] = dataset["daily_cube"]
+
+    # This session state is used to skip already added zip files in the append mode
+    if not append:
+        st.session_state["pos_archive_keys"] = set(st.session_state.get("pos_loaded_keys", []))
+    else:
+        st.session_state["pos_archive_keys"].update(st.session_state.get("pos_loaded_keys", []))
+
+    # These session states are used to show information about the uploaded POS data.
+    # Customers are sorted by store and "開始日時", so the first and last rows of each store are its range.
+    df_cus = dataset["df_customers"]
+    for store, prefix in [("西食堂", "west"), ("東カフェテリア", "east")]:
+        ranges = get_store_ranges(df_cus, store)
+        if ranges:
+            date_min = df_cus["開始日時"].iat[ranges[0][0]]
+            date_max = df_cus["開始日時"].iat[ranges[0][1] - 1]
+        else:
+            date_min = date_max = pd.NaT
+        st.session_state[f"{prefix}_date_min"] = date_min
+        st.session_state[f"{prefix}_date_max"] = date_max
+        st.session_state[f"{prefix}_pos"] = bool(pd.notna(date_min))
+
+    if st.session_state["west_pos"]:
+        if st.session_state["east_pos"]:
+            st.session_state["min_date"] = min(
+                st.session_state["west_date_min"], 
+                st.session_state["east_date_min"]
+            )
+            st.session_state["max_date"] = max(
+                st.session_state["west_date_max"], 
+                st.session_state["east_date_max"]
+            )
+        else:
+            st.session_state["min_date"] = st.session_state["west_date_min"]
+            st.session_state["max_date"] = st.session_state["west_date_max"]
+    else:
+        if st.session_state["east_pos"]:
+            st.session_state["min_date"] = st.session_state["east_date_min"]
+            st.session_state["max_date"] = st.session_state["east_date_max"]
+
+
+def append_session_state_pos(df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame) -> None:
+    """
+    Append DataFrames of customers and items returned by `merge_pos_tables()` to the dataset of the session.\\
+    Only the new data is aggregated (see `append_pos_dataset()`).
+    """
+    set_session_state_pos(append_pos_dataset(st.session_state["pos_dataset"], df_cus_new, df_itm_new), append=True)
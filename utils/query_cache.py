@@ -0,0 +1,186 @@
+import os
+import sys
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+import streamlit as st
+from plotly.basedatatypes import BaseFigure
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Upper limit of the memory used by the results of queries, shared by all sessions
+QUERY_CACHE_MB = float(os.environ.get("POSCOPE_QUERY_CACHE_MB", 128))
+
+# Upper limit of the memory used by the figures of charts, shared by all sessions
+FIGURE_CACHE_MB = float(os.environ.get("POSCOPE_FIGURE_CACHE_MB", 64))
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# `@st.cache_data` hashes every argument on every call, which is as slow as the query itself for DataFrames,
+# and it has no limit on memory. Queries are therefore memoized in a single LRU cache shared by all sessions,
+# keyed by the name of the query and its arguments.
+# As in `@st.cache_data`, arguments whose names start with an underscore (ex. `_tensor`) are not part of the key,
+# so the data is passed with such arguments together with the version of the dataset it belongs to.
+# The least recently used results are evicted when the total size exceeds `QUERY_CACHE_MB`.
+# Results are copied when returned, so callers can modify them without breaking the cache.
+# Figures of charts are kept in another cache of the same kind (see `get_cached_figure()`), so they do not evict queries.
+
+
+def create_cache(limit_mb: float) -> dict:
+    """
+    Return an empty LRU cache whose entries use up to `limit_mb` megabytes.
+    """
+    return {
+        "entries": OrderedDict(),
+        "nbytes": 0,
+        "limit": limit_mb * 1024**2,
+        "hits": 0,
+        "misses": 0,
+        "lock": threading.Lock()
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache() -> dict:
+    """
+    Return the cache of query results shared by all sessions.
+    """
+    return create_cache(QUERY_CACHE_MB)
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache() -> dict:
+    """
+    Return the cache of figures shared by all sessions.
+    """
+    return create_cache(FIGURE_CACHE_MB)
+
+
+def get_nbytes(value: Any) -> int:
+    """
+    Return the approximate memory usage of a query result in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, BaseFigure):
+        # Size of the spec sent to the browser, which is dominated by the arrays of the traces
+        return len(pio.to_json(value, validate=False))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def copy_result(value: Any) -> Any:
+    """
+    Return a copy of a query result which can be modified by the caller.
+    """
+    if isinstance(value, pd.DataFrame):
+        # With copy-on-write, a shallow copy is enough (see `utils.session_data`)
+        return value.copy(deep=not pd.get_option("mode.copy_on_write"))
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, list):
+        return [copy_result(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(copy_result(v) for v in value)
+    return value
+
+
+def get_cached_entry(cache: dict, key: tuple) -> tuple | None:
+    """
+    Return the entry (value, size) of `key` and mark it as the most recently used, or None if it is not stored.
+    """
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is not None:
+            cache["entries"].move_to_end(key)
+            cache["hits"] += 1
+        else:
+            cache["misses"] += 1
+    return entry
+
+
+def put_query_result(cache: dict, key: tuple, value: Any) -> None:
+    """
+    Store a query result and evict the least recently used ones beyond the limit of the cache.\\
+    A result larger than the limit itself is not stored.
+    """
+    nbytes = get_nbytes(value)
+    if nbytes > cache["limit"]:
+        return
+    with cache["lock"]:
+        if key in cache["entries"]:
+            return
+        cache["entries"][key] = (value, nbytes)
+        cache["nbytes"] += nbytes
+        while cache["nbytes"] > cache["limit"]:
+            _, (_, size) = cache["entries"].popitem(last=False)
+            cache["nbytes"] -= size
+
+
+def cache_query(func: Callable) -> Callable:
+    """
+    Decorator memoizing a query in the shared LRU cache.\\
+    Arguments whose names start with an underscore are excluded from the key. The others must be hashable.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__module__, func.__qualname__) + tuple(
+            (name, value) for name, value in bound.arguments.items() if not name.startswith("_")
+        )
+        cache = get_query_cache()
+        entry = get_cached_entry(cache, key)
+        if entry is not None:
+            return copy_result(entry[0])
+        # The query runs outside the lock, so queries can call other cached queries
+        value = func(*args, **kwargs)
+        put_query_result(cache, key, value)
+        return copy_result(value)
+
+    return wrapper
+
+
+def get_cached_figure(key: tuple, build: Callable[[], Any]) -> Any:
+    """
+    Return the figure of `key` from the cache of figures, or build it with `build()` and store it.\\
+    `key` identifies the chart and everything the figure depends on: the versions of the data and the options.
+    The figure is shared, so it must not be modified after it is returned. `st.plotly_chart()` does not modify it.
+    Streamlit validates a dict spec by building a figure again, so the figure itself is stored instead of its spec.
+    """
+    cache = get_figure_cache()
+    entry = get_cached_entry(cache, key)
+    if entry is not None:
+        return entry[0]
+    figure = build()
+    put_query_result(cache, key, figure)
+    return figure
+
+
+def get_query_stats(cache: dict | None = None) -> dict:
+    """
+    Return the number of hits and misses, the number of stored results, and their size in bytes.\\
+    `cache` is the cache of queries if not given.
+    """
+    if cache is None:
+        cache = get_query_cache()
+    with cache["lock"]:
+        return {
+            "hits": cache["hits"],
+            "misses": cache["misses"],
+            "entries": len(cache["entries"]),
+            "nbytes": cache["nbytes"]
+        }
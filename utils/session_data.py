@@ -0,0 +1,21 @@
+import pandas as pd
+import streamlit as st
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# The datasets committed to the session state ("df_customers", "df_items", "df_calendar", "df_syllabus_west", ...)
+# are shared by all pages and reruns, and must not be modified by the pages.
+# Copy-on-write of pandas is enabled in `0_streamlit_app.py`, so a shallow copy shares the data with the session state,
+# and modifying it copies only the modified columns. Pages get the datasets with `get_dataset()` instead of `.copy()`,
+# which copied the whole dataset on every rerun.
+
+
+def get_dataset(name: str) -> pd.DataFrame:
+    """
+    Return the dataset `name` in the session state without copying the data.\\
+    The committed dataset is not changed even if the returned DataFrame is modified.
+    Without copy-on-write (ex. when a page is run alone), the dataset is copied as before.
+    """
+    df: pd.DataFrame = st.session_state[name]
+    return df.copy(deep=not pd.get_option("mode.copy_on_write"))
@@ -0,0 +1,199 @@
+import os
+import time
+import uuid
+import threading
+
+import pandas as pd
+import streamlit as st
+from watchdog.events import PatternMatchingEventHandler
+from watchdog.observers import Observer
+
+from utils.ingest_cache import load_zip_files_cached, hash_file
+from utils.pos_loader import concat_chunks
+from utils.pos_cleaning import merge_pos_tables
+from utils.pos_schema import compact_pos_tables
+from utils.pos_state import build_pos_dataset, append_pos_dataset, set_session_state_pos
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Local folder watched for zip files exported from Ubiregi.
+# The watched folder is disabled when this is not set.
+WATCH_DIR = os.environ.get("POSCOPE_WATCH_DIR")
+
+# A zip file is loaded only after it has not been modified for this number of seconds,
+# so that files being copied into the folder are not loaded halfway.
+WATCH_SETTLE_SECONDS = float(os.environ.get("POSCOPE_WATCH_SETTLE_SECONDS", 2))
+# The folder is also rescanned at this interval in case file system events are missed (ex. network drives)
+WATCH_RESCAN_SECONDS = float(os.environ.get("POSCOPE_WATCH_RESCAN_SECONDS", 60))
+# Interval in seconds at which each session checks whether the data has been updated
+WATCH_POLL_SECONDS = float(os.environ.get("POSCOPE_WATCH_POLL_SECONDS", 5))
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# A single watcher is shared by all sessions of the server (`st.cache_resource`).
+# It loads new zip files and aggregates them in a background thread, and replaces the shared dataset with a new one.
+# Every session refers to the dataset from its session state when the version has changed, without copying it.
+# New zip files are appended like the append mode of the upload page:
+# zip files with the same content and checkouts which have already been added are skipped,
+# and removing a file from the folder does not remove its data.
+
+
+#-------------Shared dataset-------------
+
+def get_empty_dataset() -> dict:
+    """
+    Return an empty dataset of the watched folder.
+    """
+    return {
+        "version": 0,
+        "id": None,
+        "df_customers": None,
+        "keys": set(),
+        "updated": None
+    }
+
+
+def update_watched_dataset(dataset: dict, df_cus_new: pd.DataFrame, df_itm_new: pd.DataFrame, keys: list[str]) -> dict:
+    """
+    Return a new dataset with DataFrames of customers and items returned by `merge_pos_tables()` appended.\\
+    The dataset of the watched folder is a dataset of `utils.pos_state` with the version, the hashes of the loaded zip files,
+    and the time of the update. The data is aggregated here in the watcher thread, not in the sessions.
+    The given dataset is not modified.
+    """
+    if dataset["df_customers"] is None:
+        pos_dataset = build_pos_dataset(*compact_pos_tables(df_cus_new, df_itm_new))
+    else:
+        pos_dataset = append_pos_dataset(dataset, df_cus_new, df_itm_new)
+    return pos_dataset | {
+        "version": dataset["version"] + 1,
+        # Identifies the data across restarts of the watcher, unlike "version"
+        "id": uuid.uuid4().hex,
+        "keys": dataset["keys"] | set(keys),
+        "updated": time.time()
+    }
+
+
+#-------------Watcher-------------
+
+def scan_watched_folder(state: dict) -> None:
+    """
+    Load zip files in the watched folder which are new or modified since the last scan, and update the shared dataset.\\
+    Zip files which fail to load are skipped and the error is kept in the state.
+    """
+    files = {}
+    for entry in os.scandir(state["path"]):
+        if entry.is_file() and entry.name.lower().endswith(".zip"):
+            stat = entry.stat()
+            files[entry.path] = (stat.st_size, stat.st_mtime)
+    new = [path for path in sorted(files) if state["files"].get(path) != files[path]]
+    # Files still being written are left for the next scan
+    ready = [path for path in new if time.time() - files[path][1] >= WATCH_SETTLE_SECONDS]
+    if len(ready) < len(new):
+        state["wakeup"].set()
+    if not ready:
+        return
+
+    dataset = state["dataset"]
+    tables = []
+    keys = []
+    for path in ready:
+        try:
+            with open(path, "rb") as f:
+                key = hash_file(f)
+                if key not in dataset["keys"] and key not in keys:
+                    df_checkouts, df_items, df_payments, _ = load_zip_files_cached([f], keys=[key])
+                    tables.append((df_checkouts, df_items, df_payments))
+                    keys.append(key)
+        except Exception as e:
+            state["errors"][path] = repr(e)
+        else:
+            state["errors"].pop(path, None)
+        state["files"][path] = files[path]
+
+    tables = [t for t in tables if not t[0].empty]
+    if not tables:
+        return
+    df_cus, df_itm = merge_pos_tables(*(concat_chunks([t[n] for t in tables]) for n in range(3)))
+    if not df_cus.empty:
+        state["dataset"] = update_watched_dataset(dataset, df_cus, df_itm, keys)
+
+
+def run_watcher(state: dict) -> None:
+    """
+    Scan the watched folder whenever a file system event arrives or `WATCH_RESCAN_SECONDS` have passed.\\
+    Events usually come in bursts while a file is copied, so the scan waits for `WATCH_SETTLE_SECONDS` first.
+    """
+    while True:
+        state["wakeup"].wait(timeout=WATCH_RESCAN_SECONDS)
+        state["wakeup"].clear()
+        time.sleep(WATCH_SETTLE_SECONDS)
+        try:
+            scan_watched_folder(state)
+        except Exception as e:
+            state["errors"][state["path"]] = repr(e)
+
+
+@st.cache_resource(show_spinner=False)
+def get_watched_folder(path: str) -> dict:
+    """
+    Start watching the folder and return the state shared by all sessions.\\
+    The state contains the current dataset, the files already scanned, and the errors by file.
+    """
+    state = {
+        "path": path,
+        "dataset": get_empty_dataset(),
+        "files": {},
+        "errors": {},
+        "wakeup": threading.Event()
+    }
+    os.makedirs(path, exist_ok=True)
+    handler = PatternMatchingEventHandler(patterns=["*.zip", "*.ZIP"], ignore_directories=True)
+    handler.on_any_event = lambda event: state["wakeup"].set()
+    observer = Observer()
+    observer.schedule(handler, path, recursive=False)
+    observer.daemon = True
+    observer.start()
+    threading.Thread(target=run_watcher, args=(state,), name="watch-folder", daemon=True).start()
+    # Load the zip files already in the folder
+    state["wakeup"].set()
+    return state
+
+
+#-------------Sessions-------------
+
+def sync_watched_folder() -> None:
+    """
+    Set the dataset of the watched folder to the session state if it has been updated.\\
+    This function is called at the beginning of every script run.
+    Sessions which have chosen their own uploaded data (`watch_follow` is `False`) are not updated.
+    """
+    if WATCH_DIR is None or not st.session_state.get("watch_follow", True):
+        return
+    dataset = get_watched_folder(WATCH_DIR)["dataset"]
+    if dataset["df_customers"] is None or st.session_state.get("watch_version") == dataset["version"]:
+        return
+    st.session_state["pos_loaded_keys"] = list(dataset["keys"])
+    set_session_state_pos(dataset, version=dataset["id"])
+    st.session_state["watch_version"] = dataset["version"]
+
+
+@st.fragment(run_every=WATCH_POLL_SECONDS)
+def poll_watched_folder() -> None:
+    """
+    Show the status of the watched folder and rerun the app when the dataset has been updated,
+    so the new data reaches the pages within `WATCH_POLL_SECONDS`.
+    """
+    state = get_watched_folder(WATCH_DIR)
+    dataset = state["dataset"]
+    if st.session_state.get("watch_follow", True) and dataset["df_customers"] is not None \
+            and st.session_state.get("watch_version") != dataset["version"]:
+        st.rerun()
+    if dataset["updated"] is None:
+        st.caption(":material/folder_eye: 監視フォルダ：データはありません。")
+    else:
+        updated = time.strftime("%H:%M:%S", time.localtime(dataset["updated"]))
+        st.caption(f":material/folder_eye: 監視フォルダ：{len(dataset['keys'])}ファイル（最終更新 {updated}）")
+    if state["errors"]:
+        st.caption(f":material/error: 読み込めなかったファイル：{len(state['errors'])}件")
@@ -0,0 +1,93 @@
+import re
+from typing import IO
+
+import pandas as pd
+
+from utils.ingest_cache import hash_file, cache_get, cache_put
+
+
+#-----------------------------------------Settings-----------------------------------------
+
+# Sheets of the syllabus workbook and the labels of their columns (ex. "2024SPR").
+# The first two columns are the row labels (曜日, 時限).
+SYLLABUS_SHEETS = ["west", "east"]
+SYLLABUS_TERM = re.compile(r"\d{4}(SPR|SMR|AUT|WTR)")
+
+# Columns allowed in the calendar workbook
+CALENDAR_COLUMNS = ["date", "academic_year", "term", "class", "info"]
+
+
+#-----------------------------------------Functions-----------------------------------------
+
+# openpyxl parses the whole workbook every time `pd.read_excel()` is called,
+# so each workbook is opened once with `pd.ExcelFile` and all sheets are parsed from it.
+# The header row is checked before parsing the rest of the sheet, so wrong files fail fast.
+# Parsed tables are cached as Parquet files by the hash of the workbook (see `utils.ingest_cache`),
+# so uploading the same workbook again does not parse it at all.
+
+
+def read_header(xls: pd.ExcelFile, sheet_name: str | int) -> list:
+    """
+    Return the labels of the header row of the sheet without parsing the other rows.
+    """
+    return list(xls.parse(sheet_name, nrows=0).columns)
+
+
+def cache_tables(key: str, dfs: tuple[pd.DataFrame, ...], tables: list[str]) -> None:
+    """
+    Store the parsed tables in the cache.\\
+    Columns mixing numbers and strings cannot be stored as Parquet files, and such workbooks are just not cached.
+    """
+    try:
+        cache_put(key, dfs, tables)
+    except (TypeError, ValueError):
+        pass
+
+
+#--------------syllabus--------------
+
+def is_syllabus_header(header: list) -> bool:
+    """
+    Return `True` if the header row has the row labels and the labels of terms.
+    """
+    return len(header) > 2 and all(isinstance(col, str) and SYLLABUS_TERM.fullmatch(col) for col in header[2:])
+
+
+def read_syllabus_workbook(f: IO[bytes]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Read the xlsx file of syllabus data and return DataFrames of the west and east campuses
+    indexed by the day of the week and the period.\\
+    If the file format is not correct, return empty DataFrames.
+    """
+    key = f"syllabus-{hash_file(f)}"
+    dfs = cache_get(key, SYLLABUS_SHEETS)
+    if dfs is None:
+        with pd.ExcelFile(f) as xls:
+            if not all(sheet in xls.sheet_names for sheet in SYLLABUS_SHEETS) \
+                    or not all(is_syllabus_header(read_header(xls, sheet)) for sheet in SYLLABUS_SHEETS):
+                return pd.DataFrame(), pd.DataFrame()
+            # Merged cells of the row labels are filled by parsing them as the index
+            dfs = tuple(xls.parse(sheet, index_col=[0, 1]).reset_index() for sheet in SYLLABUS_SHEETS)
+        cache_tables(key, dfs, SYLLABUS_SHEETS)
+    # The row labels are stored as columns in the cache
+    df_west, df_east = (df.set_index(list(df.columns[:2])) for df in dfs)
+    return df_west, df_east
+
+
+#--------------calendar--------------
+
+def read_calendar_workbook(f: IO[bytes]) -> pd.DataFrame:
+    """
+    Read the xlsx file of calendar data and return a DataFrame.\\
+    If the file format is not correct, return an empty DataFrame.
+    """
+    key = f"calendar-{hash_file(f)}"
+    dfs = cache_get(key, ["calendar"])
+    if dfs is not None:
+        return dfs[0]
+    with pd.ExcelFile(f) as xls:
+        if any(col not in CALENDAR_COLUMNS for col in read_header(xls, 0)):
+            return pd.DataFrame()
+        df_cal = xls.parse(0)
+    cache_tables(key, (df_cal,), ["calendar"])
+    return df_cal